@@ -0,0 +1,93 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pyglet
+from PIL import Image
+
+if not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+    pyglet.options["headless"] = True
+
+from renderer.scroll_renderer import ScrollRenderer, RotationAxis
+from renderer.audio import AudioDriver, open_source
+from renderer.ingest import FaceLayout, build_panorama
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="音声に合わせてパノラマを回転させる")
+    parser.add_argument("source", help='WAVファイル、"-" (標準入力の生PCM)、"unix:PATH" または "tcp:HOST:PORT"')
+    parser.add_argument("--art", help="アルバムアート (省略時はグラデーション)")
+    parser.add_argument("--rate", type=int, default=44100, help="生PCMのサンプルレート")
+    parser.add_argument("--channels", type=int, default=2, help="生PCMのチャンネル数")
+    parser.add_argument("--sample-width", type=int, default=2, help="生PCMの1サンプルのバイト数")
+    parser.add_argument("--hop", type=int, default=256, help="解析1回あたりのサンプル数")
+    parser.add_argument("--fft-size", type=int, default=1024)
+    parser.add_argument("--axes", nargs="+", choices=[axis.name for axis in RotationAxis], default=["Y", "X", "Z"])
+    parser.add_argument("--face-size", type=int, default=64)
+    parser.add_argument("--backend", choices=ScrollRenderer.BACKENDS, default="gl")
+    parser.add_argument("--fps", type=float, default=60.0)
+    parser.add_argument("--headless", action="store_true", help="ウィンドウを出さずに描画だけする")
+    args = parser.parse_args(argv)
+
+    face_size = args.face_size
+    if args.art:
+        with Image.open(args.art) as image:
+            layout = FaceLayout.strip() if image.width == image.height * 6 else FaceLayout.tiled()
+            panorama = build_panorama([image], layout, face_size, face_size)
+    else:
+        y, x = np.mgrid[0:face_size, 0:face_size * 6]
+        panorama = np.stack([x * 255 // (face_size * 6), y * 255 // face_size, (x ^ y) & 0xFF,
+                             np.full_like(x, 255)], axis=-1).astype(np.uint8)
+
+    headless = args.headless and args.backend == "gl"
+    renderer = ScrollRenderer(face_size, face_size, backend=args.backend, headless=headless,
+                              use_offscreen=args.headless)
+    renderer.set_panorama_texture(panorama)
+    source = open_source(args.source, args.rate, args.channels, args.sample_width)
+    driver = AudioDriver(source, hop=args.hop, fft_size=args.fft_size, axes=[RotationAxis[name] for name in args.axes])
+    driver.start()
+
+    last = [time.perf_counter()]
+
+    def update(dt=None):
+        now = time.perf_counter()
+        driver.apply(renderer, now - last[0])
+        last[0] = now
+        renderer.on_draw()
+
+    try:
+        if args.headless:
+            period = 1.0 / args.fps
+            next_time = time.perf_counter()
+            while not driver.finished:
+                update()
+                next_time += period
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        else:
+            def tick(dt):
+                if driver.finished:
+                    pyglet.app.exit()
+                    return
+                update()
+            pyglet.clock.schedule_interval(tick, 1.0 / args.fps)
+            pyglet.app.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        driver.stop()
+        latency = driver.latency_stats.summary()
+        analysis = driver.analysis_stats.summary()
+        if "mean_ms" in latency:
+            print(f"beats {driver.analyzer.beat_count}  sample->frame latency mean {latency['mean_ms']:.2f} ms  "
+                  f"p95 {latency['p95_ms']:.2f} ms  max {latency['max_ms']:.2f} ms  "
+                  f"analysis mean {analysis['mean_ms']:.3f} ms", file=sys.stderr)
+        renderer.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import argparse
+import importlib.metadata
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+from renderer.scroll_renderer import ScrollRenderer, RotationAxis
+
+FACE_SIZES = (16, 32, 64, 128, 256)
+BACKENDS = ("gl", "cpu")
+
+
+def make_panorama(face_size):
+    y, x = np.mgrid[0:face_size, 0:face_size * 6]
+    pixels = np.empty((face_size, face_size * 6, 4), dtype=np.uint8)
+    pixels[..., 0] = x * 255 // (face_size * 6)
+    pixels[..., 1] = y * 255 // face_size
+    pixels[..., 2] = (x ^ y) & 0xFF
+    pixels[..., 3] = 255
+    return pixels
+
+
+def measure(func, iterations, finish=None):
+    """func を iterations 回実行した所要時間 (ミリ秒) の統計"""
+    func()
+    if finish:
+        finish()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        if finish:
+            finish()
+        samples.append((time.perf_counter() - start) * 1e3)
+    samples = np.array(samples)
+    return {
+        "n": iterations,
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "min_ms": float(samples.min()),
+    }
+
+
+def _configure_pyglet():
+    """GLかcubeを測るときだけ pyglet を読み込む (CPUだけなら pyglet はなくてもよい)"""
+    import pyglet
+    if not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+        # show_cube のウィンドウもEGLで作る (llvmpipe などディスプレイのない環境)
+        pyglet.options["headless"] = True
+
+
+def _pyglet_version():
+    # 読み込み済みならそのバージョン、そうでなければインストールされているバージョン
+    if "pyglet" in sys.modules:
+        return sys.modules["pyglet"].version
+    try:
+        return importlib.metadata.version("pyglet")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def bench_renderer(backend, face_size, show_cube, iterations):
+    # cubeを出さないGLは pyglet のウィンドウなしで測る
+    headless = backend == "gl" and not show_cube
+    renderer = ScrollRenderer(face_size, face_size, show_cube=show_cube, use_offscreen=True,
+                              backend=backend, headless=headless)
+    finish = None
+    if backend == "gl":
+        from OpenGL.GL import glFinish
+
+        def finish():
+            renderer.window.switch_to()
+            glFinish()
+
+    panorama = make_panorama(face_size)
+    results = {}
+    results["set_panorama_texture"] = measure(lambda: renderer.set_panorama_texture(panorama), iterations, finish)
+    results["on_draw"] = measure(renderer.on_draw, iterations, finish)
+    results["get_current_panorama_frame"] = measure(renderer.get_current_panorama_frame, iterations)
+    results["get_current_panorama_array"] = measure(renderer.get_current_panorama_array, iterations)
+
+    for axis in RotationAxis:
+        step = {"deg": 0}
+
+        def rotate_loop():
+            # test_scroll_renderer.py の update() と同じ1フレーム分の処理
+            step["deg"] = (step["deg"] + 2) % 360
+            renderer.rotate(axis, -step["deg"])
+            renderer.on_draw()
+            renderer.get_current_panorama_array()
+
+        results[f"rotate_loop_{axis.name}"] = measure(rotate_loop, iterations)
+
+    renderer.cleanup()
+    return results
+
+
+def environment():
+    info = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pyglet": _pyglet_version(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    try:
+        from OpenGL.GL import glGetString, GL_RENDERER, GL_VERSION
+        from renderer.headless_context import EGLContext
+        context = EGLContext()
+        info["gl_renderer"] = glGetString(GL_RENDERER).decode()
+        info["gl_version"] = glGetString(GL_VERSION).decode()
+        context.close()
+    except Exception as e:
+        info["gl_renderer"] = f"unavailable ({e})"
+    return info
+
+
+def compare(results, baseline, tolerance):
+    """baseline より mean_ms が tolerance 以上悪化した項目を返す"""
+    previous = {(r["backend"], r["face_size"], r["show_cube"], r["op"]): r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        old = previous.get((r["backend"], r["face_size"], r["show_cube"], r["op"]))
+        if old and r["mean_ms"] > old["mean_ms"] * (1.0 + tolerance):
+            regressions.append((r, old))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ScrollRenderer のベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(FACE_SIZES))
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--cube", choices=("off", "on", "both"), default="both",
+                        help="show_cube の有無 (on はウィンドウ用のコンテキストが必要)")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    parser.add_argument("--baseline", help="比較する以前の結果のJSONファイル")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="回帰とみなす悪化率 (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    cube_options = {"off": [False], "on": [True], "both": [False, True]}[args.cube]
+    if "gl" in args.backends or args.cube != "off":
+        _configure_pyglet()
+    results = []
+    for backend in args.backends:
+        for face_size in args.sizes:
+            for show_cube in cube_options:
+                try:
+                    ops = bench_renderer(backend, face_size, show_cube, args.iterations)
+                except Exception as e:
+                    print(f"skip {backend} {face_size} show_cube={show_cube}: {e}", file=sys.stderr)
+                    continue
+                for op, stats in ops.items():
+                    results.append({"backend": backend, "face_size": face_size, "show_cube": show_cube,
+                                    "op": op, **stats})
+                    print(f"{backend:4} {face_size:4} cube={int(show_cube)} {op:30} "
+                          f"mean {stats['mean_ms']:8.3f} ms  p95 {stats['p95_ms']:8.3f} ms")
+
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for new, old in regressions:
+            print(f"REGRESSION {new['backend']} {new['face_size']} cube={int(new['show_cube'])} {new['op']}: "
+                  f"{old['mean_ms']:.3f} -> {new['mean_ms']:.3f} ms", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
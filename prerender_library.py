@@ -0,0 +1,162 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+from PIL import Image
+
+# ウィンドウを使わないツールなので、DISPLAY があってもGLはEGLで読み込む (spawn したワーカーにも引き継がれる)
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
+from renderer.scroll_renderer import ScrollRenderer, RotationAxis
+from renderer.loop_cache import LoopCache
+from renderer.ingest import FaceLayout, build_panorama
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif")
+
+
+def panorama_from_image(image, face_size, height):
+    """アルバムアートをパノラマ (6面を横に並べた画像) にする
+
+    横幅が高さの6倍ならそのままパノラマとして切り分け、それ以外 (正方形のアートなど) は
+    6面すべてに同じ画像を貼る。
+    """
+    layout = FaceLayout.strip() if image.width == image.height * 6 else FaceLayout.tiled()
+    return build_panorama([image], layout, face_size, height)
+
+
+def find_images(root):
+    paths = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(directory, name))
+    paths.sort()
+    return paths
+
+
+def _create_renderer(options):
+    return ScrollRenderer(options["face_size"], options["face_size"], backend=options["backend"],
+                          headless=options["backend"] == "gl")
+
+
+def check_backend(options):
+    """レンダラを作れるかを親プロセスで一度だけ確かめる。作れなければエラーの文字列を返す"""
+    try:
+        renderer = _create_renderer(options)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    renderer.cleanup()
+    return None
+
+
+# ワーカープロセスごとのレンダラとキャッシュ
+_worker = {}
+
+
+def _init_worker(options):
+    # ここで例外を投げると Pool がワーカーを作り直し続けるので、失敗しうるレンダラの作成は _render_track() で行う
+    if options["workers"] > 1:
+        # llvmpipe のスレッドがプロセス数と重ならないように
+        os.environ.setdefault("LP_NUM_THREADS", "1")
+    _worker["renderer"] = None
+    _worker["cache"] = LoopCache(options["cache_dir"], options["max_bytes"])
+    _worker["options"] = options
+
+
+def _render_track(path):
+    """1曲分のループを描画する。(path, 描画したループ数, 既にあったループ数, 描画したフレーム数, エラー)"""
+    options = _worker["options"]
+    cache = _worker["cache"]
+    try:
+        if _worker["renderer"] is None:
+            _worker["renderer"] = _create_renderer(options)
+        renderer = _worker["renderer"]
+        with Image.open(path) as image:
+            panorama = panorama_from_image(image, options["face_size"], options["face_size"])
+        rendered = frames = 0
+        for axis in options["axes"]:
+            misses = cache.misses
+            loop = cache.load(renderer, panorama, axis, options["step"])
+            # キャッシュから読んだ軸は frames/s に数えない
+            if cache.misses != misses:
+                rendered += 1
+                frames += len(loop)
+        return path, rendered, len(options["axes"]) - rendered, frames, None
+    except Exception as e:
+        return path, 0, 0, 0, f"{type(e).__name__}: {e}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="アルバムアートのディレクトリから回転ループをまとめて事前描画する")
+    parser.add_argument("art_dir", help="アルバムアートのディレクトリ (サブディレクトリも探す)")
+    parser.add_argument("--cache-dir", required=True, help="LoopCache のディレクトリ")
+    parser.add_argument("--face-size", type=int, default=64)
+    parser.add_argument("--axes", nargs="+", choices=[axis.name for axis in RotationAxis], default=["Y"])
+    parser.add_argument("--step", type=float, default=2, help="1フレームあたりの角度 (360を割り切れる値)")
+    parser.add_argument("--backend", choices=ScrollRenderer.BACKENDS, default="gl")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-bytes", type=float, default=float(1 << 30) * 16, help="キャッシュの上限 (バイト)")
+    parser.add_argument("--progress-interval", type=float, default=2.0, help="進捗を表示する間隔 (秒)")
+    args = parser.parse_args(argv)
+
+    paths = find_images(args.art_dir)
+    if not paths:
+        print(f"no images in {args.art_dir}", file=sys.stderr)
+        return 1
+    workers = max(1, min(args.workers, len(paths)))
+    step = int(args.step) if args.step == int(args.step) else args.step
+    options = {
+        "face_size": args.face_size,
+        "axes": [RotationAxis[name] for name in args.axes],
+        "step": step,
+        "backend": args.backend,
+        "cache_dir": args.cache_dir,
+        "max_bytes": int(args.max_bytes),
+        "workers": workers,
+    }
+    error = check_backend(options)
+    if error:
+        print(f"cannot create the {args.backend} renderer: {error}", file=sys.stderr)
+        return 2
+    print(f"{len(paths)} images, {workers} workers, backend={args.backend}, axes={','.join(args.axes)}",
+          file=sys.stderr)
+
+    done = rendered = cached = frames = 0
+    errors = []
+    start = last_report = time.perf_counter()
+    # GLのコンテキストを親から引き継がないように spawn で起動する
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=_init_worker, initargs=(options,)) as pool:
+        for path, track_rendered, track_cached, track_frames, error in pool.imap_unordered(
+                _render_track, paths, chunksize=4):
+            done += 1
+            rendered += track_rendered
+            cached += track_cached
+            frames += track_frames
+            if error:
+                errors.append((path, error))
+                print(f"error {path}: {error}", file=sys.stderr)
+            now = time.perf_counter()
+            if now - last_report >= args.progress_interval or done == len(paths):
+                last_report = now
+                elapsed = now - start
+                rate = done / elapsed
+                eta = (len(paths) - done) / rate if rate else 0.0
+                print(f"{done}/{len(paths)} tracks  {rate:.1f} tracks/s  {frames / elapsed:.0f} frames/s  "
+                      f"rendered {rendered} cached {cached} errors {len(errors)}  eta {eta:.0f}s",
+                      file=sys.stderr)
+
+    # ワーカーごとの削除は同時に走るので、最後にまとめて上限に合わせる
+    cache = LoopCache(args.cache_dir, int(args.max_bytes))
+    cache.evict()
+    stats = cache.stats()
+    print(f"done in {time.perf_counter() - start:.1f}s: {rendered} loops rendered, {cached} already cached, "
+          f"{len(errors)} errors, cache {stats['entries']} loops / {stats['bytes'] / (1 << 20):.1f} MiB",
+          file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+import os
+import sys
+
+# パッケージの読み込みは軽く保つ: OpenGL・pyglet・glm・PIL はバックエンドを作るときに初めて読み込む
+# レンダラは create_renderer(name, ...) で作る。バックエンドは register_backend() で追加できる
+
+if sys.platform.startswith("linux") and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+    # ディスプレイのない環境ではPyOpenGLをEGLで読み込む (headless=True 用)
+    # OpenGL をどのモジュールが先に読み込んでも効くように、パッケージの読み込み時に設定する
+    os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
+from .common import RotationAxis
+
+# バックエンド名 → factory(width, height, **kwargs)
+_BACKENDS = {}
+
+
+def register_backend(name, factory):
+    """バックエンドを登録する。factory は重い依存を呼ばれたときに import する関数にする"""
+    _BACKENDS[name] = factory
+
+
+def available_backends():
+    return tuple(_BACKENDS)
+
+
+def create_renderer(backend, width, height, **kwargs):
+    """登録済みのバックエンドでレンダラを作る (kwargs はレンダラのコンストラクタにそのまま渡す)"""
+    factory = _BACKENDS.get(backend)
+    if factory is None:
+        raise ValueError(f"unknown backend: {backend!r} (expected one of {available_backends()})")
+    return factory(width, height, **kwargs)
+
+
+def _scroll_renderer(**options):
+    def factory(width, height, **kwargs):
+        from .scroll_renderer import ScrollRenderer
+        return ScrollRenderer(width, height, **options, **kwargs)
+    return factory
+
+
+register_backend("gl", _scroll_renderer(backend="gl"))
+register_backend("gl-headless", _scroll_renderer(backend="gl", headless=True))
+# CPUバックエンドは NumPy だけで描画する (ScrollRenderer は GL を使うときだけ OpenGL を読み込む)
+register_backend("cpu", _scroll_renderer(backend="cpu"))
+
+# from renderer import ScrollRenderer などは参照されたときにモジュールを読み込む
+_LAZY_ATTRIBUTES = {
+    "ScrollRenderer": ".scroll_renderer",
+    "MultiCubeRenderer": ".multi_cube",
+    "LoopCache": ".loop_cache",
+    "PanoramaIngest": ".ingest",
+}
+
+
+def __getattr__(name):
+    module = _LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    return getattr(importlib.import_module(module, __name__), name)
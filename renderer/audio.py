@@ -0,0 +1,326 @@
+import math
+import socket
+import sys
+import threading
+import time
+import wave
+from collections import deque, namedtuple
+
+import numpy as np
+
+from .pipeline import StageStats
+from .common import RotationAxis
+
+# 音声のPCMを少しずつ読んでFFTで特徴量 (音量・帯域ごとのレベル・ビート) を求め、rotate() の軸・速度・角度を決める
+# 解析は別スレッドで行い、結果は不変の AudioFeatures を属性ごと差し替えて渡すので描画スレッドはロックを取らない
+# (CPython では属性への代入と参照はそれぞれ不可分)
+
+
+def _pcm_to_float(data, channels, sample_width):
+    """リトルエンディアンの符号付き整数PCM (8bitのみ符号なし) を -1〜1 のモノラル float32 にする"""
+    if sample_width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+    elif sample_width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        # 上位に詰めて int32 として読む
+        packed = np.zeros((len(raw), 4), dtype=np.uint8)
+        packed[:, 1:] = raw
+        samples = packed.view("<i4").ravel().astype(np.float32) / 2147483648.0
+    elif sample_width == 4:
+        samples = np.frombuffer(data, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"unsupported sample width: {sample_width}")
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples
+
+
+class PcmSource:
+    """ファイルオブジェクト (パイプ・ソケットなど) から生のPCMを読む"""
+
+    def __init__(self, stream, sample_rate=44100, channels=2, sample_width=2):
+        self.stream = stream
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+
+    def read(self, frames):
+        """frames サンプル分をモノラル float32 で返す。終端なら None"""
+        size = frames * self.channels * self.sample_width
+        data = self._read_bytes(size)
+        # 終端で半端に残ったバイトはフレーム単位に切り捨てる
+        data = data[:len(data) - len(data) % (self.channels * self.sample_width)]
+        if not data:
+            return None
+        return _pcm_to_float(data, self.channels, self.sample_width)
+
+    def _read_bytes(self, size):
+        # パイプやソケットは要求より短く返すことがあるので揃うまで読む
+        chunks = []
+        while size > 0:
+            chunk = self.stream.read(size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def close(self):
+        self.stream.close()
+
+
+class WavSource(PcmSource):
+    """WAVファイルを読む。realtime=True なら再生と同じ速さで返す (ストリームとして扱うため)"""
+
+    def __init__(self, path, realtime=True):
+        self.wav = wave.open(path, "rb")
+        super().__init__(None, self.wav.getframerate(), self.wav.getnchannels(), self.wav.getsampwidth())
+        self.realtime = realtime
+        self._start = None
+        self._position = 0
+
+    def _read_bytes(self, size):
+        return self.wav.readframes(size // (self.channels * self.sample_width))
+
+    def read(self, frames):
+        if self.realtime:
+            if self._start is None:
+                self._start = time.perf_counter()
+            # 読み終わる位置の時刻まで待つ
+            delay = self._start + (self._position + frames) / self.sample_rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        samples = super().read(frames)
+        if samples is not None:
+            self._position += len(samples)
+        return samples
+
+    def close(self):
+        self.wav.close()
+
+
+class SocketSource(PcmSource):
+    """ローカルソケットに接続して生のPCMを読む
+
+    address が文字列なら UNIX ドメインソケットのパス、(host, port) なら TCP。
+    """
+
+    def __init__(self, address, sample_rate=44100, channels=2, sample_width=2):
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(address)
+        super().__init__(self.socket.makefile("rb"), sample_rate, channels, sample_width)
+
+    def close(self):
+        # 別スレッドで読み込み中でも戻るように先に shutdown する
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.stream.close()
+        self.socket.close()
+
+
+def open_source(spec, sample_rate=44100, channels=2, sample_width=2, realtime=True):
+    """"-" は標準入力、"unix:PATH" と "tcp:HOST:PORT" はソケット、それ以外はWAVファイル"""
+    if spec == "-":
+        return PcmSource(sys.stdin.buffer, sample_rate, channels, sample_width)
+    if spec.startswith("unix:"):
+        return SocketSource(spec[len("unix:"):], sample_rate, channels, sample_width)
+    if spec.startswith("tcp:"):
+        host, port = spec[len("tcp:"):].rsplit(":", 1)
+        return SocketSource((host, int(port)), sample_rate, channels, sample_width)
+    return WavSource(spec, realtime)
+
+
+# time は解析したチャンクを読み終えた時刻 (perf_counter)、bands は (low, mid, high)
+# energy と bands は最近の最大値で割った 0〜1、beat はこのチャンクでビートを検出したか
+AudioFeatures = namedtuple("AudioFeatures", "seq time energy bands beat beat_count")
+
+
+class AudioAnalyzer:
+    """リングバッファの最新 fft_size サンプルに窓をかけてFFTし、特徴量を求める
+
+    帯域のレベルと音量は agc_seconds で減衰する最大値で正規化するので、入力の音量によらず 0〜1 になる。
+    ビートは低域のレベルが直前 beat_history 秒の平均の beat_threshold 倍を超えたとき
+    (min_beat_interval 秒以内の連続は1回とみなす)。
+    """
+
+    BANDS = ((20, 150), (150, 2000), (2000, 20000))
+
+    def __init__(self, sample_rate, fft_size=1024, hop=256, agc_seconds=3.0, beat_history=1.0,
+                 beat_threshold=1.4, min_beat_interval=0.15):
+        self.sample_rate = sample_rate
+        self.fft_size = fft_size
+        self.hop = hop
+        self.window = np.hanning(fft_size).astype(np.float32)
+        self.ring = np.zeros(fft_size * 2, dtype=np.float32)
+        self.ring_pos = 0
+        freqs = np.fft.rfftfreq(fft_size, 1.0 / sample_rate)
+        self.band_bins = []
+        for low, high in self.BANDS:
+            bins = np.nonzero((freqs >= low) & (freqs < high))[0]
+            if len(bins) == 0:
+                # 低域が1ビンに満たない短い窓でも一番近いビンを使う
+                bins = np.array([np.abs(freqs - (low + high) / 2).argmin()])
+            self.band_bins.append(slice(bins[0], bins[-1] + 1))
+        self.agc_decay = math.exp(-hop / (sample_rate * agc_seconds))
+        self.peaks = np.full(len(self.BANDS) + 1, 1e-4, dtype=np.float32)
+        self.low_history = deque(maxlen=max(1, int(beat_history * sample_rate / hop)))
+        self.beat_threshold = beat_threshold
+        self.min_beat_interval = min_beat_interval
+        self.beat_count = 0
+        self.seq = 0
+        self._last_beat = -math.inf
+        self._samples = 0
+        self._recent = np.zeros(1, dtype=np.float32)
+
+    def push(self, samples):
+        """新しいサンプルをリングバッファに入れる"""
+        samples = samples[-self.fft_size:]
+        n = len(samples)
+        # 同じ内容を2周分持ち、最新 fft_size サンプルを常に連続したスライスで取り出せるようにする
+        pos = self.ring_pos
+        first = min(n, self.fft_size - pos)
+        for offset in (0, self.fft_size):
+            self.ring[offset + pos:offset + pos + first] = samples[:first]
+            self.ring[offset:offset + n - first] = samples[first:]
+        self.ring_pos = (pos + n) % self.fft_size
+        self._samples += n
+        self._recent = samples
+
+    def analyze(self, arrived=None):
+        """最新のチャンクまでの特徴量を返す (arrived はチャンクを読み終えた時刻)"""
+        frame = self.ring[self.ring_pos:self.ring_pos + self.fft_size]
+        power = np.abs(np.fft.rfft(frame * self.window)) ** 2
+        levels = np.empty(len(self.BANDS) + 1, dtype=np.float32)
+        for i, bins in enumerate(self.band_bins):
+            levels[i] = math.sqrt(float(power[bins].mean()))
+        levels[-1] = math.sqrt(float(np.mean(self._recent * self._recent)))
+        self.peaks = np.maximum(levels, self.peaks * self.agc_decay)
+        normalized = levels / self.peaks
+
+        low = float(levels[0])
+        t = self._samples / self.sample_rate
+        beat = False
+        if len(self.low_history) == self.low_history.maxlen:
+            average = sum(self.low_history) / len(self.low_history)
+            if low > average * self.beat_threshold and low > self.peaks[0] * 0.1 \
+                    and t - self._last_beat >= self.min_beat_interval:
+                beat = True
+                self.beat_count += 1
+                self._last_beat = t
+        self.low_history.append(low)
+
+        self.seq += 1
+        return AudioFeatures(self.seq, time.perf_counter() if arrived is None else arrived,
+                             float(normalized[-1]), tuple(float(x) for x in normalized[:-1]),
+                             beat, self.beat_count)
+
+
+class AudioDriver:
+    """音声の特徴量で ScrollRenderer.rotate() を動かす
+
+    source (PcmSource など) の読み込みと解析は start() で起動するスレッドで hop サンプルずつ行う。
+    描画スレッドは毎フレーム apply(renderer, dt) を呼ぶ。
+        速度 (度/秒) = base_speed + energy_speed * 音量 + ビートごとに beat_kick から kick_decay 秒で減衰する加速
+    (max_speed で頭打ち)。beats_per_axis 回のビートごとに axes の次の軸に切り替える。
+    軸の切り替えは角度が1周して 0 に戻るところで行うので、描画が飛ばない。
+    latency_stats はチャンクを読み終えてからそれを反映したフレームを描くまでの時間。
+    """
+
+    def __init__(self, source, hop=256, fft_size=1024, axes=(RotationAxis.Y, RotationAxis.X, RotationAxis.Z),
+                 base_speed=30.0, energy_speed=240.0, beat_kick=180.0, kick_decay=0.25, max_speed=360.0,
+                 beats_per_axis=8):
+        self.source = source
+        self.hop = hop
+        self.analyzer = AudioAnalyzer(source.sample_rate, fft_size, hop)
+        self.axes = tuple(axes)
+        self.base_speed = base_speed
+        self.energy_speed = energy_speed
+        self.beat_kick = beat_kick
+        self.kick_decay = kick_decay
+        self.max_speed = max_speed
+        self.beats_per_axis = beats_per_axis
+        self.latency_stats = StageStats()
+        self.analysis_stats = StageStats()
+        # 解析スレッドが丸ごと差し替える (描画スレッドは参照するだけ)
+        self.features = None
+        self.finished = False
+
+        # 以下は描画スレッドだけが触る
+        self.axis_index = 0
+        self.degree = 0.0
+        self.speed = base_speed
+        self._pending_axis = False
+        self._applied_seq = 0
+        self._beat_count = 0
+        self._beats_on_axis = 0
+        self._kick_time = -math.inf
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def axis(self):
+        return self.axes[self.axis_index]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._analysis_loop, name="audio-analysis", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.source.close()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def _analysis_loop(self):
+        try:
+            while not self._stop.is_set():
+                samples = self.source.read(self.hop)
+                if samples is None:
+                    break
+                arrived = time.perf_counter()
+                self.analyzer.push(samples)
+                self.features = self.analyzer.analyze(arrived)
+                self.analysis_stats.record(arrived, time.perf_counter())
+        except (OSError, ValueError):
+            # stop() でソースを閉じると読み込み中の read() が失敗する
+            if not self._stop.is_set():
+                raise
+        finally:
+            self.finished = True
+
+    def apply(self, renderer, dt):
+        """最新の特徴量から角度を dt 秒分進めて renderer.rotate() する"""
+        features = self.features
+        now = time.perf_counter()
+        energy = 0.0
+        if features is not None:
+            energy = features.energy
+            if features.seq != self._applied_seq:
+                self._applied_seq = features.seq
+                self.latency_stats.record(features.time, now)
+            if features.beat_count != self._beat_count:
+                self._beats_on_axis += features.beat_count - self._beat_count
+                self._beat_count = features.beat_count
+                self._kick_time = features.time
+                if self._beats_on_axis >= self.beats_per_axis and len(self.axes) > 1:
+                    self._beats_on_axis = 0
+                    self._pending_axis = True
+
+        kick = self.beat_kick * math.exp(-(now - self._kick_time) / self.kick_decay)
+        self.speed = min(self.base_speed + self.energy_speed * energy + kick, self.max_speed)
+        degree = self.degree + self.speed * dt
+        if degree >= 360.0:
+            degree %= 360.0
+            if self._pending_axis:
+                self._pending_axis = False
+                self.axis_index = (self.axis_index + 1) % len(self.axes)
+        self.degree = degree
+        renderer.rotate(self.axis, degree)
+        return features
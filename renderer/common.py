@@ -0,0 +1,44 @@
+import sys
+from enum import Enum
+
+import numpy as np
+
+# GL・pyglet・PIL を読み込まずに使える共通の定義
+# エンコーダやキャッシュの読み出しなど、描画しないモジュールはここから import する
+
+
+class RotationAxis(Enum):
+    X = 0
+    Y = 1
+    Z = 2
+
+
+def _as_rgba_array(data, height, width):
+    """PIL.Image / ndarray / バッファを (H, W, 4) の uint8 配列にする (ndarrayはコピーしない)"""
+    # PIL が読み込まれていなければ data が PIL.Image のことはないので、ここでは import しない
+    image_module = sys.modules.get("PIL.Image")
+    if image_module is not None and isinstance(data, image_module.Image):
+        if data.mode != 'RGBA':
+            data = data.convert('RGBA')
+        return np.asarray(data)
+    pixels = data if isinstance(data, np.ndarray) else np.asarray(memoryview(data))
+    if pixels.dtype != np.uint8:
+        raise TypeError(f"pixel data must be uint8, got {pixels.dtype}")
+    if pixels.ndim == 1:
+        pixels = pixels.reshape(height, width, 4)
+    if pixels.ndim != 3 or pixels.shape[2] != 4:
+        raise ValueError(f"pixel data must be (H, W, 4) RGBA, got {pixels.shape}")
+    return np.ascontiguousarray(pixels)
+
+
+def _load_gl(namespace):
+    """OpenGL.GL の名前を namespace (呼び出し元モジュールの globals()) に入れる
+
+    GLを使うモジュールは from OpenGL.GL import * と同じ名前で関数を参照しているので、
+    GLの処理を最初に行うときにこれを呼ぶ。読み込み済みなら何もしない。
+    """
+    if "glClear" in namespace:
+        return
+    import OpenGL.GL
+    names = getattr(OpenGL.GL, "__all__", None) or [name for name in dir(OpenGL.GL) if not name.startswith("_")]
+    namespace.update({name: getattr(OpenGL.GL, name) for name in names})
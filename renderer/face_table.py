@@ -0,0 +1,165 @@
+import sys
+
+import numpy as np
+
+# 回転モードごとの面の隣接関係と座標変換の表
+# PANORAMA_FRAGMENT_SHADER (GL) と scroll_cpu (CPU) はこの表だけを見て描画するので、
+# 回転モードを追加・修正するときはここのデータを変えればよい。
+#
+# 面番号はパノラマ上の並び 0:top 1:front 2:right 3:back 4:left 5:bottom。
+# 各面は次のどちらか:
+#   "rotate": 面の中心を軸にその場で回転する (値は角度の符号)
+#   リング上の面: ring の並びで循環スクロールする
+# リング上の面は面内の座標 (lu, lv) から
+#   rel = a_u*lu + a_v*lv + b + k*scroll
+# を求め、floor(rel) * seg 個先の面の frac = rel - floor(rel) の位置を表示する。
+# transitions[(src, dst)] はリング上の位置 src から dst へ移ったときの
+# 移動先の面内座標 (new_u, new_v) を lu, lv, f (= frac) で表したもの。
+
+MODES = {
+    # X軸: right/left がその場で回転し、top, front, bottom, back が縦に循環
+    0: {
+        "rotate": {2: 1.0, 4: -1.0},
+        "ring": (0, 1, 5, 3),
+        # (a_u, a_v, b, k), seg
+        "scroll": [
+            ((0, 1, 0, 1), 1),    # top: 上から下へ
+            ((0, 1, 0, -1), -1),  # front: 下から上へ
+            ((0, 1, 0, -1), -1),  # bottom: 下から上へ
+            ((0, 1, 0, 1), 1),    # back: 上から下へ
+        ],
+        # top→front, bottom→back などは180度回転
+        "transitions": {
+            (src, dst): ("1-lu", "1-f") if flip else ("lu", "f")
+            for src, row in enumerate([
+                (False, True, True, False),
+                (True, False, False, True),
+                (True, False, False, True),
+                (False, True, True, False),
+            ])
+            for dst, flip in enumerate(row)
+        },
+    },
+    # Y軸: top/bottom がその場で回転し、側面4つが横に循環
+    1: {
+        "rotate": {0: 1.0, 5: -1.0},
+        "ring": (1, 2, 3, 4),
+        "scroll": [((1, 0, 0, 1), 1)] * 4,
+        "transitions": {(src, dst): ("f", "lv") for src in range(4) for dst in range(4)},
+    },
+    # Z軸: front/back がその場で回転し、top, right, bottom, left が循環
+    2: {
+        "rotate": {1: 1.0, 3: -1.0},
+        "ring": (0, 2, 5, 4),
+        "scroll": [
+            ((1, 0, 0, 1), -1),   # top: 右から左へ
+            ((0, 1, 0, 1), -1),   # right: 上から下へ
+            ((1, 0, 0, 1), -1),   # bottom: 右から左へ
+            ((0, -1, 1, 1), -1),  # left: 下から上へ
+        ],
+        "transitions": {
+            (0, 0): ("f", "lv"), (0, 1): ("1-lv", "f"), (0, 2): ("f", "lv"), (0, 3): ("lv", "1-f"),
+            (1, 0): ("f", "1-lu"), (1, 1): ("lu", "f"), (1, 2): ("f", "1-lu"), (1, 3): ("lu", "1-f"),
+            (2, 0): ("f", "lv"), (2, 1): ("1-lv", "f"), (2, 2): ("f", "lv"), (2, 3): ("lv", "1-f"),
+            (3, 0): ("f", "lu"), (3, 1): ("1-lu", "f"), (3, 2): ("f", "lu"), (3, 3): ("lu", "1-f"),
+        },
+    },
+}
+
+# 変換式を (lu, lv, f, 1) との内積の係数にする
+_TERMS = {
+    "lu": (1, 0, 0, 0), "1-lu": (-1, 0, 0, 1),
+    "lv": (0, 1, 0, 0), "1-lv": (0, -1, 0, 1),
+    "f": (0, 0, 1, 0), "1-f": (0, 0, -1, 1),
+}
+
+
+def build_face_table(mode):
+    """MODES[mode] をシェーダの uniform 配列と同じ形の float32 配列にする
+
+    戻り値:
+        face_params (12, 4): 面 i の [2i] = (a_u, a_v, b, k), [2i+1] = (回転の符号, seg, リング上の位置, 0)
+        transitions (72, 4): 面 i から n 番目の位置へ移ったときの [3(4i+n)] = new_u の係数,
+                             [+1] = new_v の係数, [+2] = (移動先の面, 0, 0, 0)
+    """
+    spec = MODES[mode]
+    face_params = np.zeros((6, 2, 4), dtype=np.float32)
+    transitions = np.zeros((6, 4, 3, 4), dtype=np.float32)
+    for face in range(6):
+        if face in spec["rotate"]:
+            face_params[face, 1] = (spec["rotate"][face], 0, 0, 0)
+            # seg が常に0なので移動先は自分 (位置0) だけ
+            transitions[face, 0] = (_TERMS["lu"], _TERMS["lv"], (face, 0, 0, 0))
+            continue
+        src = spec["ring"].index(face)
+        coef, seg = spec["scroll"][src]
+        face_params[face] = (coef, (0, seg, src, 0))
+        for dst in range(4):
+            new_u, new_v = spec["transitions"][(src, dst)]
+            transitions[face, dst] = (_TERMS[new_u], _TERMS[new_v], (spec["ring"][dst], 0, 0, 0))
+    return face_params.reshape(12, 4), transitions.reshape(72, 4)
+
+
+# 立方体としての各面の向き (cubeプレビューの頂点と同じ対応)
+# 面 i の面内座標 (lu, lv) は 3D の FACE_CENTERS[i] + (2lu-1)*FACE_RIGHT[i] + (2lv-1)*FACE_UP[i]
+FACE_CENTERS = np.array([(0, 1, 0), (0, 0, 1), (1, 0, 0), (0, 0, -1), (-1, 0, 0), (0, -1, 0)], dtype=np.float32)
+FACE_RIGHT = np.array([(-1, 0, 0), (1, 0, 0), (0, 0, -1), (-1, 0, 0), (0, 0, 1), (1, 0, 0)], dtype=np.float32)
+FACE_UP = np.array([(0, 0, 1), (0, 1, 0), (0, 1, 0), (0, 1, 0), (0, 1, 0), (0, 0, 1)], dtype=np.float32)
+
+
+def axis_rotation(axis, degree):
+    """X/Y/Z軸 (0/1/2) まわりの回転行列 (3x3)
+
+    90度単位では rotate(axis, degree) と同じ向きに回る。
+    rotate_matrix() に渡す複数軸の回転は、この行列の積で作れる。
+    """
+    a = np.radians(degree)
+    c, s = np.cos(a), np.sin(a)
+    # 90度単位で誤差なく軸にそろうように丸める
+    c, s = np.round(c, 12) + 0.0, np.round(s, 12) + 0.0
+    if axis == 0:
+        return np.array([[1, 0, 0], [0, c, -s], [0, s, c]])
+    if axis == 1:
+        return np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+
+def rotation_matrix(rotation):
+    """クォータニオン (glm.quat か (w, x, y, z)) または 3x3/4x4 行列を 3x3 の回転行列にする"""
+    # glm が読み込まれていなければ rotation が glm の型のことはないので、ここでは import しない
+    glm = sys.modules.get("glm")
+    if glm is not None and isinstance(rotation, glm.quat):
+        rotation = (rotation.w, rotation.x, rotation.y, rotation.z)
+    elif glm is not None and isinstance(rotation, (glm.mat3, glm.mat4)):
+        # glm.mat3 / glm.mat4 は列ごとのリストになる
+        rotation = np.array(rotation.to_list()).T
+    matrix = np.asarray(rotation, dtype=np.float64)
+    if matrix.shape == (4,):
+        w, x, y, z = matrix / np.linalg.norm(matrix)
+        return np.array([
+            [1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)],
+            [2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)],
+            [2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)],
+        ])
+    if matrix.shape == (4, 4):
+        matrix = matrix[:3, :3]
+    if matrix.shape != (3, 3):
+        raise ValueError(f"rotation must be a quaternion or a 3x3/4x4 matrix, got shape {matrix.shape}")
+    return matrix
+
+
+# rotate(axis, degree) のスクロール描画が立方体マップとしての回転と画素単位で一致しない組
+# Z軸の180度では right 面がスクロールの表どおりに入れ替わり、回転させた立方体の向きとは変わる
+# (270度は一致するが、Z軸の半回転以上はスクロールに寄せない)
+SCROLL_MISMATCH = {(2, 180), (2, 270)}
+
+
+def match_axis_rotation(matrix, atol=1e-6):
+    """matrix が1軸の90度単位の回転で、スクロール描画と同じ結果になるなら (axis, degree)、そうでなければ None"""
+    for axis in range(3):
+        for degree in (0, 90, 180, 270):
+            if (axis, degree) in SCROLL_MISMATCH:
+                continue
+            if np.allclose(matrix, axis_rotation(axis, degree), atol=atol):
+                return axis, degree
+    return None
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class FrameDeltaTracker:
+    """前回送出したフレームと比べて、変化した面 (またはタイル) を求める
+
+    tile_size を省略すると1面を1タイルとして扱う。
+    update() の戻り値は (6, tiles_y, tiles_x) の bool 配列で、True のタイルが変化している。
+    """
+
+    def __init__(self, face_size, height, tile_size=None):
+        tile_size = tile_size or face_size
+        if face_size % tile_size or height % tile_size:
+            raise ValueError(f"tile_size {tile_size} must divide face size {face_size}x{height}")
+        self.face_size = face_size
+        self.height = height
+        self.tile_size = tile_size
+        self.tiles_x = face_size // tile_size
+        self.tiles_y = height // tile_size
+        # 最後に送出したフレーム (RGBAを1要素にまとめたuint32で持つ)
+        self.previous = None
+        # 最後に送出したフレームを描画したときのレンダラの状態番号
+        self.version = None
+
+    def update(self, frame, version=None):
+        """frame を送出したものとして記録し、前回から変化したタイルを返す
+
+        version (ScrollRenderer.frame_version) が前回と同じなら比較を省略する。
+        """
+        if version is not None and version == self.version and self.previous is not None:
+            return np.zeros((6, self.tiles_y, self.tiles_x), dtype=bool)
+
+        pixels = np.ascontiguousarray(frame).view(np.uint32)[..., 0]
+        if self.previous is None:
+            self.previous = pixels.copy()
+            dirty = np.ones((6, self.tiles_y, self.tiles_x), dtype=bool)
+        else:
+            changed = pixels != self.previous
+            t = self.tile_size
+            dirty = changed.reshape(self.tiles_y, t, 6, self.tiles_x, t).any(axis=(1, 4)).transpose(1, 0, 2)
+            np.copyto(self.previous, pixels)
+        self.version = version
+        return dirty
+
+    def dirty_faces(self, dirty):
+        """タイル単位のマスクから変化した面の番号を返す"""
+        return [int(face) for face in np.flatnonzero(dirty.any(axis=(1, 2)))]
+
+    def regions(self, dirty):
+        """変化したタイルをパノラマ上の矩形 (face, x, y, w, h) のリストにする"""
+        t = self.tile_size
+        return [
+            (int(face), int(face * self.face_size + tx * t), int(ty * t), t, t)
+            for face, ty, tx in np.argwhere(dirty)
+        ]
+
+    def reset(self):
+        """次の update() で全タイルを変化ありとして扱う (受信側の再接続時など)"""
+        self.previous = None
+        self.version = None
@@ -0,0 +1,96 @@
+import ctypes
+
+import OpenGL.platform
+from OpenGL import EGL
+
+EGL_PLATFORM_SURFACELESS_MESA = 0x31DD
+
+
+class EGLContext:
+    """ウィンドウを作らずに OpenGL 3.3 core のコンテキストを作る
+
+    EGL_MESA_platform_surfaceless が使えればサーフェスなし、
+    使えなければデフォルトディスプレイ上の1x1 pbufferで作る。
+    描画はFBOに対して行う前提。pyglet.window.Window と同じく switch_to() で current にする。
+    """
+
+    # EGLDisplay はプロセスで共有されるので、最後のコンテキストを閉じるまで eglTerminate しない
+    _open_contexts = 0
+
+    def __init__(self):
+        if type(OpenGL.platform.PLATFORM).__name__ != "EGLPlatform":
+            raise RuntimeError(
+                "headless rendering needs PyOpenGL's EGL platform; "
+                "set PYOPENGL_PLATFORM=egl before importing OpenGL"
+            )
+        self.display = self._get_display()
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.display, ctypes.pointer(major), ctypes.pointer(minor)):
+            raise RuntimeError("eglInitialize failed")
+        extensions = (EGL.eglQueryString(self.display, EGL.EGL_EXTENSIONS) or b"").split()
+        surfaceless = b"EGL_KHR_surfaceless_context" in extensions
+
+        # EGL_SURFACE_TYPE の既定値は EGL_WINDOW_BIT なので明示する
+        config_attribs = [
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_RED_SIZE, 8,
+            EGL.EGL_GREEN_SIZE, 8,
+            EGL.EGL_BLUE_SIZE, 8,
+            EGL.EGL_ALPHA_SIZE, 8,
+            EGL.EGL_NONE,
+        ]
+        config = EGL.EGLConfig()
+        num_configs = EGL.EGLint()
+        EGL.eglChooseConfig(self.display, (EGL.EGLint * len(config_attribs))(*config_attribs),
+                            ctypes.pointer(config), 1, ctypes.pointer(num_configs))
+        if num_configs.value == 0:
+            raise RuntimeError("no EGL config supports desktop OpenGL")
+
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        context_attribs = [
+            EGL.EGL_CONTEXT_MAJOR_VERSION, 3,
+            EGL.EGL_CONTEXT_MINOR_VERSION, 3,
+            EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+            EGL.EGL_NONE,
+        ]
+        self.context = EGL.eglCreateContext(self.display, config, EGL.EGL_NO_CONTEXT,
+                                            (EGL.EGLint * len(context_attribs))(*context_attribs))
+        if not self.context:
+            raise RuntimeError("eglCreateContext failed")
+        EGLContext._open_contexts += 1
+
+        if surfaceless:
+            self.surface = EGL.EGL_NO_SURFACE
+        else:
+            pbuffer_attribs = [EGL.EGL_WIDTH, 1, EGL.EGL_HEIGHT, 1, EGL.EGL_NONE]
+            self.surface = EGL.eglCreatePbufferSurface(self.display, config,
+                                                       (EGL.EGLint * len(pbuffer_attribs))(*pbuffer_attribs))
+        self.switch_to()
+
+    @staticmethod
+    def _get_display():
+        try:
+            display = EGL.eglGetPlatformDisplay(EGL_PLATFORM_SURFACELESS_MESA, EGL.EGL_DEFAULT_DISPLAY, None)
+        except Exception:
+            # EGL 1.5未満やsurfaceless非対応のドライバ
+            display = None
+        if not display:
+            display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        return display
+
+    def switch_to(self):
+        if EGL.eglGetCurrentContext() != self.context:
+            EGL.eglMakeCurrent(self.display, self.surface, self.surface, self.context)
+
+    def close(self):
+        if self.context is None:
+            return
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+        if self.surface != EGL.EGL_NO_SURFACE:
+            EGL.eglDestroySurface(self.display, self.surface)
+        EGL.eglDestroyContext(self.display, self.context)
+        EGLContext._open_contexts -= 1
+        if EGLContext._open_contexts == 0:
+            EGL.eglTerminate(self.display)
+        self.context = None
@@ -0,0 +1,265 @@
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# アルバムアートなどの元画像から (H, W*6, 4) のパノラマを作り、内容のハッシュでキャッシュする
+# 次の曲のパノラマをワーカースレッドで先に作っておけば、曲の切り替え時に描画スレッドで
+# デコードや縮小をしなくてよい
+
+
+class FaceLayout:
+    """6面それぞれに元画像のどこを貼るかの宣言
+
+    faces は面0〜5 (0:top 1:front 2:right 3:back 4:left 5:bottom) の dict のリストで、各要素は
+        source : 元画像の番号 (PanoramaIngest.get() などに渡すリストの添字)
+        crop   : 元画像から切り出す範囲 (left, top, right, bottom) を 0〜1 の割合で (省略時は全体)
+        rotate : 時計回りの回転角 (0, 90, 180, 270)
+        flip_x : 左右反転 (省略時 False)
+        flip_y : 上下反転 (省略時 False)
+    source の代わりに fill (RGBA のタプル) を書くと単色で塗る。
+    """
+
+    def __init__(self, faces):
+        if len(faces) != 6:
+            raise ValueError(f"layout needs 6 faces, got {len(faces)}")
+        self.faces = []
+        for face in faces:
+            if "fill" in face:
+                self.faces.append({"fill": tuple(face["fill"])})
+                continue
+            if face.get("rotate", 0) % 90:
+                raise ValueError(f"rotate must be a multiple of 90, got {face['rotate']}")
+            self.faces.append({
+                "source": face.get("source", 0),
+                "crop": tuple(face.get("crop", (0.0, 0.0, 1.0, 1.0))),
+                "rotate": face.get("rotate", 0) % 360,
+                "flip_x": face.get("flip_x", False),
+                "flip_y": face.get("flip_y", False),
+            })
+
+    @classmethod
+    def tiled(cls, source=0):
+        """1枚の画像を6面すべてにそのまま貼る (正方形のアルバムアート向け)"""
+        return cls([{"source": source} for _ in range(6)])
+
+    @classmethod
+    def strip(cls, source=0):
+        """6面を横に並べた画像 (横幅が高さの6倍) を面ごとに切り分ける"""
+        return cls([{"source": source, "crop": (i / 6, 0.0, (i + 1) / 6, 1.0)} for i in range(6)])
+
+    def key(self):
+        return repr(self.faces)
+
+
+def build_panorama(images, layout, face_size, height):
+    """images (PIL.Image のリスト) を layout に従って (height, face_size*6, 4) の uint8 配列にする"""
+    out = np.empty((height, face_size * 6, 4), dtype=np.uint8)
+    for index, face in enumerate(layout.faces):
+        region = out[:, index * face_size:(index + 1) * face_size]
+        if "fill" in face:
+            region[:] = face["fill"]
+            continue
+        image = images[face["source"]]
+        left, top, right, bottom = face["crop"]
+        w, h = image.size
+        tile = image.crop((round(left * w), round(top * h), round(right * w), round(bottom * h)))
+        # 90/270度回すなら縦横を入れ替えた大きさに縮小してから回す
+        size = (height, face_size) if face["rotate"] in (90, 270) else (face_size, height)
+        tile = tile.convert("RGBA").resize(size, Image.LANCZOS)
+        if face["rotate"]:
+            # PIL の ROTATE_* は反時計回り
+            tile = tile.transpose({90: Image.ROTATE_270, 180: Image.ROTATE_180, 270: Image.ROTATE_90}[face["rotate"]])
+        if face["flip_x"]:
+            tile = tile.transpose(Image.FLIP_LEFT_RIGHT)
+        if face["flip_y"]:
+            tile = tile.transpose(Image.FLIP_TOP_BOTTOM)
+        region[:] = np.asarray(tile)
+    return out
+
+
+def _read_source(source):
+    """元画像をエンコードされたバイト列か PIL.Image として読む"""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def _source_digest(data):
+    if isinstance(data, Image.Image):
+        return hashlib.sha256(f"{data.mode}:{data.size}".encode() + data.tobytes()).hexdigest()
+    return hashlib.sha256(data).hexdigest()
+
+
+def _decode(data, layout, index, face_size, height):
+    if isinstance(data, Image.Image):
+        return data
+    image = Image.open(io.BytesIO(data))
+    # JPEG は必要な大きさに近い縮小率でデコードさせる (切り出す面のうち一番細かいものに合わせる)
+    need_w, need_h = face_size, height
+    for face in layout.faces:
+        if face.get("source") == index:
+            left, top, right, bottom = face["crop"]
+            need_w = max(need_w, face_size / max(right - left, 1e-6), height / max(right - left, 1e-6))
+            need_h = max(need_h, height / max(bottom - top, 1e-6), face_size / max(bottom - top, 1e-6))
+    image.draft("RGB", (int(need_w), int(need_h)))
+    image.load()
+    return image
+
+
+class PanoramaIngest:
+    """元画像からパノラマを作るキャッシュ付きの取り込み処理
+
+    sources はパス、エンコード済みのバイト列、PIL.Image のいずれか1つかそのリスト。
+    キャッシュのキーは元画像の内容のハッシュ + レイアウト + 大きさなので、
+    別のパスにある同じアートも再利用される。
+
+        ingest = PanoramaIngest(64, 64)
+        ingest.prefetch(next_track_art)         # ワーカースレッドで作り始める
+        ...
+        renderer.set_panorama_texture(ingest.get(next_track_art))  # 作り終わっていればすぐ返る
+
+    get() の戻り値はキャッシュと共有する読み取り専用の配列。
+    get() されないまま残った prefetch() は max_pending 件を超えるか pending_ttl 秒経つと古い順に捨てる
+    (作り終わったパノラマはキャッシュに残るので、後の get() はキャッシュから返る)。
+    """
+
+    def __init__(self, face_size, height=None, layout=None, max_bytes=64 * 1024 * 1024, workers=1,
+                 max_pending=8, pending_ttl=60.0):
+        self.face_size = face_size
+        self.height = height or face_size
+        self.layout = layout or FaceLayout.tiled()
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_pending = max_pending
+        self.pending_ttl = pending_ttl
+        # request -> (future, sources, 期限)。sources を持っておくので、待っている間は id() が再利用されない
+        self._pending = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="panorama-ingest")
+
+    def prefetch(self, sources):
+        """バックグラウンドでパノラマを作り始める (既に作っている最中なら何もしない)"""
+        request = self._request_id(sources)
+        with self._lock:
+            self._expire_pending()
+            entry = self._pending.get(request)
+            if entry is not None and self._same_sources(entry[1], sources):
+                return entry[0]
+            if entry is not None:
+                entry[0].cancel()
+            future = self._executor.submit(self._build, sources)
+            self._pending[request] = (future, sources, time.monotonic() + self.pending_ttl)
+            self._pending.move_to_end(request)
+            while len(self._pending) > self.max_pending:
+                _, (evicted, _, _) = self._pending.popitem(last=False)
+                evicted.cancel()
+        return future
+
+    def get(self, sources, timeout=None):
+        """パノラマを返す。prefetch() 済みならその結果を待ち、そうでなければこのスレッドで作る"""
+        request = self._request_id(sources)
+        with self._lock:
+            self._expire_pending()
+            entry = self._pending.get(request)
+            if entry is not None and self._same_sources(entry[1], sources):
+                del self._pending[request]
+            else:
+                entry = None
+        if entry is not None and not entry[0].cancelled():
+            return entry[0].result(timeout)
+        return self._build(sources)
+
+    def _expire_pending(self):
+        # _lock を持って呼ぶ。期限は追加順に並ぶので先頭から見ればよい
+        now = time.monotonic()
+        while self._pending:
+            request, (future, _, deadline) = next(iter(self._pending.items()))
+            if deadline > now:
+                break
+            del self._pending[request]
+            future.cancel()
+
+    def _same_sources(self, pending, sources):
+        # パス以外は id() で対応付けているので、同じオブジェクトかどうかも確かめる
+        return all(a is b or isinstance(a, (str, os.PathLike))
+                   for a, b in zip(self._as_list(pending), self._as_list(sources)))
+
+    def _request_id(self, sources):
+        # prefetch() と get() の対応付け用。ファイルは更新されたら別のリクエストとして扱う
+        ids = []
+        for source in self._as_list(sources):
+            if isinstance(source, (str, os.PathLike)):
+                stat = os.stat(source)
+                ids.append((os.fspath(source), stat.st_mtime_ns, stat.st_size))
+            else:
+                ids.append(id(source))
+        return tuple(ids)
+
+    @staticmethod
+    def _as_list(sources):
+        if isinstance(sources, (list, tuple)):
+            return list(sources)
+        return [sources]
+
+    def _build(self, sources):
+        data = [_read_source(source) for source in self._as_list(sources)]
+        h = hashlib.sha256(f"{self.layout.key()}:{self.face_size}x{self.height}".encode())
+        for item in data:
+            h.update(_source_digest(item).encode())
+        key = h.hexdigest()
+
+        with self._lock:
+            panorama = self._cache.get(key)
+            if panorama is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return panorama
+            self.misses += 1
+
+        images = [_decode(item, self.layout, i, self.face_size, self.height) for i, item in enumerate(data)]
+        panorama = build_panorama(images, self.layout, self.face_size, self.height)
+        # キャッシュと共有するので呼び出し側で書き換えられないようにする
+        panorama.flags.writeable = False
+
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = panorama
+                self.bytes += panorama.nbytes
+                while self.bytes > self.max_bytes and len(self._cache) > 1:
+                    _, evicted = self._cache.popitem(last=False)
+                    self.bytes -= evicted.nbytes
+        return panorama
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._cache),
+                    "bytes": self.bytes, "pending": len(self._pending)}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._pending.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
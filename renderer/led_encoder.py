@@ -0,0 +1,164 @@
+import socket
+import sys
+
+import numpy as np
+
+# パノラマ (H, W*6, 4) をLEDパネルの配線順のバイト列に変換する
+# 面の向き・チェーン順・サーペンタイン配線はすべて1本のインデックス配列にまとめ、
+# 1フレームあたり take 1回 + ガンマLUTで変換する
+
+
+class PanelLayout:
+    """パネルのチェーン順と向きの宣言
+
+    panels はチェーン順の dict のリストで、各要素は
+        face   : パノラマ上の面番号 (0:top 1:front 2:right 3:back 4:left 5:bottom)
+        rotate : 時計回りの回転角 (0, 90, 180, 270)
+        flip_x : 左右反転 (省略時 False)
+        flip_y : 上下反転 (省略時 False)
+    serpentine が True なら各パネル内で奇数行を右から左へ並べる。
+    """
+
+    def __init__(self, panels, serpentine=False):
+        self.panels = []
+        for panel in panels:
+            if not 0 <= panel["face"] < 6:
+                raise ValueError(f"face must be 0-5, got {panel['face']}")
+            if panel.get("rotate", 0) % 90:
+                raise ValueError(f"rotate must be a multiple of 90, got {panel['rotate']}")
+            self.panels.append({
+                "face": panel["face"],
+                "rotate": panel.get("rotate", 0) % 360,
+                "flip_x": panel.get("flip_x", False),
+                "flip_y": panel.get("flip_y", False),
+            })
+        self.serpentine = serpentine
+
+    @classmethod
+    def default(cls):
+        """面0〜5をそのままの向きで順につないだ配置"""
+        return cls([{"face": face} for face in range(6)])
+
+    def pixel_order(self, face_size, height):
+        """パノラマを平坦化した画素番号を、配線順に並べた配列を返す"""
+        if face_size != height:
+            # 90度単位で回すには正方形である必要がある
+            if any(panel["rotate"] in (90, 270) for panel in self.panels):
+                raise ValueError("rotate 90/270 needs square faces")
+        width = face_size * 6
+        index = np.arange(height * width, dtype=np.int32).reshape(height, width)
+        order = []
+        for panel in self.panels:
+            face = index[:, panel["face"] * face_size:(panel["face"] + 1) * face_size]
+            # np.rot90 は反時計回りなので符号を反転する
+            face = np.rot90(face, -panel["rotate"] // 90)
+            if panel["flip_x"]:
+                face = face[:, ::-1]
+            if panel["flip_y"]:
+                face = face[::-1]
+            if self.serpentine:
+                face = face.copy()
+                face[1::2] = face[1::2, ::-1]
+            order.append(face.ravel())
+        return np.concatenate(order)
+
+
+class LedEncoder:
+    """レンダラのフレームをLEDパネル向けのバイト列にする
+
+    color_format は "rgb888" (1画素3バイト) か "rgb565" (1画素2バイト)。
+    gamma, brightness は事前にLUTにしておくので1フレームのコストには影響しない。
+    レンダラの後処理 (enable_post_process) で補正済みなら gamma=1.0 にすればLUTを引かずに詰めるだけになる。
+    """
+
+    COLOR_FORMATS = ("rgb888", "rgb565")
+
+    def __init__(self, face_size, height, layout=None, color_format="rgb888", gamma=2.2, brightness=1.0,
+                 byteorder="little"):
+        if color_format not in self.COLOR_FORMATS:
+            raise ValueError(f"unknown color_format: {color_format!r} (expected one of {self.COLOR_FORMATS})")
+        self.face_size = face_size
+        self.height = height
+        self.layout = layout or PanelLayout.default()
+        self.color_format = color_format
+        self.order = self.layout.pixel_order(face_size, height)
+
+        levels = np.arange(256, dtype=np.float64) / 255.0
+        corrected = np.round(255.0 * brightness * levels ** gamma)
+        self.lut = np.clip(corrected, 0, 255).astype(np.uint8)
+        # 恒等のLUTなら rgb888 では引く必要がない
+        self.identity = bool((self.lut == np.arange(256)).all())
+        if color_format == "rgb565":
+            # 演算 (|) の結果はネイティブのバイト順になるので、指定のバイト順には詰めた後に変換する
+            self.dtype565 = np.dtype("<u2" if byteorder == "little" else ">u2")
+            lut = self.lut.astype(np.uint16)
+            # チャンネルごとに詰めた位置までシフト済みのLUT
+            self.lut565 = (
+                (lut >> 3) << 11,
+                (lut >> 2) << 5,
+                lut >> 3,
+            )
+
+    @property
+    def frame_bytes(self):
+        return len(self.order) * (3 if self.color_format == "rgb888" else 2)
+
+    def encode(self, frame, out=None):
+        """(H, W*6, 4) の uint8 フレームを配線順の1次元 uint8 配列にする"""
+        pixels = np.asarray(frame).reshape(-1, 4).take(self.order, axis=0)
+        if self.color_format == "rgb888":
+            encoded = pixels[:, :3] if self.identity else self.lut.take(pixels[:, :3])
+        else:
+            r, g, b = self.lut565
+            encoded = r.take(pixels[:, 0]) | g.take(pixels[:, 1]) | b.take(pixels[:, 2])
+            encoded = encoded.astype(self.dtype565, copy=False)
+        encoded = encoded.reshape(-1).view(np.uint8)
+        if out is None:
+            return encoded
+        np.copyto(out, encoded)
+        return out
+
+
+class FileSink:
+    """ファイルやFIFOへフレームを書き出す"""
+
+    def __init__(self, path):
+        self.stream = open(path, "wb")
+
+    def write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PipeSink(FileSink):
+    """標準出力などのバイナリストリームへ書き出す (既定は stdout)"""
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout.buffer
+
+    def close(self):
+        self.stream.flush()
+
+
+class SocketSink(FileSink):
+    """UNIXドメインソケット (または (host, port)) へフレームを送る"""
+
+    def __init__(self, address):
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def close(self):
+        self.sock.close()
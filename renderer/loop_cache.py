@@ -0,0 +1,168 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from .common import _as_rgba_array
+
+# 1周分の回転ループを .npy に書き出し、再生時は mmap で読むキャッシュ
+# ファイル名はパノラマの画素と描画条件のハッシュなので、同じ曲のアートなら次回はGLを使わずに再生できる
+
+# 描画結果が変わる変更をしたら上げる (古いキャッシュを使わないように)
+_FORMAT_VERSION = 1
+
+
+def loop_cache_key(pixels, axis, step, face_size, height, backend):
+    # GLとCPUの結果は数LSB違うので、バックエンドもキーに入れる
+    h = hashlib.sha256()
+    h.update(f"v{_FORMAT_VERSION}:{backend}:{axis}:{step!r}:{face_size}x{height}:{pixels.shape}".encode())
+    h.update(np.ascontiguousarray(pixels).data)
+    return h.hexdigest()
+
+
+class LoopPlayback:
+    """キャッシュした1周分のフレームを角度で引く
+
+    frames は (N, H, W*6, 4) の読み取り専用 memmap。frame() が返す配列も memmap のビューで、
+    アクセスしたページだけがディスクから読まれる。
+    """
+
+    def __init__(self, frames, step, path=None):
+        self.frames = frames
+        self.step = step
+        self.path = path
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame(self, degree):
+        """rotate(axis, degree) で描画したのと同じフレーム (degree は step 単位に丸める)"""
+        return self.frames[int(round(degree / self.step)) % len(self.frames)]
+
+
+class LoopCache:
+    """回転ループのディスクキャッシュ (合計 max_bytes を超えたら最後に使った時刻の古い順に削除)
+
+    最後に使った時刻はファイルの mtime で持つ (atime はマウントオプションで更新されないことがある)。
+    """
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def load(self, renderer, panorama, axis, step=2):
+        """panorama の axis 回転1周分を返す。キャッシュになければ renderer で描画して保存する
+
+        step は1フレームあたりの角度で、360 を割り切れる値にする。
+        描画は render_sequence(panorama=...) で行うので、renderer が表示中のパノラマは変わらない。
+        """
+        pixels = _as_rgba_array(panorama, renderer.height, renderer.width)
+        playback, path = self._lookup(pixels, axis, step, renderer.face_size, renderer.height, renderer.backend)
+        if playback is not None:
+            return playback
+        self._render(renderer, pixels, axis, step, int(360 / step), path)
+        self.evict(keep=path)
+        return LoopPlayback(self._open(path), step, path)
+
+    def open(self, panorama, axis, step, face_size, height, backend="gl"):
+        """レンダラを使わずにキャッシュだけを引く。あれば LoopPlayback、なければ None
+
+        GPUを止めたまま事前描画済みのループを再生するときに使う。キーには描画したバックエンドが入るので、
+        backend はキャッシュを作ったレンダラのものを渡す (prerender_library.py の既定 --backend gl なら "gl")。
+        """
+        pixels = _as_rgba_array(panorama, height, face_size * 6)
+        return self._lookup(pixels, axis, step, face_size, height, backend)[0]
+
+    def _lookup(self, pixels, axis, step, face_size, height, backend):
+        """(LoopPlayback か None, キャッシュのパス)"""
+        count = 360 / step
+        if count != int(count):
+            raise ValueError(f"step must divide 360, got {step}")
+        path = self.path(loop_cache_key(pixels, axis.value, step, face_size, height, backend))
+        frames = self._open(path)
+        if frames is None:
+            self.misses += 1
+            return None, path
+        self.hits += 1
+        return LoopPlayback(frames, step, path), path
+
+    def _open(self, path):
+        try:
+            frames = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return frames
+
+    def _render(self, renderer, pixels, axis, step, count, path):
+        shape = (count, renderer.height, renderer.width, 4)
+        # 書きかけのファイルを他のプロセスが読まないように一時ファイルに書いてから rename する
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            frames = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=shape)
+            renderer.render_sequence(axis, [i * step for i in range(count)], out=frames, panorama=pixels)
+            frames.flush()
+            del frames
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def entries(self):
+        """[(path, size, mtime), ...] を最後に使った時刻の古い順に返す"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def evict(self, keep=None):
+        """合計サイズが max_bytes 以下になるまで古いループを消す (keep は残す)
+
+        再生中のループを消しても、mmap 済みの内容はファイルを閉じるまで読める。
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        entries = self.entries()
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(entries), "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes}
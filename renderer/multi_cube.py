@@ -0,0 +1,224 @@
+import ctypes
+
+import numpy as np
+
+from .common import _as_rgba_array, _load_gl, RotationAxis
+from .scroll_shader import MULTI_CUBE_VERTEX_SHADER, MULTI_CUBE_FRAGMENT_SHADER
+from .scroll_cpu import CpuPanoramaRenderer
+from .remap_cache import RemapTableCache
+from .face_table import build_face_table
+
+# 1つのコンテキストで複数のキューブを描画する
+# パノラマは GL_TEXTURE_2D_ARRAY の1レイヤーずつ、キューブごとの回転はインスタンス属性に入れ、
+# 全キューブを縦長FBOへ1回のインスタンス描画で描いて1回で読み出す。
+# キューブが増えても増えるのは画素数だけで、GLの呼び出し回数は変わらない。
+
+
+class MultiCubeRenderer:
+    """count 台のキューブを ScrollRenderer と同じスクロール回転でまとめて描画する
+
+        renderer = MultiCubeRenderer(4, 64, 64, headless=True)
+        renderer.set_panorama_texture(0, panorama)
+        renderer.rotate(0, RotationAxis.Y, 30)
+        frames = renderer.render()     # (4, H, W*6, 4)、frames[i] は rotate(axis, degree) と同じ画像
+
+    rotate_many() なら全キューブの角度を配列で一度に設定できる。
+    切り替え・文字列・rotate_matrix() は ScrollRenderer だけが対応する。
+    """
+
+    BACKENDS = ("gl", "cpu")
+
+    def __init__(self, count, width, height, backend="gl", headless=False, shader_cache_dir=None,
+                 remap_cache=None):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"unknown backend: {backend!r} (expected one of {self.BACKENDS})")
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        self.count = count
+        self.face_size = width
+        self.width = width * 6
+        self.height = height
+        self.backend = backend
+        self.headless = headless
+        # キューブごとの (回転モード, 角度 (ラジアン), スクロール, レイヤー)。シェーダの a_Instance と同じ並び
+        self.instances = np.zeros((count, 4), dtype=np.float32)
+        self.instances[:, 3] = np.arange(count)
+        self.degrees = np.zeros(count)
+        self.instances_dirty = True
+
+        if self.backend == "cpu":
+            if remap_cache is None:
+                remap_cache = RemapTableCache()
+            self.remap_cache = remap_cache
+            self.cpu_renderers = [CpuPanoramaRenderer(width, height, cache=remap_cache) for _ in range(count)]
+            return
+
+        # OpenGL・pyglet はGLバックエンドを作るときに読み込む (scroll_renderer と同じ)
+        _load_gl(globals())
+        from .shader_cache import compile_program
+        if self.headless:
+            from .headless_context import EGLContext
+            self.window = EGLContext()
+        else:
+            import pyglet
+            # 画面には出さないのでウィンドウは隠しておく
+            self.window = pyglet.window.Window(1, 1, "Multi Cube Renderer", visible=False)
+        self.window.switch_to()
+
+        self.program = compile_program(MULTI_CUBE_VERTEX_SHADER, MULTI_CUBE_FRAGMENT_SHADER, shader_cache_dir)
+        glUseProgram(self.program)
+        glUniform1i(glGetUniformLocation(self.program, "u_Panoramas"), 0)
+
+        # 3つの回転モードの表は変わらないので最初にUBOへ入れておく
+        tables = [build_face_table(mode) for mode in range(3)]
+        data = np.concatenate([params for params, _ in tables] + [transitions for _, transitions in tables])
+        self.face_table_ubo = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.face_table_ubo)
+        glBufferData(GL_UNIFORM_BUFFER, data.nbytes, data, GL_STATIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        glUniformBlockBinding(self.program, glGetUniformBlockIndex(self.program, "FaceTables"), 0)
+
+        self.texture_array = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.texture_array)
+        if bool(glTexStorage3D):
+            glTexStorage3D(GL_TEXTURE_2D_ARRAY, 1, GL_RGBA8, self.width, self.height, count)
+        else:
+            glTexImage3D(GL_TEXTURE_2D_ARRAY, 0, GL_RGBA8, self.width, self.height, count, 0, GL_RGBA,
+                         GL_UNSIGNED_BYTE, None)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D_ARRAY, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, 0)
+
+        # フルスクリーン矩形 (ScrollRenderer と同じ) + インスタンスごとの属性
+        vertices = np.array([
+            -1, -1,  0, 0,
+             1, -1,  1, 0,
+             1,  1,  1, 1,
+            -1,  1,  0, 1,
+        ], dtype=np.float32)
+        indices = np.array([0,1,2, 2,3,0], dtype=np.uint32)
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+        self.vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+        self.ebo = glGenBuffers(1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ebo)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+        glVertexAttribPointer(0, 2, GL_FLOAT, GL_FALSE, 4 * 4, ctypes.c_void_p(0))
+        glEnableVertexAttribArray(0)
+        glVertexAttribPointer(1, 2, GL_FLOAT, GL_FALSE, 4 * 4, ctypes.c_void_p(2 * 4))
+        glEnableVertexAttribArray(1)
+        self.instance_vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        glBufferData(GL_ARRAY_BUFFER, self.instances.nbytes, None, GL_DYNAMIC_DRAW)
+        glEnableVertexAttribArray(2)
+        glVertexAttribDivisor(2, 1)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindVertexArray(0)
+
+        # テクスチャサイズの上限まで縦にタイルを積む。足りなければ render() で複数回に分ける
+        max_size = min(glGetIntegerv(GL_MAX_TEXTURE_SIZE), glGetIntegerv(GL_MAX_VIEWPORT_DIMS)[1])
+        self.tiles = max(1, min(count, max_size // self.height))
+        self.fbo = glGenFramebuffers(1)
+        self.fbo_tex = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.fbo_tex)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, self.width, self.height * self.tiles, 0, GL_RGBA,
+                     GL_UNSIGNED_BYTE, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.fbo_tex, 0)
+        assert glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def set_panorama_texture(self, index, panorama):
+        """キューブ index のパノラマ (ScrollRenderer.set_panorama_texture() と同じ形式)"""
+        pixels = _as_rgba_array(panorama, self.height, self.width)
+        if pixels.shape[:2] != (self.height, self.width):
+            raise ValueError(f"panorama must be {self.width}x{self.height}, got {pixels.shape[1]}x{pixels.shape[0]}")
+        if self.backend == "cpu":
+            self.cpu_renderers[index].set_panorama(pixels)
+            return
+        self.window.switch_to()
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.texture_array)
+        glTexSubImage3D(GL_TEXTURE_2D_ARRAY, 0, 0, 0, index, self.width, self.height, 1, GL_RGBA,
+                        GL_UNSIGNED_BYTE, pixels)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, 0)
+
+    def rotate(self, index, axis: RotationAxis, degree: float):
+        self.degrees[index] = degree
+        self.instances[index, :3] = (axis.value, np.radians(degree), (degree / 90.0) % 4.0)
+        self.instances_dirty = True
+
+    def rotate_many(self, axes, degrees):
+        """全キューブの回転を配列でまとめて設定する (axes は RotationAxis か 0〜2 の値の並び)"""
+        axes = np.array([getattr(axis, "value", axis) for axis in axes])
+        degrees = np.asarray(degrees, dtype=np.float64)
+        if len(axes) != self.count or len(degrees) != self.count:
+            raise ValueError(f"need {self.count} axes and degrees, got {len(axes)} and {len(degrees)}")
+        self.degrees[:] = degrees
+        self.instances[:, 0] = axes
+        self.instances[:, 1] = np.radians(degrees)
+        self.instances[:, 2] = (degrees / 90.0) % 4.0
+        self.instances_dirty = True
+
+    def render(self, out=None):
+        """全キューブを描画して (count, H, W*6, 4) の uint8 配列で返す"""
+        if out is None:
+            out = np.empty((self.count, self.height, self.width, 4), dtype=np.uint8)
+        if self.backend == "cpu":
+            for i, renderer in enumerate(self.cpu_renderers):
+                renderer.render(int(self.instances[i, 0]), self.degrees[i], out=out[i])
+            return out
+
+        self.window.switch_to()
+        if self.instances_dirty:
+            glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+            glBufferSubData(GL_ARRAY_BUFFER, 0, self.instances.nbytes, self.instances)
+            glBindBuffer(GL_ARRAY_BUFFER, 0)
+            self.instances_dirty = False
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, self.width, self.height * self.tiles)
+        glUseProgram(self.program)
+        glUniform1f(glGetUniformLocation(self.program, "u_Tiles"), self.tiles)
+        glBindBufferBase(GL_UNIFORM_BUFFER, 0, self.face_table_ubo)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, self.texture_array)
+        glBindVertexArray(self.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        for start in range(0, self.count, self.tiles):
+            n = min(self.tiles, self.count - start)
+            # インスタンス属性の参照位置をずらして start 台目から描く
+            glVertexAttribPointer(2, 4, GL_FLOAT, GL_FALSE, 4 * 4, ctypes.c_void_p(start * 4 * 4))
+            glDrawElementsInstanced(GL_TRIANGLES, 6, GL_UNSIGNED_INT, None, n)
+            glReadPixels(0, 0, self.width, self.height * n, GL_RGBA, GL_UNSIGNED_BYTE, out[start:start + n])
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindVertexArray(0)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        return out
+
+    def cleanup(self):
+        # CPUバックエンドではGLのリソースは作られない
+        if hasattr(self, "window"):
+            self.window.switch_to()
+        if getattr(self, "program", None):
+            glDeleteProgram(self.program)
+        if getattr(self, "vao", None):
+            glDeleteVertexArrays(1, [self.vao])
+        if getattr(self, "vbo", None):
+            glDeleteBuffers(3, [self.vbo, self.ebo, self.instance_vbo])
+        if getattr(self, "face_table_ubo", None):
+            glDeleteBuffers(1, [self.face_table_ubo])
+        if getattr(self, "texture_array", None):
+            glDeleteTextures(1, [self.texture_array])
+        if getattr(self, "fbo", None):
+            glDeleteFramebuffers(1, [self.fbo])
+            glDeleteTextures(1, [self.fbo_tex])
+        if getattr(self, "headless", False) and hasattr(self, "window"):
+            self.window.close()
@@ -0,0 +1,212 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class StageStats:
+    """ステージ1回あたりの所要時間と、実行間隔のばらつき (ジッタ) を記録する"""
+
+    def __init__(self, window=1000):
+        self.durations = deque(maxlen=window)
+        self.intervals = deque(maxlen=window)
+        self.count = 0
+        self._last_start = None
+
+    def record(self, start, end):
+        self.count += 1
+        self.durations.append(end - start)
+        if self._last_start is not None:
+            self.intervals.append(start - self._last_start)
+        self._last_start = start
+
+    def summary(self):
+        """所要時間のパーセンタイルと間隔の標準偏差 (いずれもミリ秒)"""
+        result = {"count": self.count}
+        if self.durations:
+            d = np.array(self.durations) * 1e3
+            result.update(mean_ms=float(d.mean()), p50_ms=float(np.percentile(d, 50)),
+                          p95_ms=float(np.percentile(d, 95)), p99_ms=float(np.percentile(d, 99)),
+                          max_ms=float(d.max()))
+        if len(self.intervals) > 1:
+            i = np.array(self.intervals) * 1e3
+            result.update(interval_ms=float(i.mean()), jitter_ms=float(i.std()))
+        return result
+
+
+class FrameQueue:
+    """描画ステージと出力ステージをつなぐ固定長のフレームキュー
+
+    policy:
+        "drop-oldest" : 満杯なら一番古いフレームを捨てて入れる
+        "drop-newest" : 満杯なら新しいフレームを捨てる
+        "block"       : 空きができるまで put() が待つ
+    フレームは put() 時に使い回しのバッファへコピーするので、レンダラの読み出しバッファを
+    そのまま渡してよい。get() で受け取ったバッファは処理後に release() で返す。
+    """
+
+    POLICIES = ("drop-oldest", "drop-newest", "block")
+
+    def __init__(self, capacity, shape, policy="drop-oldest"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"unknown policy: {policy!r} (expected one of {self.POLICIES})")
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.policy = policy
+        self.dropped = 0
+        self._items = deque()
+        # キューの中身 + 出力側が処理中の1枚
+        self._free = [np.empty(shape, dtype=np.uint8) for _ in range(capacity + 1)]
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, frame_index, frame):
+        """フレームを入れる。捨てられたら False を返す"""
+        with self._cond:
+            if len(self._items) >= self.capacity:
+                if self.policy == "drop-newest":
+                    self.dropped += 1
+                    return False
+                if self.policy == "drop-oldest":
+                    _, _, buffer = self._items.popleft()
+                    self._free.append(buffer)
+                    self.dropped += 1
+                else:
+                    self._cond.wait_for(lambda: len(self._items) < self.capacity or self._closed)
+                    if self._closed:
+                        return False
+            # 出力側がまだ前のバッファを返していなければ待つ
+            self._cond.wait_for(lambda: self._free or self._closed)
+            if self._closed:
+                return False
+            buffer = self._free.pop()
+            np.copyto(buffer, frame)
+            self._items.append((frame_index, time.perf_counter(), buffer))
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """(frame_index, 投入時刻, frame) を返す。タイムアウトか close() 後は None"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                return None
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def release(self, buffer):
+        with self._cond:
+            self._free.append(buffer)
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def __len__(self):
+        return len(self._items)
+
+
+class PipelineRunner:
+    """描画と出力 (エンコード・送信) を別スレッドに分けて実行する
+
+    render(dt) は描画スレッド (GLのコンテキストを持つスレッド) で呼ばれ、
+    (frame_index, frame) か None を返す。frame はコピーされるので使い回しのバッファでよい。
+    output(frame_index, frame) は出力スレッドで呼ばれる。
+    tick() を pyglet.clock.schedule_interval に登録するか、run() でループさせる。
+    output() が例外を投げたら出力スレッドはキューを閉じて止まり、その例外を次の tick() / run() が投げ直す。
+    """
+
+    def __init__(self, render, output, shape, capacity=3, policy="drop-oldest"):
+        self.render = render
+        self.output = output
+        self.queue = FrameQueue(capacity, shape, policy)
+        self.render_stats = StageStats()
+        self.output_stats = StageStats()
+        # 描画完了から出力完了までの時間
+        self.latency_stats = StageStats()
+        self._thread = None
+        # 出力スレッドで起きた例外 (描画スレッドで投げ直す)
+        self.error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._output_loop, name="led-output", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.queue.close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError("output stage failed") from self.error
+
+    def tick(self, dt=0.0):
+        self._raise_error()
+        start = time.perf_counter()
+        frame = self.render(dt)
+        if frame is not None:
+            self.queue.put(*frame)
+        self.render_stats.record(start, time.perf_counter())
+        self._raise_error()
+
+    def run(self, fps, duration=None):
+        """描画スレッドで fps に合わせて tick() を繰り返す (ウィンドウのない環境向け)
+
+        duration 秒が経つか、stop() されるか、出力スレッドが例外で止まるまで続ける。
+        """
+        period = 1.0 / fps
+        start = last = time.perf_counter()
+        next_time = start
+        while not self.queue.closed and (duration is None or last - start < duration):
+            now = time.perf_counter()
+            self.tick(now - last)
+            last = now
+            next_time += period
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # 遅れを取り戻そうと連続で描画しない
+                next_time = time.perf_counter()
+        self._raise_error()
+
+    def _output_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            frame_index, queued_at, frame = item
+            start = time.perf_counter()
+            try:
+                self.output(frame_index, frame)
+            except Exception as error:
+                # 描画スレッドが put() で待ち続けないようにキューを閉じる
+                self.error = error
+                self.queue.close()
+                return
+            finally:
+                self.queue.release(frame)
+            end = time.perf_counter()
+            self.output_stats.record(start, end)
+            self.latency_stats.record(queued_at, end)
+
+    def stats(self):
+        return {
+            "render": self.render_stats.summary(),
+            "output": self.output_stats.summary(),
+            "latency": self.latency_stats.summary(),
+            "queue": {"depth": len(self.queue), "capacity": self.queue.capacity,
+                      "policy": self.queue.policy, "dropped": self.queue.dropped},
+        }
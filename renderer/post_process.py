@@ -0,0 +1,80 @@
+import numpy as np
+
+# LEDへ出す前の後処理: ガンマLUT・全体の明るさ・電源の電流の上限
+# GLでは ScrollRenderer.enable_post_process() で on_draw() の後に2パス足す。
+#   1. 面ごとの電流を (6P, P) のテクスチャに書いてミップマップで 6x1 まで縮約する
+#   2. 最上段から面ごとの電流を読み、上限を超える分だけ減光しながらガンマLUTをかける
+# どちらもGPU内で完結するので、同じフレームのうちに減光でき読み出しも待たない。
+# CPUバックエンドでは apply() が同じ計算を NumPy で行う。
+
+
+class PostProcess:
+    """後処理の設定
+
+    gamma          : ガンマ値 (lut を渡したときは無視)
+    brightness     : 全体の明るさ (0〜1)。電流の見積もりにも入る
+    max_current_ma : 全体の電流の上限 (mA)。None なら制限しない
+    face_current_ma: 面ごとの電流の上限 (mA)。面ごとに別の電源・配線の場合に使う
+    ma_per_channel : 1チャンネルを255で点灯したときの電流 (mA)。WS2812 なら約20
+    lut            : 256段のLUT (uint8 なら 0〜255、float なら 0〜1)。省略時は gamma から作る
+    """
+
+    def __init__(self, gamma=2.2, brightness=1.0, max_current_ma=None, face_current_ma=None, ma_per_channel=20.0,
+                 lut=None):
+        if lut is None:
+            lut = (np.arange(256, dtype=np.float64) / 255.0) ** gamma
+        else:
+            lut = np.asarray(lut)
+            if lut.shape != (256,):
+                raise ValueError(f"lut must have 256 entries, got shape {lut.shape}")
+            if lut.dtype == np.uint8:
+                lut = lut / 255.0
+        self.lut = np.clip(lut, 0.0, 1.0).astype(np.float32)
+        self.brightness = float(brightness)
+        self.max_current_ma = max_current_ma
+        self.face_current_ma = face_current_ma
+        self.ma_per_channel = float(ma_per_channel)
+
+    def face_levels(self, frame, face_size):
+        """(H, W*6, 4) の uint8 フレームの面ごとの平均 (画素あたりの r+g+b のLUT後の値)"""
+        levels = self.lut[frame[..., :3]].sum(axis=-1, dtype=np.float32) * np.float32(self.brightness)
+        return levels.reshape(frame.shape[0], 6, face_size).mean(axis=(0, 2))
+
+    def face_scales(self, face_ma):
+        """面ごとの電流 (減光前) から、上限に収めるための面ごとの倍率を返す"""
+        face_ma = np.asarray(face_ma, dtype=np.float64)
+        scale = np.ones(6)
+        if self.face_current_ma:
+            over = face_ma > self.face_current_ma
+            scale[over] = self.face_current_ma / face_ma[over]
+        total = float((face_ma * scale).sum())
+        if self.max_current_ma and total > self.max_current_ma:
+            scale *= self.max_current_ma / total
+        return scale
+
+    def estimate(self, face_levels, face_size, height):
+        """face_levels() (またはGPUの縮約結果) から電流の見積もりを dict で返す
+
+        face_ma は減光前の面ごとの電流、scale は面ごとの減光の倍率、
+        requested_ma は減光前の合計、output_ma は減光後の合計 (電源に流れる見積もり)。
+        """
+        face_ma = np.asarray(face_levels, dtype=np.float64) * face_size * height * self.ma_per_channel
+        scale = self.face_scales(face_ma)
+        return {
+            "face_ma": face_ma.tolist(),
+            "scale": scale.tolist(),
+            "requested_ma": float(face_ma.sum()),
+            "output_ma": float((face_ma * scale).sum()),
+            "dimmed": bool((scale < 1.0).any()),
+        }
+
+    def apply(self, frame, face_size):
+        """GLSLの後処理と同じ変換を (H, W*6, 4) の uint8 フレームにその場で行い、見積もりを返す"""
+        estimate = self.estimate(self.face_levels(frame, face_size), face_size, frame.shape[0])
+        # 面ごとの倍率まで含めた uint8 のLUTにして、面ごとに take 1回で済ませる
+        scaled = self.lut[None, :] * np.float32(self.brightness) * np.array(estimate["scale"], np.float32)[:, None]
+        tables = np.rint(np.clip(scaled, 0.0, 1.0) * 255.0).astype(np.uint8)
+        for face in range(6):
+            region = frame[:, face * face_size:(face + 1) * face_size, :3]
+            region[:] = tables[face].take(region)
+        return estimate
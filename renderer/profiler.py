@@ -0,0 +1,162 @@
+import ctypes
+import functools
+import json
+import sys
+import time
+
+from .common import _load_gl
+from .pipeline import StageStats
+
+# 計測するメソッドとステージ名の対応
+# frame は読み出し (readback) + PIL への変換を含むCPU時間
+STAGES = {
+    "set_panorama_texture": "upload",
+    "set_panorama_face": "upload",
+    "on_draw": "draw",
+    "render_sequence": "sequence",
+    "update_cube_texture": "cube",
+    "get_current_panorama_array": "readback",
+    "read_panorama_array_async": "readback",
+    "get_current_panorama_frame": "frame",
+}
+# GPU時間も測るステージ (GL_TIME_ELAPSED は入れ子にできないので内側で呼ばれるものは除く)
+GPU_STAGES = ("upload", "draw", "sequence", "cube", "readback")
+
+
+def _import_gl():
+    """GPU時間を測るときだけ OpenGL を読み込む (CPUバックエンドの計測では読み込まない)"""
+    global _glGetQueryObjectui64v
+    _load_gl(globals())
+    # PyOpenGL の glGetQueryObjectui64v ラッパーは出力配列の型を解決できないので ctypes で直接呼ぶ
+    from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v as _glGetQueryObjectui64v
+
+
+class StageProfiler:
+    """ScrollRenderer のステージごとの所要時間を記録する
+
+    CPU時間は perf_counter、GPU時間は GL_TIME_ELAPSED クエリで測る。
+    クエリの結果は次の計測のついでに完了済みのものだけ回収するので描画を待たせない。
+    ScrollRenderer.enable_profiling() が対象のメソッドを差し替えて使う。
+    無効にすると元のメソッドに戻るので、計測していないときのコストはない。
+
+    dump_interval (秒) を指定すると、その間隔で summary() を dump_stream に書き出す。
+    """
+
+    def __init__(self, gpu=True, window=1000, dump_interval=None, dump_format="text", dump_stream=None):
+        if dump_format not in ("text", "json"):
+            raise ValueError(f"unknown dump_format: {dump_format!r} (expected 'text' or 'json')")
+        self.gpu = gpu
+        if gpu:
+            _import_gl()
+        self.window = window
+        self.cpu_stats = {}
+        self.gpu_stats = {}
+        self.dump_interval = dump_interval
+        self.dump_format = dump_format
+        self.dump_stream = dump_stream
+        self._last_dump = time.perf_counter()
+        # GPUクエリ: 結果待ちの (stage, query, 開始時刻) と使い回し用の空きクエリ
+        self._pending = []
+        self._free_queries = []
+        self._query_active = False
+
+    def wrap(self, stage, method, switch_to=None):
+        """method を計測付きの関数で包む。switch_to はGPUクエリを発行するコンテキストに切り替える関数"""
+        use_gpu = self.gpu and stage in GPU_STAGES and switch_to is not None
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            query = None
+            if use_gpu and not self._query_active:
+                switch_to()
+                self._collect()
+                query = self._begin_query()
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                if query is not None:
+                    switch_to()
+                    self._end_query(stage, query, start)
+                self._stats(self.cpu_stats, stage).record(start, end)
+                if self.dump_interval is not None and end - self._last_dump >= self.dump_interval:
+                    self._last_dump = end
+                    self.dump()
+
+        return timed
+
+    def _stats(self, table, stage):
+        stats = table.get(stage)
+        if stats is None:
+            stats = table[stage] = StageStats(self.window)
+        return stats
+
+    def _begin_query(self):
+        query = self._free_queries.pop() if self._free_queries else int(glGenQueries(1)[0])
+        glBeginQuery(GL_TIME_ELAPSED, query)
+        self._query_active = True
+        return query
+
+    def _end_query(self, stage, query, start):
+        glEndQuery(GL_TIME_ELAPSED)
+        self._query_active = False
+        self._pending.append((stage, query, start))
+
+    def _collect(self):
+        """結果の出ているクエリだけを回収する (発行順に完了するので最初の未完了で止める)"""
+        if not self._pending:
+            return
+        elapsed = ctypes.c_uint64()
+        now = time.perf_counter()
+        done = 0
+        for stage, query, start in self._pending:
+            if not glGetQueryObjectiv(query, GL_QUERY_RESULT_AVAILABLE):
+                break
+            _glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(elapsed))
+            self._free_queries.append(query)
+            done += 1
+            seconds = elapsed.value * 1e-9
+            # 発行から回収までより長い値は不正 (llvmpipe は最初の描画のクエリでこうなる)
+            if seconds <= now - start:
+                self._stats(self.gpu_stats, stage).record(start, start + seconds)
+        del self._pending[:done]
+
+    def summary(self):
+        """{"cpu": {stage: {...}}, "gpu": {stage: {...}}} (時間はミリ秒)"""
+        return {
+            "cpu": {stage: stats.summary() for stage, stats in self.cpu_stats.items()},
+            "gpu": {stage: stats.summary() for stage, stats in self.gpu_stats.items()},
+        }
+
+    def format_text(self, summary=None):
+        summary = summary or self.summary()
+        lines = []
+        for kind in ("cpu", "gpu"):
+            for stage, s in summary[kind].items():
+                if "mean_ms" not in s:
+                    continue
+                lines.append(f"{kind} {stage:9} n={s['count']:<6} mean {s['mean_ms']:7.3f}  p50 {s['p50_ms']:7.3f}  "
+                             f"p95 {s['p95_ms']:7.3f}  p99 {s['p99_ms']:7.3f}  max {s['max_ms']:7.3f} ms")
+        return "\n".join(lines)
+
+    def dump(self, stream=None):
+        stream = stream or self.dump_stream or sys.stderr
+        summary = self.summary()
+        if self.dump_format == "json":
+            stream.write(json.dumps(summary) + "\n")
+        else:
+            stream.write(self.format_text(summary) + "\n")
+        stream.flush()
+
+    def reset(self):
+        self.cpu_stats.clear()
+        self.gpu_stats.clear()
+
+    def release(self):
+        """GPUクエリを削除する (レンダラのコンテキストが current の状態で呼ぶ)"""
+        queries = self._free_queries + [query for _, query, _ in self._pending]
+        if queries:
+            glDeleteQueries(len(queries), queries)
+        self._free_queries = []
+        self._pending = []
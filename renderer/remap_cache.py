@@ -0,0 +1,71 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from .scroll_cpu import build_remap_table
+
+
+class RemapTableCache:
+    """(axis, angle, face size) ごとのremapテーブルをLRUで保持する
+
+    angle_step を指定すると角度をその刻みに量子化してキーにする (Noneなら量子化しない)。
+    max_bytes を超えたら古いテーブルから捨てる。
+    """
+
+    def __init__(self, angle_step=None, max_bytes=64 * 1024 * 1024):
+        if angle_step is not None and angle_step <= 0:
+            raise ValueError("angle_step must be positive")
+        self.angle_step = angle_step
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tables = OrderedDict()
+
+    def quantize(self, degree):
+        if self.angle_step is not None:
+            degree = round(degree / self.angle_step) * self.angle_step
+        # 角度もスクロールも360度周期
+        return round(degree % 360.0, 6) % 360.0
+
+    def get(self, axis, degree, face_size, height):
+        degree = self.quantize(degree)
+        key = (axis, degree, face_size, height)
+        table = self._tables.get(key)
+        if table is not None:
+            self._tables.move_to_end(key)
+            self.hits += 1
+            return table
+
+        self.misses += 1
+        angle = np.radians(degree)
+        scroll = (degree / 90.0) % 4.0
+        table = build_remap_table(axis, angle, scroll, face_size, height)
+        size = table[0].nbytes + table[1].nbytes
+        if size > self.max_bytes:
+            # 予算に収まらないテーブルは保持しない
+            return table
+        self._tables[key] = table
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (index, weight) = self._tables.popitem(last=False)
+            self.nbytes -= index.nbytes + weight.nbytes
+            self.evictions += 1
+        return table
+
+    def clear(self):
+        self._tables.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._tables),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._tables)
@@ -0,0 +1,259 @@
+import numpy as np
+
+from .face_table import build_face_table, FACE_CENTERS, FACE_RIGHT, FACE_UP
+
+# PANORAMA_FRAGMENT_SHADER と同じ座標変換をNumPyで行うCPUバックエンド
+# 座標系はシェーダと同じ (u: 左→右, v: 下→上) で、同じ面の隣接表 (face_table) を使って計算し、
+# 画像配列 (行0が上) へのインデックスに変換してからバイリニアでサンプルする
+
+
+def panorama_uv(axis, angle, scroll, face_size, height):
+    """出力の各ピクセルがサンプルするテクスチャ座標 (シェーダのuv) を返す
+
+    axis は回転モード (0:X, 1:Y, 2:Z)。GLSLの panorama_uv() と同じく face_table の表を引いて計算する。
+    戻り値の配列は画像と同じく行0が上。
+    """
+    face_params, transitions = build_face_table(axis)
+    face_params = face_params.reshape(6, 2, 4)
+    transitions = transitions.reshape(6, 4, 3, 4)
+    width = face_size * 6
+    u = ((np.arange(width, dtype=np.float32) + np.float32(0.5)) / np.float32(width))
+    v = np.float32(1.0) - (np.arange(height, dtype=np.float32) + np.float32(0.5)) / np.float32(height)
+    v = v[:, None]
+    out_u = np.empty((height, width), dtype=np.float32)
+    out_v = np.empty((height, width), dtype=np.float32)
+
+    # 面の中では表の値が共通なので面ごとにまとめて計算する
+    for face in range(6):
+        columns = slice(face * face_size, (face + 1) * face_size)
+        (a_u, a_v, b, k), (sign, seg_sign, position, _) = face_params[face]
+        local_u = (u[columns] * np.float32(6.0) - np.float32(face))[None, :]
+        local_v = v
+        if sign:
+            a = np.float32(angle) * sign
+            cos_a, sin_a = np.float32(np.cos(a)), np.float32(np.sin(a))
+            rel_u = local_u - np.float32(0.5)
+            rel_v = local_v - np.float32(0.5)
+            local_u = rel_u * cos_a - rel_v * sin_a + np.float32(0.5)
+            local_v = rel_u * sin_a + rel_v * cos_a + np.float32(0.5)
+
+        # 係数が0の項を省くと、rel は横方向にだけ変わる面で (1, W) のまま計算できる
+        rel = b + k * np.float32(scroll)
+        if a_u:
+            rel = rel + a_u * local_u
+        if a_v:
+            rel = rel + a_v * local_v
+        rel = np.asarray(rel, dtype=np.float32)
+        seg = np.floor(rel)
+        frac = rel - seg
+        n = np.mod(position + seg_sign * seg, np.float32(4.0)).astype(np.intp)
+        table = transitions[face]
+        terms = (local_u, local_v, frac, np.float32(1.0))
+        out_u[:, columns] = (_select(table[:, 2, 0], n) + _dot(table[:, 0], n, terms)) / np.float32(6.0)
+        out_v[:, columns] = _dot(table[:, 1], n, terms)
+    return out_u, out_v
+
+
+def _select(values, n):
+    """values[n] (移動先がすべて同じ値ならスカラーのまま返す)"""
+    if (values == values[0]).all():
+        return values[0]
+    return values.take(n)
+
+
+def _dot(coefs, n, terms):
+    """移動先 n ごとの係数 coefs[n] と terms の内積。係数が0の項は計算しない"""
+    result = np.float32(0.0)
+    for i, term in enumerate(terms):
+        if coefs[:, i].any():
+            result = result + _select(coefs[:, i], n) * term
+    return result
+
+
+def _cube_positions(face_size, height):
+    """出力の各ピクセルの面番号 (float32) と立方体上の位置 (H, W*6, 3)"""
+    width = face_size * 6
+    u = ((np.arange(width, dtype=np.float32) + np.float32(0.5)) / np.float32(width))
+    v = np.float32(1.0) - (np.arange(height, dtype=np.float32) + np.float32(0.5)) / np.float32(height)
+    u, v = np.meshgrid(u, v)
+    f = np.minimum(np.floor(u * np.float32(6.0)), np.float32(5.0))
+    face = f.astype(np.intp)
+    local_u = (u * np.float32(6.0) - f) * np.float32(2.0) - np.float32(1.0)
+    local_v = v * np.float32(2.0) - np.float32(1.0)
+    return f, FACE_CENTERS[face] + local_u[..., None] * FACE_RIGHT[face] + local_v[..., None] * FACE_UP[face]
+
+
+def cubemap_uv(rotation, face_size, height):
+    """パノラマを立方体マップとして rotation (3x3) で回したときのuv (GLSLの cubemap_uv() と同じ計算)"""
+    _, direction = _cube_positions(face_size, height)
+    direction = direction @ np.asarray(rotation, dtype=np.float32).T
+
+    # いちばん向きの近い面 (同じ値なら番号の小さい面)
+    dots = direction @ FACE_CENTERS.T
+    src = dots.argmax(axis=-1)
+    p = direction / np.take_along_axis(dots, src[..., None], axis=-1)
+    inset = np.float32(0.5 / face_size), np.float32(0.5 / height)
+    s = np.clip(((p * FACE_RIGHT[src]).sum(axis=-1) + 1) * np.float32(0.5), inset[0], 1 - inset[0])
+    t = np.clip(((p * FACE_UP[src]).sum(axis=-1) + 1) * np.float32(0.5), inset[1], 1 - inset[1])
+    return ((src + s) / np.float32(6.0)).astype(np.float32), t.astype(np.float32)
+
+
+# 切り替えの種類とシェーダの u_TransitionMode の値
+TRANSITION_MODES = {"crossfade": 1, "wipe": 2, "stagger": 3}
+
+
+def transition_weight(mode, progress, face_size, height, wipe_axis=(1, 0, 0), softness=0.1, stagger=0.1):
+    """GLSLの transition_weight() と同じ、出力の各ピクセルで次のパノラマを混ぜる割合 (0〜1)
+
+    crossfade はスカラー、wipe と stagger は (H, W*6) の float32 配列を返す。
+    """
+    progress = np.float32(progress)
+    if mode == "crossfade":
+        return progress
+    f, position = _cube_positions(face_size, height)
+    if mode == "wipe":
+        softness = np.float32(softness)
+        t = (position @ np.asarray(wipe_axis, dtype=np.float32) + np.float32(1.0)) * np.float32(0.5)
+        edge = progress * (np.float32(1.0) + softness)
+        x = np.clip((t - (edge - softness)) / softness, 0.0, 1.0)
+        return np.float32(1.0) - x * x * (np.float32(3.0) - np.float32(2.0) * x)
+    stagger = np.float32(stagger)
+    return np.clip((progress - f * stagger) / (np.float32(1.0) - np.float32(5.0) * stagger), 0.0, 1.0)
+
+
+def blend_frames(current, following, weight, out=None):
+    """current と following を weight (0〜1、スカラーか (H, W) の配列) で混ぜる"""
+    # 重みを1/256単位にして uint16 で計算する (255*256+128 に収まる)
+    w = np.rint(np.asarray(weight, dtype=np.float32) * 256).astype(np.uint16)
+    if w.ndim:
+        w = w[..., None]
+    result = (current.astype(np.uint16) * (256 - w) + following.astype(np.uint16) * w + 128) >> 8
+    if out is None:
+        return result.astype(np.uint8)
+    np.copyto(out, result, casting="unsafe")
+    return out
+
+
+def build_remap_table(axis, angle, scroll, face_size, height):
+    """uvをバイリニア用の4タップのインデックスと8bitの重みに変換する
+
+    戻り値は (index[4, H, W*6], weight[2, H, W*6])。
+    index は (height, face_size*6) の画像を平坦化したときの画素番号、
+    weight は x, y 方向の補間係数 (1/256単位)。GL_LINEAR + GL_CLAMP_TO_EDGE 相当。
+    """
+    u, v = panorama_uv(axis, angle, scroll, face_size, height)
+    return remap_table_from_uv(u, v, face_size, height)
+
+
+def remap_table_from_uv(u, v, face_size, height):
+    """シェーダのuv (u, v) の配列から build_remap_table() と同じ形のテーブルを作る"""
+    width = face_size * 6
+    # テクセル中心基準の座標 (yは画像の行方向)
+    x = u * np.float32(width) - np.float32(0.5)
+    y = (np.float32(1.0) - v) * np.float32(height) - np.float32(0.5)
+    x0 = np.floor(x)
+    y0 = np.floor(y)
+    fx = np.rint((x - x0) * 256).astype(np.int32)
+    fy = np.rint((y - y0) * 256).astype(np.int32)
+    x0 = x0.astype(np.int32) + (fx >> 8)
+    y0 = y0.astype(np.int32) + (fy >> 8)
+    fx &= 0xFF
+    fy &= 0xFF
+
+    x1 = np.clip(x0 + 1, 0, width - 1)
+    y1 = np.clip(y0 + 1, 0, height - 1)
+    x0 = np.clip(x0, 0, width - 1)
+    y0 = np.clip(y0, 0, height - 1)
+
+    index_dtype = np.int16 if width * height <= np.iinfo(np.int16).max else np.int32
+    index = np.stack([
+        y0 * width + x0,
+        y0 * width + x1,
+        y1 * width + x0,
+        y1 * width + x1,
+    ]).astype(index_dtype)
+    weight = np.stack([fx, fy]).astype(np.uint8)
+    return index, weight
+
+
+def apply_remap_table(source, index, weight, out=None):
+    """remapテーブルで (H, W*6, 4) のRGBA画像をサンプルする"""
+    pixels = source.reshape(-1, source.shape[-1])
+    # 横方向の補間は 255*256 に収まるのでuint16で計算する
+    taps = pixels.take(index, axis=0).astype(np.uint16)
+    fx = weight[0, ..., None].astype(np.uint16)
+    fy = weight[1, ..., None].astype(np.uint32)
+    top = taps[0] * (256 - fx) + taps[1] * fx
+    bottom = taps[2] * (256 - fx) + taps[3] * fx
+    result = (top * (256 - fy) + bottom * fy + 32768) >> 16
+    if out is None:
+        return result.astype(np.uint8)
+    np.copyto(out, result, casting="unsafe")
+    return out
+
+
+class CpuPanoramaRenderer:
+    """OpenGLを使わずにパノラマのスクロール/回転を描画する
+
+    cache (RemapTableCache) を渡すと、同じ角度のremapテーブルを再利用して
+    1フレームあたりgather 1回で描画できる。
+    """
+
+    def __init__(self, face_size, height, cache=None):
+        self.face_size = face_size
+        self.height = height
+        self.width = face_size * 6
+        self.cache = cache
+        self.source = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        # 切り替え先のパノラマ (set_next_panorama() で作る)
+        self.next_source = None
+
+    def set_panorama(self, pixels):
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        if pixels.shape != self.source.shape:
+            raise ValueError(f"panorama must be {self.source.shape}, got {pixels.shape}")
+        # 呼び出し側の配列を後から書き換えられても影響しないようにコピーして持つ
+        np.copyto(self.source, pixels)
+
+    def set_next_panorama(self, pixels):
+        """render() の blend で混ぜる切り替え先のパノラマ"""
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        if pixels.shape != self.source.shape:
+            raise ValueError(f"panorama must be {self.source.shape}, got {pixels.shape}")
+        if self.next_source is None:
+            self.next_source = np.empty_like(self.source)
+        np.copyto(self.next_source, pixels)
+
+    def swap_panorama(self):
+        """切り替え先のパノラマを現在のパノラマにする"""
+        self.source, self.next_source = self.next_source, self.source
+
+    def set_panorama_region(self, x, pixels):
+        """x列目から pixels の幅だけを置き換える (1面だけの更新など)"""
+        pixels = np.asarray(pixels, dtype=np.uint8)
+        self.source[:pixels.shape[0], x:x + pixels.shape[1]] = pixels
+
+    def remap_table(self, axis, degree):
+        if self.cache is not None:
+            return self.cache.get(axis, degree, self.face_size, self.height)
+        angle = np.radians(degree)
+        scroll = (degree / 90.0) % 4.0
+        return build_remap_table(axis, angle, scroll, self.face_size, self.height)
+
+    def render(self, axis, degree, out=None, blend=None):
+        """blend (transition_weight() の戻り値) を渡すと次のパノラマを同じテーブルでサンプルして混ぜる"""
+        index, weight = self.remap_table(axis, degree)
+        return self._sample(index, weight, out, blend)
+
+    def render_rotation(self, rotation, out=None, blend=None):
+        """立方体マップとして任意の回転行列で描画する (テーブルは毎回作るのでキャッシュしない)"""
+        u, v = cubemap_uv(rotation, self.face_size, self.height)
+        index, weight = remap_table_from_uv(u, v, self.face_size, self.height)
+        return self._sample(index, weight, out, blend)
+
+    def _sample(self, index, weight, out, blend):
+        if blend is None:
+            return apply_remap_table(self.source, index, weight, out)
+        current = apply_remap_table(self.source, index, weight)
+        following = apply_remap_table(self.next_source, index, weight)
+        return blend_frames(current, following, blend, out)
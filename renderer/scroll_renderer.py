@@ -1,56 +1,124 @@
 import numpy as np
 import ctypes
-from OpenGL.GL import *
-from OpenGL.GL.shaders import compileShader, compileProgram
-import pyglet
-import glm
-from PIL import Image, ImageDraw
-from PIL import ImageFont
-from enum import Enum
+
+from .common import RotationAxis, _as_rgba_array, _load_gl
 from .scroll_shader import *
+from .scroll_cpu import CpuPanoramaRenderer, TRANSITION_MODES, transition_weight, apply_remap_table
+from .remap_cache import RemapTableCache
+from .face_table import build_face_table, rotation_matrix, match_axis_rotation
+
+
+def _import_gl():
+    """OpenGL・pyglet・glm を読み込む (GLバックエンドかcubeプレビューを最初に作るとき)
 
-class RotationAxis(Enum):
-    X = 0
-    Y = 1
-    Z = 2
+    このモジュールの GL 関数は from OpenGL.GL import * と同じ名前で参照しているので、
+    読み込んだ名前をモジュールのグローバルに入れる。CPUバックエンドだけならこれらは読み込まれない。
+    PYOPENGL_PLATFORM の既定値は renderer パッケージの読み込み時に設定済み。
+    """
+    global pyglet, glm, compile_program
+    if "glClear" in globals():
+        return
+    _load_gl(globals())
+    import pyglet
+    import glm
+    from .shader_cache import compile_program
 
 class ScrollRenderer:
-    def __init__(self, width, height, show_cube=False, use_offscreen=False):
+    BACKENDS = ("gl", "cpu")
+
+    def __init__(self, width, height, show_cube=False, use_offscreen=False, backend="gl", remap_cache=None,
+                 readback_buffers=0, headless=False, shader_cache_dir=None,
+                 streaming_texture=False):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"unknown backend: {backend!r} (expected one of {self.BACKENDS})")
+        if headless and show_cube:
+            raise ValueError("show_cube needs a window and cannot be used with headless=True")
         self.width = width * 6
         self.height = height
-        self.use_offscreen = use_offscreen
-        self.window = pyglet.window.Window(self.width, self.height, "Scroll Renderer (Panorama)", visible=True)
-        self.window.switch_to()
-        self.window.on_draw = self.on_draw
-
-        if self.use_offscreen:
-            # オフスクリーン用FBOとテクスチャを作成
-            self.fbo = glGenFramebuffers(1)
-            self.offscreen_tex = glGenTextures(1)
-            glBindTexture(GL_TEXTURE_2D, self.offscreen_tex)
-            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, self.width, self.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-            glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
-            glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.offscreen_tex, 0)
-            assert glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE
-            glBindFramebuffer(GL_FRAMEBUFFER, 0)
-        else:
-            self.fbo = None
-            self.offscreen_tex = None
+        # GLでは常にFBOへ描画し、use_offscreen でなければウィンドウへもblitする (ウィンドウがなければblitしない)
+        self.use_offscreen = use_offscreen or headless
+        self.backend = backend
+        self.headless = headless
+        # リンク済みシェーダのバイナリを保存するディレクトリ (Noneなら毎回コンパイル)
+        self.shader_cache_dir = shader_cache_dir
+        self.face_size = width
+        self.streaming_texture = streaming_texture
 
+        self.frame_index = 0
+        # 描画結果に影響する状態 (回転・パノラマ) が変わるたびに増やす
+        self.content_version = 0
+        # 最後に on_draw() したときの content_version
+        self.frame_version = None
+        self.degree = 0
         self.angle = 0
         self.scroll = 0
         self.axis = RotationAxis.X
+        # rotate_matrix() で指定した任意の回転 (3x3)。None なら axis/degree のスクロール
+        self.rotation = None
+        # start_transition() で始めた次のパノラマへの切り替え (None なら切り替え中でない)
+        self.transition = None
+        self.transition_progress = 0.0
+        self.transition_softness = 0.1
+        self.transition_stagger = 0.1
+        # set_text() で重ねる文字列 (最初に使うときに作る)
+        self.text_overlay = None
+        self.show_cube = show_cube
+        # enable_post_process() の設定 (None なら後処理しない)
+        self.post_process = None
+        # 今の設定で後処理したフレームがあるか、CPUバックエンドではその電流の見積もり
+        self.post_processed = False
+        self.power_estimate = None
+        # enable_profiling() で作る計測用オブジェクト
+        self.profiler = None
+
+        if self.backend == "cpu":
+            # GLコンテキストを作らずにNumPyで描画する
+            # remapテーブルは角度ごとにキャッシュし、複数のレンダラで共有もできる
+            if remap_cache is None:
+                remap_cache = RemapTableCache()
+            self.remap_cache = remap_cache
+            self.cpu_renderer = CpuPanoramaRenderer(width, height, cache=remap_cache)
+            self.cpu_frame = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+            if self.show_cube:
+                self.init_cube_window()
+            return
+
+        _import_gl()
+        if self.headless:
+            # pygletのウィンドウを作らずにEGLのコンテキストだけ作る
+            from .headless_context import EGLContext
+            self.window = EGLContext()
+        else:
+            self.window = pyglet.window.Window(self.width, self.height, "Scroll Renderer (Panorama)", visible=True)
+            self.window.on_draw = self.on_draw
+        self.window.switch_to()
+
+        # 描画は常にFBOへ行う (ウィンドウには on_draw() の最後にblitする)
+        # FBOには上下反転して描くので、読み出した配列は行0が上端のままでCPUでの反転が要らない
+        self.fbo = glGenFramebuffers(1)
+        self.offscreen_tex = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.offscreen_tex)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, self.width, self.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        # cubeプレビューで直接サンプルするときに面の端で反対側がにじまないように
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.offscreen_tex, 0)
+        assert glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
 
         # ここでVAOを生成・バインド
         self.vao = glGenVertexArrays(1)
         glBindVertexArray(self.vao)
 
-        vs = compileShader(PANORAMA_VERTEX_SHADER, GL_VERTEX_SHADER)
-        fs = compileShader(PANORAMA_FRAGMENT_SHADER, GL_FRAGMENT_SHADER)
-        self.shader_program = compileProgram(vs, fs)
+        self.shader_program = compile_program(PANORAMA_VERTEX_SHADER, PANORAMA_FRAGMENT_SHADER, self.shader_cache_dir)
         glUseProgram(self.shader_program)
+        # 最後にアップロードした面の隣接表の回転モード
+        self.face_table_mode = None
+        # rotate_matrix() 用のプログラムは最初に使うときにコンパイルする
+        self.cubemap_program = None
 
         # フルスクリーン矩形
         vertices = np.array([
@@ -75,12 +143,229 @@ class ScrollRenderer:
         glBindVertexArray(0)
 
         self.texture_id = glGenTextures(1)
-        self.show_cube = show_cube
+        # 切り替え先のパノラマのテクスチャ (start_transition() で作る)
+        self.next_texture_id = None
+        # 文字列のアトラスと列の表のテクスチャ、アップロード済みの版
+        self.glyph_texture = None
+        self.text_columns_texture = None
+        self.glyph_texture_version = None
+        self.text_columns_version = None
+        if self.streaming_texture:
+            self.init_streaming_texture()
+        self.frame_buffer = self.new_frame_buffer()
+        self.async_frame_buffer = self.new_frame_buffer()
+
+        self.readback_pbos = []
+        if readback_buffers:
+            self.init_readback_buffers(readback_buffers)
 
         if self.show_cube:
             self.init_cube_window()
 
+    def init_streaming_texture(self):
+        self._allocate_streaming_texture(self.texture_id)
+        self.upload_pbo = glGenBuffers(1)
+
+    def _allocate_streaming_texture(self, texture_id):
+        # 毎フレーム更新する用途向けに、テクスチャの領域は最初に一度だけ確保する
+        glBindTexture(GL_TEXTURE_2D, texture_id)
+        if bool(glTexStorage2D):
+            glTexStorage2D(GL_TEXTURE_2D, 1, GL_RGBA8, self.width, self.height)
+        else:
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, self.width, self.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def init_readback_buffers(self, count):
+        # glReadPixelsの転送先をPBOのリングにして、GPU→CPUの同期を count-1 フレーム遅らせる
+        size = self.width * self.height * 4
+        for _ in range(count):
+            pbo = glGenBuffers(1)
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pbo)
+            glBufferData(GL_PIXEL_PACK_BUFFER, size, None, GL_STREAM_READ)
+            self.readback_pbos.append(pbo)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        # 各PBOに読み出し中のフレーム番号とフェンス
+        self.readback_pending = [None] * count
+        self.readback_head = 0
+
+    @property
+    def readback_latency(self):
+        """read_panorama_frame_async() が返すフレームの遅れ (フレーム数)"""
+        if self.backend == "cpu" or not self.readback_pbos:
+            return 0
+        return len(self.readback_pbos) - 1
+
+    def enable_profiling(self, gpu=True, window=1000, dump_interval=None, dump_format="text", dump_stream=None):
+        """アップロード・描画・読み出しなどのステージごとの時間計測を始める
+
+        計測対象のメソッドをこのインスタンスだけ計測付きに差し替える。
+        GPU時間はGLバックエンドのみ。結果は get_profile_stats() で取得する。
+        """
+        if self.profiler is not None:
+            self.disable_profiling()
+        from .profiler import StageProfiler, STAGES
+        gpu = gpu and self.backend == "gl"
+        self.profiler = StageProfiler(gpu, window, dump_interval, dump_format, dump_stream)
+        switch_to = self.window.switch_to if gpu else None
+        for name, stage in STAGES.items():
+            setattr(self, name, self.profiler.wrap(stage, getattr(self, name), switch_to))
+        if self.backend == "gl" and not self.headless:
+            self.window.on_draw = self.on_draw
+        return self.profiler
+
+    def disable_profiling(self):
+        if self.profiler is None:
+            return
+        from .profiler import STAGES
+        for name in STAGES:
+            # インスタンス属性を消せばクラスのメソッドに戻る
+            self.__dict__.pop(name, None)
+        if self.backend == "gl" and not self.headless:
+            self.window.on_draw = self.on_draw
+        if self.backend == "gl":
+            self.window.switch_to()
+            self.profiler.release()
+        self.profiler = None
+
+    def get_profile_stats(self):
+        """ステージごとの所要時間のパーセンタイル (ミリ秒)。計測していなければ None"""
+        if self.profiler is None:
+            return None
+        return self.profiler.summary()
+
+    def enable_post_process(self, gamma=2.2, brightness=1.0, max_current_ma=None, face_current_ma=None,
+                            ma_per_channel=20.0, lut=None):
+        """on_draw() の後にガンマLUT・明るさ・電流の上限による減光をかける (引数は PostProcess と同じ)
+
+        画面表示・読み出し・cubeプレビュー・非同期読み出しはすべて後処理後のフレームになるので、
+        LedEncoder は gamma=1.0 で作ればよい。
+        もう一度呼ぶと設定を置き換える。
+        """
+        from .post_process import PostProcess
+        post_process = PostProcess(gamma, brightness, max_current_ma, face_current_ma, ma_per_channel, lut)
+        if self.backend == "gl":
+            self.window.switch_to()
+            if getattr(self, "post_program", None) is None:
+                self._init_post_process()
+            glBindTexture(GL_TEXTURE_2D, self.gamma_lut_texture)
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_R32F, 256, 1, 0, GL_RED, GL_FLOAT, post_process.lut)
+            glBindTexture(GL_TEXTURE_2D, 0)
+        self.post_process = post_process
+        self.post_processed = False
+        self.content_version += 1
+
+    def disable_post_process(self):
+        self.post_process = None
+        self.post_processed = False
+        self.power_estimate = None
+        self.content_version += 1
+
+    def get_power_estimate(self):
+        """最後に描画したフレームの電流の見積もり (PostProcess.estimate() の dict)。後処理していなければ None
+
+        GLでは縮約済みの 6x1 のミップマップだけを読むので、フレーム全体の読み出しは起きない。
+        """
+        if self.post_process is None or not self.post_processed:
+            return None
+        if self.backend == "cpu":
+            return self.power_estimate
+        self.window.switch_to()
+        glBindTexture(GL_TEXTURE_2D, self.luminance_texture)
+        levels = np.empty(6, dtype=np.float32)
+        glGetTexImage(GL_TEXTURE_2D, self.luminance_level, GL_RED, GL_FLOAT, levels)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        return self.post_process.estimate(levels, self.face_size, self.height)
+
+    def _init_post_process(self):
+        # 後処理前のフレームを描くFBO (後処理の結果は従来どおり self.fbo に書く)
+        self.scene_fbo = glGenFramebuffers(1)
+        self.scene_texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.scene_texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, self.width, self.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.scene_fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.scene_texture, 0)
+        assert glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE
+
+        # 面を P x P のブロックに分ける (P は面の幅・高さ以下の最大の2のべき)。最上段のミップマップが 6x1 になる
+        self.luminance_blocks = 1 << (min(self.face_size, self.height).bit_length() - 1)
+        self.luminance_level = self.luminance_blocks.bit_length() - 1
+        self.luminance_fbo = glGenFramebuffers(1)
+        self.luminance_texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.luminance_texture)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_R32F, 6 * self.luminance_blocks, self.luminance_blocks, 0, GL_RED,
+                     GL_FLOAT, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST_MIPMAP_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, self.luminance_level)
+        glGenerateMipmap(GL_TEXTURE_2D)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.luminance_fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.luminance_texture, 0)
+        assert glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+        self.gamma_lut_texture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.gamma_lut_texture)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+        self.luminance_program = compile_program(PANORAMA_VERTEX_SHADER, LUMINANCE_FRAGMENT_SHADER,
+                                                 self.shader_cache_dir)
+        self.post_program = compile_program(PANORAMA_VERTEX_SHADER, POST_PROCESS_FRAGMENT_SHADER,
+                                            self.shader_cache_dir)
+
+    def _set_post_process_uniforms(self, program):
+        post = self.post_process
+        # フレームはユニット0、LUTはユニット1、縮約テクスチャはユニット2
+        glActiveTexture(GL_TEXTURE1)
+        glBindTexture(GL_TEXTURE_2D, self.gamma_lut_texture)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, self.scene_texture)
+        glUniform1i(glGetUniformLocation(program, "u_Frame"), 0)
+        glUniform1i(glGetUniformLocation(program, "u_GammaLut"), 1)
+        glUniform1f(glGetUniformLocation(program, "u_Brightness"), post.brightness)
+        glUniform2i(glGetUniformLocation(program, "u_FaceSize"), self.face_size, self.height)
+        glUniform1i(glGetUniformLocation(program, "u_FlipY"), False)
+
+    def _post_process_pass(self):
+        """scene_fbo に描いたフレームの電流を縮約し、後処理した結果を self.fbo に描く"""
+        post = self.post_process
+        glBindVertexArray(self.vao)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.luminance_fbo)
+        glViewport(0, 0, 6 * self.luminance_blocks, self.luminance_blocks)
+        glUseProgram(self.luminance_program)
+        self._set_post_process_uniforms(self.luminance_program)
+        glUniform1i(glGetUniformLocation(self.luminance_program, "u_Blocks"), self.luminance_blocks)
+        glDrawElements(GL_TRIANGLES, 6, GL_UNSIGNED_INT, None)
+        glBindTexture(GL_TEXTURE_2D, self.luminance_texture)
+        glGenerateMipmap(GL_TEXTURE_2D)
+
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glViewport(0, 0, self.width, self.height)
+        program = self.post_program
+        glUseProgram(program)
+        self._set_post_process_uniforms(program)
+        glActiveTexture(GL_TEXTURE2)
+        glBindTexture(GL_TEXTURE_2D, self.luminance_texture)
+        glActiveTexture(GL_TEXTURE0)
+        glUniform1i(glGetUniformLocation(program, "u_Luminance"), 2)
+        glUniform1i(glGetUniformLocation(program, "u_LuminanceLevel"), self.luminance_level)
+        glUniform1f(glGetUniformLocation(program, "u_MaPerChannel"), post.ma_per_channel)
+        glUniform1f(glGetUniformLocation(program, "u_MaxCurrent"), post.max_current_ma or 0.0)
+        glUniform1f(glGetUniformLocation(program, "u_FaceCurrent"), post.face_current_ma or 0.0)
+        glDrawElements(GL_TRIANGLES, 6, GL_UNSIGNED_INT, None)
+        glBindVertexArray(0)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
     def init_cube_window(self):
+            _import_gl()
             # 立方体のスクロール用
             self.cube_window = None
             self.cube_rot_x = 20.0
@@ -160,92 +445,565 @@ class ScrollRenderer:
             glBindVertexArray(0)
 
             # 立方体用シェーダ
-            cube_vs = compileShader(CUBE_VERTEX_SHADER, GL_VERTEX_SHADER)
-            cube_fs = compileShader(CUBE_FRAGMENT_SHADER, GL_FRAGMENT_SHADER)
-            glBindVertexArray(self.cube_vao)  # 追加
-            self.cube_shader_program = compileProgram(cube_vs, cube_fs)
-            glBindVertexArray(0)  # 終わったら解除
+            self.cube_shader_program = compile_program(CUBE_VERTEX_SHADER, CUBE_FRAGMENT_SHADER, self.shader_cache_dir)
+
+    def set_panorama_texture(self, panorama):
+        """パノラマ画像をアップロードする
+
+        PIL.Image のほか (H, W*6, 4) の uint8 ndarray やバッファ (bytes, memoryview など) を受け付ける。
+        上下反転はシェーダ側で行うので、配列は行0が画像の上端のままでよい。
+        """
+        pixels = _as_rgba_array(panorama, self.height, self.width)
+        self.content_version += 1
 
-    def set_panorama_texture(self, panorama_image: Image.Image):
-        if panorama_image.mode != 'RGBA':
-            panorama_image = panorama_image.convert('RGBA')
+        if self.backend == "cpu":
+            self.cpu_renderer.set_panorama(pixels)
+            return
 
+        if self.streaming_texture:
+            if pixels.shape[:2] != (self.height, self.width):
+                raise ValueError(f"panorama must be {self.width}x{self.height} with streaming_texture=True")
+            self._upload_texture_region(0, pixels)
+            return
+
+        self._upload_texture(self.texture_id, pixels)
+
+    def _upload_texture(self, texture_id, pixels):
         # OpenGLテクスチャとしてアップロード（全体画像をそのまま使う場合）
-        img_data = panorama_image.transpose(Image.FLIP_TOP_BOTTOM).tobytes("raw", "RGBA")
         self.window.switch_to()
-        glBindTexture(GL_TEXTURE_2D, self.texture_id)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, panorama_image.width, panorama_image.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, img_data)
+        glBindTexture(GL_TEXTURE_2D, texture_id)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, pixels.shape[1], pixels.shape[0], 0, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
         glBindTexture(GL_TEXTURE_2D, 0)
 
+    def set_panorama_face(self, face, pixels):
+        """パノラマのうち1面 (0〜5) だけを更新する
+
+        pixels は (H, W, 4) の1面分。set_panorama_texture() で全体を一度アップロードしてから使う。
+        """
+        if not 0 <= face < 6:
+            raise ValueError(f"face must be 0-5, got {face}")
+        pixels = _as_rgba_array(pixels, self.height, self.face_size)
+        self.content_version += 1
+        if pixels.shape[:2] != (self.height, self.face_size):
+            raise ValueError(f"face must be {self.face_size}x{self.height}, got {pixels.shape[1]}x{pixels.shape[0]}")
+        x = face * self.face_size
+
+        if self.backend == "cpu":
+            self.cpu_renderer.set_panorama_region(x, pixels)
+            return
+
+        if self.streaming_texture:
+            self._upload_texture_region(x, pixels)
+            return
+
+        self.window.switch_to()
+        glBindTexture(GL_TEXTURE_2D, self.texture_id)
+        glTexSubImage2D(GL_TEXTURE_2D, 0, x, 0, self.face_size, self.height, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+        glBindTexture(GL_TEXTURE_2D, 0)
+
+    def _upload_texture_region(self, x, pixels, texture_id=None):
+        height, width = pixels.shape[:2]
+        size = height * width * 4
+        self.window.switch_to()
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, self.upload_pbo)
+        # 前回の転送が終わるのを待たないように、バッファを orphan してから書き込む
+        glBufferData(GL_PIXEL_UNPACK_BUFFER, size, None, GL_STREAM_DRAW)
+        ptr = glMapBufferRange(GL_PIXEL_UNPACK_BUFFER, 0, size, GL_MAP_WRITE_BIT | GL_MAP_INVALIDATE_BUFFER_BIT)
+        mapped = np.ctypeslib.as_array((ctypes.c_uint8 * size).from_address(ptr)).reshape(height, width, 4)
+        np.copyto(mapped, pixels)
+        glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+        glBindTexture(GL_TEXTURE_2D, texture_id or self.texture_id)
+        glTexSubImage2D(GL_TEXTURE_2D, 0, x, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+
+    def start_transition(self, panorama, mode="crossfade", softness=0.1, stagger=0.1):
+        """次のパノラマへの切り替えを始める
+
+        mode は "crossfade" (全体を同時に)、"wipe" (現在の回転軸の方向に境界が進む)、
+        "stagger" (面ごとに stagger ずつ遅れて切り替わる)。softness は wipe の境界のぼかし幅。
+        切り替えは on_draw() のシェーダ内で回転と同時に行うので、描画1回あたりの転送は増えない。
+        進み具合は set_transition_progress() で 0〜1 を指定し、1 になると次のパノラマが現在のものになる。
+        """
+        if mode not in TRANSITION_MODES:
+            raise ValueError(f"unknown transition: {mode!r} (expected one of {tuple(TRANSITION_MODES)})")
+        if softness <= 0:
+            raise ValueError(f"softness must be positive, got {softness}")
+        if not 0 <= stagger < 0.2:
+            raise ValueError(f"stagger must be in [0, 0.2), got {stagger}")
+        pixels = _as_rgba_array(panorama, self.height, self.width)
+        if pixels.shape[:2] != (self.height, self.width):
+            raise ValueError(f"panorama must be {self.width}x{self.height}, got {pixels.shape[1]}x{pixels.shape[0]}")
+
+        if self.backend == "cpu":
+            self.cpu_renderer.set_next_panorama(pixels)
+        else:
+            self.window.switch_to()
+            if self.next_texture_id is None:
+                self.next_texture_id = glGenTextures(1)
+                if self.streaming_texture:
+                    self._allocate_streaming_texture(self.next_texture_id)
+            if self.streaming_texture:
+                self._upload_texture_region(0, pixels, self.next_texture_id)
+            else:
+                self._upload_texture(self.next_texture_id, pixels)
+
+        self.transition = mode
+        self.transition_progress = 0.0
+        self.transition_softness = float(softness)
+        self.transition_stagger = float(stagger)
+        self.content_version += 1
+
+    def set_transition_progress(self, progress):
+        """切り替えの進み具合 (0〜1)。1 以上で finish_transition() する"""
+        if self.transition is None:
+            raise RuntimeError("start_transition() を呼んでいないので切り替えはできません")
+        progress = min(max(float(progress), 0.0), 1.0)
+        if progress >= 1.0:
+            self.finish_transition()
+            return
+        if progress != self.transition_progress:
+            self.content_version += 1
+        self.transition_progress = progress
+
+    def finish_transition(self):
+        """次のパノラマを現在のパノラマにして切り替えを終える (テクスチャを入れ替えるだけで転送はしない)"""
+        if self.transition is None:
+            return
+        if self.backend == "cpu":
+            self.cpu_renderer.swap_panorama()
+        else:
+            self.texture_id, self.next_texture_id = self.next_texture_id, self.texture_id
+        self.transition = None
+        self.transition_progress = 0.0
+        self.content_version += 1
+
+    def cancel_transition(self):
+        """切り替えをやめて現在のパノラマに戻す"""
+        if self.transition is None:
+            return
+        self.transition = None
+        self.transition_progress = 0.0
+        self.content_version += 1
+
+    def set_text_font(self, font=None, font_size=12):
+        """set_text() で使うフォント (パスか ImageFont、None なら PIL の既定フォント)"""
+        from .text_overlay import TextOverlay
+        if self.text_overlay is None:
+            self.text_overlay = TextOverlay(self.face_size, self.height, font, font_size)
+        else:
+            self.text_overlay.set_font(font, font_size)
+        self.content_version += 1
+
+    def set_text(self, slot, text, face, left=0, top=0, width=None, color=(255, 255, 255, 255), scale=1, gap=None):
+        """出力の面 face の (left, top) から幅 width に文字列を重ねる (slot は 0〜MAX_TEXTS-1)
+
+        幅に収まらない文字列は set_text_scroll() で流すマーキーになる。
+        文字は一度だけアトラスに描き、流すときは uniform を変えるだけなのでパノラマの再アップロードは不要。
+        """
+        if self.text_overlay is None:
+            from .text_overlay import TextOverlay
+            self.text_overlay = TextOverlay(self.face_size, self.height)
+        self.text_overlay.set_text(slot, text, face, left, top, width, color, scale, gap)
+        self.content_version += 1
+
+    def set_text_scroll(self, slot, offset):
+        """マーキーの表示開始位置 (文字列の先頭からの列数、文字列の長さで循環する)"""
+        if self.text_overlay is not None and self.text_overlay.set_scroll(slot, offset):
+            self.content_version += 1
+
+    def clear_text(self, slot=None):
+        """slot の文字列を消す (None ならすべて)"""
+        if self.text_overlay is not None:
+            self.text_overlay.clear(slot)
+            self.content_version += 1
+
+    def _wipe_axis(self):
+        return tuple(float(i == self.axis.value) for i in range(3))
 
     def rotate(self, axis: RotationAxis, degree: float):
+        if axis != self.axis or degree != self.degree or self.rotation is not None:
+            self.content_version += 1
         self.axis = axis
+        self.degree = degree
         self.angle = np.radians(degree)
         self.scroll = (degree / 90.0) % 4.0
-        rotated_image = self.get_current_panorama_frame()
+        self.rotation = None
+        self._update_cube_preview()
 
-        if self.show_cube:
-            self.set_cube_texture_from_image(rotated_image)
-            self.cube_window.dispatch_event('on_draw')
-    
-    def get_current_panorama_frame(self):
-        if self.use_offscreen:
-            glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
-            glPixelStorei(GL_PACK_ALIGNMENT, 1)
-            data = glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE)
-            glBindFramebuffer(GL_FRAMEBUFFER, 0)
+    def rotate_matrix(self, rotation):
+        """任意の回転 (クォータニオンか3x3/4x4行列) でパノラマを立方体マップとして回す
+
+        複数軸の回転を1回の描画で行える。回転は face_table.axis_rotation() の積などで作る。
+        rotate_matrix(A @ B) は A と B を続けて回した立方体になる。
+        1軸の90度単位の回転のうち、スクロール描画と画素単位で一致するものは rotate(axis, degree) で描画する
+        (face_table.SCROLL_MISMATCH の組は一致しないので、連続した回転で1フレームだけ飛ばないよう常に再サンプルする)。
+        """
+        matrix = rotation_matrix(rotation)
+        aligned = match_axis_rotation(matrix)
+        if aligned is not None:
+            self.rotate(RotationAxis(aligned[0]), aligned[1])
+            return
+        matrix = matrix.astype(np.float32)
+        if self.rotation is None or not np.array_equal(matrix, self.rotation):
+            self.content_version += 1
+        self.rotation = matrix
+        self._update_cube_preview()
+
+    def _update_cube_preview(self):
+        if not self.show_cube:
+            return
+        if self.backend == "cpu":
+            self.set_cube_texture_from_image(self.cpu_frame)
         else:
-            self.window.switch_to()
-            glPixelStorei(GL_PACK_ALIGNMENT, 1)
-            data = glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE)
-        image = Image.frombytes("RGBA", (self.width, self.height), data)
-        image = image.transpose(Image.FLIP_TOP_BOTTOM)
-        return image
-
-    def set_cube_texture_from_image(self, pil_image):
-        """cube用テクスチャをPIL.Imageから更新"""
-        if pil_image.mode != 'RGBA':
-            pil_image = pil_image.convert('RGBA')
-        img_data = pil_image.transpose(Image.FLIP_TOP_BOTTOM).tobytes("raw", "RGBA")
+            self.update_cube_texture()
+        self.cube_window.dispatch_event('on_draw')
+
+    def update_cube_texture(self):
+        """描画済みのパノラマをGPU内だけでcubeプレビューに渡す
+
+        cube側はFBOのテクスチャを直接サンプルするのでコピーは不要。
+        """
+        self.window.switch_to()
+        # cube側のコンテキストで読む前にこちらの描画コマンドを流しておく
+        glFlush()
+
+    def new_frame_buffer(self):
+        return np.empty((self.height, self.width, 4), dtype=np.uint8)
+
+    def get_current_panorama_array(self, out=None):
+        """最後に描画したフレームを (H, W*6, 4) の uint8 配列で返す
+
+        out を省略すると内部の使い回しバッファを返すので、次の呼び出しで上書きされる。
+        保持したい場合は out に自前の配列を渡すかコピーすること。
+        """
+        if self.backend == "cpu":
+            if out is None:
+                return self.cpu_frame
+            np.copyto(out, self.cpu_frame)
+            return out
+
+        if out is None:
+            out = self.frame_buffer
+        self.window.switch_to()
+        # FBOへは上下反転して描画しているので、そのまま行0が上になる
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE, out)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        return out
+
+    def get_panorama_delta(self, tracker):
+        """tracker (FrameDeltaTracker) に最後に送出したフレームから変化した領域を返す
+
+        戻り値は [((face, x, y, w, h), pixels), ...]。pixels は読み出しバッファのビューなので
+        次の読み出しまでに送出すること。前回から描画内容が変わっていなければ読み出し自体を省く。
+        """
+        if tracker.version is not None and tracker.version == self.frame_version:
+            return []
+        frame = self.get_current_panorama_array()
+        dirty = tracker.update(frame, self.frame_version)
+        return [
+            ((face, x, y, w, h), frame[y:y + h, x:x + w])
+            for face, x, y, w, h in tracker.regions(dirty)
+        ]
+
+    def get_current_panorama_frame(self):
+        """get_current_panorama_array() の PIL.Image 版"""
+        from PIL import Image
+        return Image.fromarray(self.get_current_panorama_array(out=self.new_frame_buffer()), "RGBA")
+
+    def read_panorama_array_async(self, out=None):
+        """直前に描画したフレームの読み出しをPBOに投げ、readback_latency フレーム前の結果を返す
+
+        戻り値は (frame_index, array)。リングが埋まるまでは None を返す。
+        frame_index はそのフレームを描画した on_draw() の通し番号。
+        out を省略したときの配列は get_current_panorama_array() と同じく使い回される。
+        """
+        if self.backend == "cpu":
+            return self.frame_index, self.get_current_panorama_array(out)
+        if not self.readback_pbos:
+            raise RuntimeError("readback_buffers=0 のため非同期読み出しは使えません")
+
+        self.window.switch_to()
+        glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
+        head = self.readback_head
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.readback_pbos[head])
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        self.readback_pending[head] = (self.frame_index, fence)
+
+        self.readback_head = (head + 1) % len(self.readback_pbos)
+        return self._map_readback_buffer(self.readback_head, self.async_frame_buffer if out is None else out)
+
+    def read_panorama_frame_async(self):
+        """read_panorama_array_async() の PIL.Image 版"""
+        from PIL import Image
+        frame = self.read_panorama_array_async(out=self.new_frame_buffer())
+        if frame is None:
+            return None
+        return frame[0], Image.fromarray(frame[1], "RGBA")
+
+    def flush_panorama_frames(self):
+        """PBOに残っているフレームを古い順にすべて (frame_index, array) で取り出す"""
+        frames = []
+        for i in range(len(self.readback_pbos)):
+            slot = (self.readback_head + i) % len(self.readback_pbos)
+            if self.readback_pending[slot] is not None:
+                frames.append(self._map_readback_buffer(slot, self.new_frame_buffer()))
+        return frames
+
+    def _map_readback_buffer(self, slot, out):
+        pending = self.readback_pending[slot]
+        if pending is None:
+            return None
+        frame_index, fence = pending
+        self.readback_pending[slot] = None
+
+        glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, GL_TIMEOUT_IGNORED)
+        glDeleteSync(fence)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.readback_pbos[slot])
+        ptr = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, out.nbytes, GL_MAP_READ_BIT)
+        ctypes.memmove(out.ctypes.data, ptr, out.nbytes)
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        return frame_index, out
+
+    def set_cube_texture_from_image(self, image):
+        """cube用テクスチャを PIL.Image / ndarray から更新"""
+        pixels = _as_rgba_array(image, self.height, self.width)
         self.cube_window.switch_to()
         glBindTexture(GL_TEXTURE_2D, self.cube_texture_id)
-        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, pil_image.width, pil_image.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, img_data)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, pixels.shape[1], pixels.shape[0], 0, GL_RGBA, GL_UNSIGNED_BYTE, pixels)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
         glBindTexture(GL_TEXTURE_2D, 0)
-        glFinish()  # ← 追加
-    
+
     def on_draw(self):
-        if self.use_offscreen:
-            glBindFramebuffer(GL_FRAMEBUFFER, self.fbo)
-            glViewport(0, 0, self.width, self.height)
-        else:
-            self.window.switch_to()
-            glViewport(0, 0, self.width, self.height)
+        if self.backend == "cpu":
+            blend = None
+            if self.transition is not None:
+                blend = transition_weight(self.transition, self.transition_progress, self.face_size, self.height,
+                                          self._wipe_axis(), self.transition_softness, self.transition_stagger)
+            if self.rotation is not None:
+                self.cpu_renderer.render_rotation(self.rotation, out=self.cpu_frame, blend=blend)
+            else:
+                self.cpu_renderer.render(self.axis.value, self.degree, out=self.cpu_frame, blend=blend)
+            if self.text_overlay is not None:
+                self.text_overlay.composite(self.cpu_frame)
+            if self.post_process is not None:
+                self.power_estimate = self.post_process.apply(self.cpu_frame, self.face_size)
+                self.post_processed = True
+            self.frame_index += 1
+            self.frame_version = self.content_version
+            return
+        self.window.switch_to()
+        # 後処理するときは一度 scene_fbo に描き、_post_process_pass() で self.fbo に書く
+        glBindFramebuffer(GL_FRAMEBUFFER, self.scene_fbo if self.post_process is not None else self.fbo)
+        glViewport(0, 0, self.width, self.height)
 
         glClearColor(0.1, 0.1, 0.1, 1.0)
         glClear(GL_COLOR_BUFFER_BIT)
-        glUseProgram(self.shader_program)
+        if self.rotation is not None:
+            program = self._use_cubemap_program()
+        else:
+            program = self.shader_program
+            glUseProgram(program)
+            glUniform1f(glGetUniformLocation(program, "u_Scroll"), self.scroll)
+            glUniform1f(glGetUniformLocation(program, "u_Angle"), self.angle)
+            self._set_face_table(self.axis.value)
         glActiveTexture(GL_TEXTURE0)
         glBindTexture(GL_TEXTURE_2D, self.texture_id)
-        glUniform1i(glGetUniformLocation(self.shader_program, "u_Texture"), 0)
-        glUniform1f(glGetUniformLocation(self.shader_program, "u_Scroll"), self.scroll)
-        glUniform1f(glGetUniformLocation(self.shader_program, "u_Angle"), self.angle)
-        glUniform1i(glGetUniformLocation(self.shader_program, "u_Axis"), self.axis.value)
+        glUniform1i(glGetUniformLocation(program, "u_Texture"), 0)
+        glUniform1i(glGetUniformLocation(program, "u_FlipY"), True)
+        self._set_transition_uniforms(program)
+        self._set_text_uniforms(program)
         glBindVertexArray(self.vao)
         glDrawElements(GL_TRIANGLES, 6, GL_UNSIGNED_INT, None)
         glBindVertexArray(0)
         glBindTexture(GL_TEXTURE_2D, 0)
+        if self.post_process is not None:
+            self._post_process_pass()
+            self.post_processed = True
+        self.frame_index += 1
+        self.frame_version = self.content_version
 
-        if self.use_offscreen:
-            glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        if not self.use_offscreen:
+            # FBOは上下反転しているので、画面へは戻しながらblitする
+            glBindFramebuffer(GL_READ_FRAMEBUFFER, self.fbo)
+            glBindFramebuffer(GL_DRAW_FRAMEBUFFER, 0)
+            glBlitFramebuffer(0, 0, self.width, self.height, 0, self.height, self.width, 0,
+                              GL_COLOR_BUFFER_BIT, GL_NEAREST)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
     
+    def _set_transition_uniforms(self, program):
+        if self.transition is None:
+            glUniform1i(glGetUniformLocation(program, "u_TransitionMode"), 0)
+            return
+        # 次のパノラマはユニット1 (呼び出し後はユニット0に戻す)
+        glActiveTexture(GL_TEXTURE1)
+        glBindTexture(GL_TEXTURE_2D, self.next_texture_id)
+        glActiveTexture(GL_TEXTURE0)
+        glUniform1i(glGetUniformLocation(program, "u_NextTexture"), 1)
+        glUniform1i(glGetUniformLocation(program, "u_TransitionMode"), TRANSITION_MODES[self.transition])
+        glUniform1f(glGetUniformLocation(program, "u_Progress"), self.transition_progress)
+        glUniform3f(glGetUniformLocation(program, "u_WipeAxis"), *self._wipe_axis())
+        glUniform1f(glGetUniformLocation(program, "u_Softness"), self.transition_softness)
+        glUniform1f(glGetUniformLocation(program, "u_Stagger"), self.transition_stagger)
+
+    def _set_text_uniforms(self, program):
+        active = self.text_overlay.active() if self.text_overlay is not None else []
+        glUniform1i(glGetUniformLocation(program, "u_TextCount"), len(active))
+        if not active:
+            return
+        # アトラスはユニット2、列の表はユニット3 (ユニット0のパノラマのバインドを崩さないように先に切り替える)
+        glActiveTexture(GL_TEXTURE2)
+        self._upload_text_textures()
+        glBindTexture(GL_TEXTURE_2D, self.glyph_texture)
+        glActiveTexture(GL_TEXTURE3)
+        glBindTexture(GL_TEXTURE_2D, self.text_columns_texture)
+        glActiveTexture(GL_TEXTURE0)
+        glUniform1i(glGetUniformLocation(program, "u_GlyphAtlas"), 2)
+        glUniform1i(glGetUniformLocation(program, "u_TextColumns"), 3)
+        glUniform2f(glGetUniformLocation(program, "u_FaceSize"), self.face_size, self.height)
+        rect, layout, color = self.text_overlay.uniforms()
+        glUniform4fv(glGetUniformLocation(program, "u_TextRect"), len(rect), rect)
+        glUniform4fv(glGetUniformLocation(program, "u_TextLayout"), len(layout), layout)
+        glUniform4fv(glGetUniformLocation(program, "u_TextColor"), len(color), color)
+
+    def _upload_text_textures(self):
+        """アトラスに文字が増えたときと文字列が変わったときだけテクスチャを作り直す"""
+        overlay = self.text_overlay
+        if self.glyph_texture is None:
+            self.glyph_texture = glGenTextures(1)
+            self.text_columns_texture = glGenTextures(1)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        if self.glyph_texture_version != (id(overlay.atlas), overlay.atlas.version):
+            pixels = overlay.atlas.pixels
+            glBindTexture(GL_TEXTURE_2D, self.glyph_texture)
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_R8, pixels.shape[1], pixels.shape[0], 0, GL_RED, GL_UNSIGNED_BYTE,
+                         pixels)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            self.glyph_texture_version = (id(overlay.atlas), overlay.atlas.version)
+        if self.text_columns_version != overlay.layout_version:
+            table = overlay.columns_array()
+            glBindTexture(GL_TEXTURE_2D, self.text_columns_texture)
+            glTexImage2D(GL_TEXTURE_2D, 0, GL_RG32F, table.shape[1], table.shape[0], 0, GL_RG, GL_FLOAT, table)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            self.text_columns_version = overlay.layout_version
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+
+    def _use_cubemap_program(self):
+        if self.cubemap_program is None:
+            self.cubemap_program = compile_program(PANORAMA_VERTEX_SHADER, CUBEMAP_FRAGMENT_SHADER,
+                                                   self.shader_cache_dir)
+        glUseProgram(self.cubemap_program)
+        glUniformMatrix3fv(glGetUniformLocation(self.cubemap_program, "u_Rotation"), 1, GL_TRUE, self.rotation)
+        glUniform2f(glGetUniformLocation(self.cubemap_program, "u_TexelInset"),
+                    0.5 / self.face_size, 0.5 / self.height)
+        return self.cubemap_program
+
+    def _set_face_table(self, mode):
+        """回転モードの面の隣接表をシェーダの uniform 配列に入れる (モードが変わったときだけ)"""
+        if self.face_table_mode == mode:
+            return
+        face_params, transitions = build_face_table(mode)
+        glUniform4fv(glGetUniformLocation(self.shader_program, "u_FaceParams"), len(face_params), face_params)
+        glUniform4fv(glGetUniformLocation(self.shader_program, "u_FaceTransitions"), len(transitions), transitions)
+        self.face_table_mode = mode
+
+    def render_sequence(self, axis: RotationAxis, degrees, out=None, panorama=None):
+        """複数の角度をまとめて描画し (N, H, W*6, 4) の uint8 配列で返す
+
+        GLでは角度ごとに縦長FBOのタイルへ描画し、最後に1回だけ読み出す。
+        描画状態 (axis/angle/scroll) は変更しない。切り替え中でも現在のパノラマだけを描画し、文字列も重ねない。
+        panorama を渡すと表示中のパノラマの代わりにそれを描画する (表示中のパノラマと content_version は変えない)。
+        """
+        degrees = list(degrees)
+        if out is None:
+            out = np.empty((len(degrees), self.height, self.width, 4), dtype=np.uint8)
+        pixels = None if panorama is None else _as_rgba_array(panorama, self.height, self.width)
+        if self.backend == "cpu":
+            source = self.cpu_renderer.source if pixels is None else pixels
+            if source.shape != self.cpu_renderer.source.shape:
+                raise ValueError(f"panorama must be {self.cpu_renderer.source.shape}, got {source.shape}")
+            for i, degree in enumerate(degrees):
+                index, weight = self.cpu_renderer.remap_table(axis.value, degree)
+                apply_remap_table(source, index, weight, out[i])
+            return out
+
+        self.window.switch_to()
+        texture_id = self.texture_id
+        if pixels is not None:
+            # 表示中のテクスチャを書き換えないように専用のテクスチャへ入れる
+            if getattr(self, "sequence_panorama_texture", None) is None:
+                self.sequence_panorama_texture = glGenTextures(1)
+            self._upload_texture(self.sequence_panorama_texture, pixels)
+            texture_id = self.sequence_panorama_texture
+        tiles = self._init_sequence_framebuffer(len(degrees))
+        glBindFramebuffer(GL_FRAMEBUFFER, self.sequence_fbo)
+        glUseProgram(self.shader_program)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, texture_id)
+        glUniform1i(glGetUniformLocation(self.shader_program, "u_Texture"), 0)
+        self._set_face_table(axis.value)
+        glUniform1i(glGetUniformLocation(self.shader_program, "u_FlipY"), True)
+        glUniform1i(glGetUniformLocation(self.shader_program, "u_TransitionMode"), 0)
+        glUniform1i(glGetUniformLocation(self.shader_program, "u_TextCount"), 0)
+        scroll_loc = glGetUniformLocation(self.shader_program, "u_Scroll")
+        angle_loc = glGetUniformLocation(self.shader_program, "u_Angle")
+        glBindVertexArray(self.vao)
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        for start in range(0, len(degrees), tiles):
+            chunk = degrees[start:start + tiles]
+            for i, degree in enumerate(chunk):
+                # タイル i は FBO の下から i 番目。タイル内は上下反転して描くので読み出すと順番通りに並ぶ
+                glViewport(0, i * self.height, self.width, self.height)
+                glUniform1f(scroll_loc, (degree / 90.0) % 4.0)
+                glUniform1f(angle_loc, np.radians(degree))
+                glDrawElements(GL_TRIANGLES, 6, GL_UNSIGNED_INT, None)
+            glReadPixels(0, 0, self.width, self.height * len(chunk), GL_RGBA, GL_UNSIGNED_BYTE,
+                         out[start:start + len(chunk)])
+        glBindVertexArray(0)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        return out
+
+    def _init_sequence_framebuffer(self, count):
+        # テクスチャサイズの上限までタイルを縦に積む。足りない分は複数回に分けて描画する
+        max_size = min(glGetIntegerv(GL_MAX_TEXTURE_SIZE), glGetIntegerv(GL_MAX_VIEWPORT_DIMS)[1])
+        tiles = max(1, min(count, max_size // self.height))
+        if getattr(self, "sequence_tiles", 0) >= tiles:
+            return self.sequence_tiles
+        if getattr(self, "sequence_fbo", None):
+            glDeleteFramebuffers(1, [self.sequence_fbo])
+            glDeleteTextures(1, [self.sequence_tex])
+        self.sequence_fbo = glGenFramebuffers(1)
+        self.sequence_tex = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_2D, self.sequence_tex)
+        glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA, self.width, self.height * tiles, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.sequence_fbo)
+        glFramebufferTexture2D(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_TEXTURE_2D, self.sequence_tex, 0)
+        assert glCheckFramebufferStatus(GL_FRAMEBUFFER) == GL_FRAMEBUFFER_COMPLETE
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        self.sequence_tiles = tiles
+        return tiles
+
     def cube_on_draw(self):
         self.cube_window.switch_to()
         glClearColor(0.2, 0.2, 0.2, 1.0)
@@ -253,7 +1011,11 @@ class ScrollRenderer:
         glEnable(GL_DEPTH_TEST)
         glUseProgram(self.cube_shader_program)
         glActiveTexture(GL_TEXTURE0)
-        glBindTexture(GL_TEXTURE_2D, self.cube_texture_id)
+        if self.backend == "gl":
+            # FBOに描画した結果をそのままサンプルする
+            glBindTexture(GL_TEXTURE_2D, self.offscreen_tex)
+        else:
+            glBindTexture(GL_TEXTURE_2D, self.cube_texture_id)
         glUniform1i(glGetUniformLocation(self.cube_shader_program, "u_Texture"), 0)
 
         # MVP行列を計算して渡す
@@ -285,16 +1047,25 @@ class ScrollRenderer:
             self.cube_rot_y += dx
 
     def cleanup(self):
-        if self.shader_program:
+        if getattr(self, "profiler", None):
+            self.disable_profiling()
+        # CPUバックエンドではパノラマ用のGLリソースは作られない
+        if getattr(self, "shader_program", None):
             glDeleteProgram(self.shader_program)
-        if self.vao:
+        if getattr(self, "cubemap_program", None):
+            glDeleteProgram(self.cubemap_program)
+        if getattr(self, "vao", None):
             glDeleteVertexArrays(1, [self.vao])
-        if self.vbo:
+        if getattr(self, "vbo", None):
             glDeleteBuffers(1, [self.vbo])
-        if self.ebo:
+        if getattr(self, "ebo", None):
             glDeleteBuffers(1, [self.ebo])
-        if self.texture_id:
+        if getattr(self, "texture_id", None):
             glDeleteTextures(1, [self.texture_id])
+        if getattr(self, "next_texture_id", None):
+            glDeleteTextures(1, [self.next_texture_id])
+        if getattr(self, "glyph_texture", None):
+            glDeleteTextures(2, [self.glyph_texture, self.text_columns_texture])
         if hasattr(self, "cube_vao"):
             glDeleteVertexArrays(1, [self.cube_vao])
         if hasattr(self, "cube_vbo"):
@@ -305,3 +1076,23 @@ class ScrollRenderer:
             glDeleteFramebuffers(1, [self.fbo])
         if hasattr(self, "offscreen_tex") and self.offscreen_tex:
             glDeleteTextures(1, [self.offscreen_tex])
+        if getattr(self, "sequence_fbo", None):
+            glDeleteFramebuffers(1, [self.sequence_fbo])
+            glDeleteTextures(1, [self.sequence_tex])
+        if getattr(self, "sequence_panorama_texture", None):
+            glDeleteTextures(1, [self.sequence_panorama_texture])
+        if getattr(self, "post_program", None):
+            glDeleteProgram(self.luminance_program)
+            glDeleteProgram(self.post_program)
+            glDeleteFramebuffers(2, [self.scene_fbo, self.luminance_fbo])
+            glDeleteTextures(3, [self.scene_texture, self.luminance_texture, self.gamma_lut_texture])
+        if getattr(self, "upload_pbo", None):
+            glDeleteBuffers(1, [self.upload_pbo])
+        if getattr(self, "readback_pbos", None):
+            for pending in self.readback_pending:
+                if pending is not None:
+                    glDeleteSync(pending[1])
+            glDeleteBuffers(len(self.readback_pbos), self.readback_pbos)
+        # CPUバックエンドは headless=True でもコンテキストを作らない
+        if getattr(self, "headless", False) and hasattr(self, "window"):
+            self.window.close()
@@ -1,416 +1,236 @@
+from .face_table import FACE_CENTERS, FACE_RIGHT, FACE_UP
+
 PANORAMA_VERTEX_SHADER = """
 #version 330 core
 layout(location = 0) in vec2 a_Position;
 layout(location = 1) in vec2 a_TexCoord;
+// FBOへ描画するときは上下反転し、glReadPixelsの結果が行0=上端になるようにする
+uniform bool u_FlipY;
 out vec2 v_TexCoord;
 void main() {
-    gl_Position = vec4(a_Position, 0.0, 1.0);
+    vec2 pos = u_FlipY ? vec2(a_Position.x, -a_Position.y) : a_Position;
+    gl_Position = vec4(pos, 0.0, 1.0);
     v_TexCoord = a_TexCoord;
 }
 """
 
-PANORAMA_FRAGMENT_SHADER = """
-#version 330 core
-in vec2 v_TexCoord;
-out vec4 FragColor;
-uniform sampler2D u_Texture;
-uniform float u_Scroll;
-uniform float u_Angle;
-uniform int u_Axis;
+def _vec3_array(name, values):
+    items = ", ".join("vec3({}, {}, {})".format(*(float(x) for x in v)) for v in values)
+    return f"const vec3 {name}[6] = vec3[6]({items});"
 
-void main() {
-    float face_width = 1.0 / 6.0;
-    float u = v_TexCoord.x;
-    float v = v_TexCoord.y;
-    vec2 uv = vec2(u, v);
 
-    // --- Y軸回転処理 ---
-    if (u_Axis == 1) {
-        // top
-        if(u < face_width) {
-            vec2 local = vec2(u / face_width, v);
-            vec2 rel = local - vec2(0.5, 0.5);
-            float angle = u_Angle;
-            float cosA = cos(angle);
-            float sinA = sin(angle);
-            vec2 rot = vec2(
-                rel.x * cosA - rel.y * sinA,
-                rel.x * sinA + rel.y * cosA
-            );
-            local = rot + vec2(0.5, 0.5);
-            uv = vec2(local.x * face_width, local.y) + vec2(0.0, 0.0);
-        }
-        // bottom
-        else if(u >= 5.0 * face_width) {
-            vec2 local = vec2((u - 5.0 * face_width) / face_width, v);
-            vec2 rel = local - vec2(0.5, 0.5);
-            float angle = -u_Angle;
-            float cosA = cos(angle);
-            float sinA = sin(angle);
-            vec2 rot = vec2(
-                rel.x * cosA - rel.y * sinA,
-                rel.x * sinA + rel.y * cosA
-            );
-            local = rot + vec2(0.5, 0.5);
-            uv = vec2(local.x * face_width, local.y) + vec2(5.0 * face_width, 0.0);
-        }
-        // 側面スクロール
-        else if(u >= face_width && u < 5.0 * face_width) {
-            float rel = (u - face_width) / (4.0 * face_width);
-            rel = mod(rel + u_Scroll / 4.0, 1.0);
-            u = face_width + rel * 4.0 * face_width;
-            uv = vec2(u, v);
-        }
+# 面0〜5の立方体上の向き (face_table.FACE_CENTERS などと同じ値)
+CUBE_FACES_GLSL = "\n".join([
+    _vec3_array("FACE_CENTERS", FACE_CENTERS),
+    _vec3_array("FACE_RIGHT", FACE_RIGHT),
+    _vec3_array("FACE_UP", FACE_UP),
+]) + "\n"
+
+# 現在のパノラマ (u_Texture) から次のパノラマ (u_NextTexture) への切り替え
+# 両方を同じ回転後のuvでサンプルし、出力の位置で決まる割合で混ぜる
+TRANSITION_FUNCTION = """
+uniform sampler2D u_NextTexture;
+// 0:なし 1:クロスフェード 2:回転軸方向のワイプ 3:面ごとに時間差で切り替え
+uniform int u_TransitionMode;
+uniform float u_Progress;
+uniform vec3 u_WipeAxis;
+uniform float u_Softness;
+uniform float u_Stagger;
+
+float transition_weight(vec2 uv) {
+    float f = min(floor(uv.x * 6.0), 5.0);
+    int face = int(f);
+    if (u_TransitionMode == 2) {
+        vec2 local = vec2(uv.x * 6.0 - f, uv.y) * 2.0 - 1.0;
+        vec3 pos = FACE_CENTERS[face] + local.x * FACE_RIGHT[face] + local.y * FACE_UP[face];
+        float t = (dot(pos, u_WipeAxis) + 1.0) * 0.5;
+        float edge = u_Progress * (1.0 + u_Softness);
+        return 1.0 - smoothstep(edge - u_Softness, edge, t);
     }
+    if (u_TransitionMode == 3) {
+        return clamp((u_Progress - f * u_Stagger) / (1.0 - 5.0 * u_Stagger), 0.0, 1.0);
+    }
+    return u_Progress;
+}
 
-    // --- X軸回転処理 ---
-    else if (u_Axis == 0) {
-        // right面（その場で回転）
-        if(u >= 2.0 * face_width && u < 3.0 * face_width) {
-            vec2 local = vec2((u - 2.0 * face_width) / face_width, v);
-            vec2 rel = local - vec2(0.5, 0.5);
-            float angle = u_Angle;
-            float cosA = cos(angle);
-            float sinA = sin(angle);
-            vec2 rot = vec2(
-                rel.x * cosA - rel.y * sinA,
-                rel.x * sinA + rel.y * cosA
-            );
-            local = rot + vec2(0.5, 0.5);
-            uv = vec2(local.x * face_width, local.y) + vec2(2.0 * face_width, 0.0);
-        }
-        // left面（その場で回転）
-        else if(u >= 4.0 * face_width && u < 5.0 * face_width) {
-            vec2 local = vec2((u - 4.0 * face_width) / face_width, v);
-            vec2 rel = local - vec2(0.5, 0.5);
-            float angle = -u_Angle;
-            float cosA = cos(angle);
-            float sinA = sin(angle);
-            vec2 rot = vec2(
-                rel.x * cosA - rel.y * sinA,
-                rel.x * sinA + rel.y * cosA
-            );
-            local = rot + vec2(0.5, 0.5);
-            uv = vec2(local.x * face_width, local.y) + vec2(4.0 * face_width, 0.0);
-        }
-        // top, front, bottom, back の循環スクロール
-        else {
-            float fw = face_width;
-            float local_u, local_v;
-            int face = -1;
-            if(u < fw) { face = 0; local_u = u / fw; local_v = v; }           // top
-            else if(u < 2.0*fw) { face = 1; local_u = (u-fw)/fw; local_v = v; } // front
-            else if(u < 4.0*fw) { face = 3; local_u = (u-3.0*fw)/fw; local_v = v; } // back
-            else { face = 5; local_u = (u-5.0*fw)/fw; local_v = v; }                // bottom
+// out_uv は出力のuv、uv はサンプル元のuv
+vec4 panorama_color(vec2 out_uv, vec2 uv) {
+    // テクスチャは画像の行0(上端)をそのままアップロードしているのでvを反転してサンプルする
+    vec2 st = vec2(uv.x, 1.0 - uv.y);
+    vec4 color = texture(u_Texture, st);
+    if (u_TransitionMode == 0) {
+        return color;
+    }
+    return mix(color, texture(u_NextTexture, st), transition_weight(out_uv));
+}
+"""
 
-            // top, front, bottom, back のみ循環
-            int tfbb_face = -1;
-            float tfbb_u = local_u, tfbb_v = local_v;
-            if(face == 0) tfbb_face = 0;
-            else if(face == 1) tfbb_face = 1;
-            else if(face == 5) tfbb_face = 2;
-            else if(face == 3) tfbb_face = 3;
+# 出力に重ねる文字列の最大数 (text_overlay.TextOverlay)
+MAX_TEXTS = 4
 
-            if(tfbb_face >= 0) {
-                // 0:top, 1:front, 2:bottom, 3:back
-                float scroll = u_Scroll; // 0〜4
-                float rel;
-                int seg = 0;
-                float frac = 0.0;
-                if (tfbb_face == 0 || tfbb_face == 3) {
-                    // top, back: 上から下へ
-                    rel = tfbb_v + scroll;
-                    seg = int(floor(rel));
-                    frac = rel - float(seg);
-                } else {
-                    // front, bottom: 下から上へ
-                    rel = tfbb_v - scroll;
-                    seg = -int(floor(rel));
-                    frac = rel + float(seg);
-                }
+# 出力の面に文字列を重ねる。列の表 (u_TextColumns の行 i) で表示位置の列からアトラスの列を引く
+# u_TextRect[i] = (面, left, top, 表示幅)、u_TextLayout[i] = (スクロール量, 列数, 行の高さ, 拡大率)
+TEXT_OVERLAY_FUNCTION = """
+#define MAX_TEXTS {max_texts}
+uniform sampler2D u_GlyphAtlas;
+uniform sampler2D u_TextColumns;
+uniform int u_TextCount;
+uniform vec2 u_FaceSize;
+uniform vec4 u_TextRect[MAX_TEXTS];
+uniform vec4 u_TextLayout[MAX_TEXTS];
+uniform vec4 u_TextColor[MAX_TEXTS];
 
+vec4 text_overlay(vec2 uv, vec4 color) {{
+    // 出力画像のピクセル中心の座標 (yは上端から)。誤差でスクロール量の境界がずれないよう中心に揃える
+    vec2 px = floor(vec2(uv.x * 6.0 * u_FaceSize.x, (1.0 - uv.y) * u_FaceSize.y)) + 0.5;
+    for (int i = 0; i < u_TextCount; i++) {{
+        vec4 rect = u_TextRect[i];
+        vec4 params = u_TextLayout[i];
+        vec2 p = px - vec2(rect.x * u_FaceSize.x + rect.y, rect.z);
+        if (p.x < 0.0 || p.x >= rect.w || p.y < 0.0) {{
+            continue;
+        }}
+        p /= params.w;
+        if (p.y >= params.z) {{
+            continue;
+        }}
+        float column = mod(floor(p.x + params.x), params.y);
+        vec2 cell = texelFetch(u_TextColumns, ivec2(int(column), i), 0).xy;
+        if (cell.x < 0.0) {{
+            continue;
+        }}
+        float alpha = texelFetch(u_GlyphAtlas, ivec2(int(cell.x), int(cell.y + floor(p.y))), 0).r * u_TextColor[i].a;
+        color.rgb = mix(color.rgb, u_TextColor[i].rgb, alpha);
+    }}
+    return color;
+}}
+""".format(max_texts=MAX_TEXTS)
 
-                // 面インデックスを循環
-                int new_face = (tfbb_face + seg) % 4;
-                if(new_face < 0) new_face += 4;
+# 面の隣接表 (face_table.build_face_table) で出力のuvをサンプル元のuvに変換する関数
+# 回転モードごとの違いはすべて表のデータにあり、表は FACE_PARAMS(i) / FACE_TRANSITIONS(i) で引く
+# (1台分のシェーダは FACE_TABLE_UNIFORMS、複数キューブ用はインスタンスの回転モードの表を引くマクロを定義する)
+FACE_TABLE_UNIFORMS = """
+uniform vec4 u_FaceParams[12];
+uniform vec4 u_FaceTransitions[72];
+#define FACE_PARAMS(i) u_FaceParams[i]
+#define FACE_TRANSITIONS(i) u_FaceTransitions[i]
+"""
 
-                // 180度回転が必要な面（top→front, bottom→back）
-                bool flip = false;
-                if (tfbb_face == 0) {// top
-                    if (new_face == 0) {
-                        flip = false;
-                    }
-                    else if (new_face == 1) {
-                        flip = true;
-                    }
-                    else if (new_face == 2) {
-                        flip = true;
-                    }
-                    else if (new_face == 3) {
-                        flip = false;
-                    }
-                } 
-                else if (tfbb_face == 1) {// front
-                    if (new_face == 0) {
-                        flip = true;
-                    }
-                    else if (new_face == 1) {
-                        flip = false;
-                    }
-                    else if (new_face == 2) {
-                        flip = false;
-                    }
-                    else if (new_face == 3) {
-                        flip = true;
-                    }
-                }
-                else if (tfbb_face == 2) { // bottom
-                    if (new_face == 0) {
-                        flip = true;
-                    }
-                    else if (new_face == 1) {
-                        flip = false;
-                    }
-                    else if (new_face == 2) {
-                        flip = false;
-                    }
-                    else if (new_face == 3) {
-                        flip = true;
-                    }
-                }
-                else if (tfbb_face == 3) { // back
-                    if (new_face == 0) {
-                        flip = false;
-                    }
-                    else if (new_face == 1) {
-                        flip = true;
-                    }
-                    else if (new_face == 2) {
-                        flip = true;
-                    }
-                    else if (new_face == 3) {
-                        flip = false;
-                    }
-                }
-                float new_u = flip ? (1.0 - tfbb_u) : tfbb_u;
-                float new_v = flip ? (1.0 - frac) : frac;
+PANORAMA_UV_FUNCTION = """
+vec2 panorama_uv(vec2 uv, float angle, float scroll) {
+    float f = min(floor(uv.x * 6.0), 5.0);
+    int face = int(f);
+    vec2 local = vec2(uv.x * 6.0 - f, uv.y);
+    vec4 coef = FACE_PARAMS(face * 2);
+    vec4 param = FACE_PARAMS(face * 2 + 1);
 
-                // 各面のテクスチャ座標
-                float base_u = 0.0;
-                if(new_face == 0) base_u = 0.0 * fw;      // top
-                else if(new_face == 1) base_u = 1.0 * fw; // front
-                else if(new_face == 2) base_u = 5.0 * fw; // bottom
-                else if(new_face == 3) base_u = 3.0 * fw; // back
+    // その場で回転する面 (回転しない面は param.x が0なので恒等変換)
+    float a = angle * param.x;
+    local = mat2(cos(a), sin(a), -sin(a), cos(a)) * (local - 0.5) + 0.5;
 
-                uv = vec2(new_u * fw, new_v) + vec2(base_u, 0.0);
-            }
-        }
-    }
-    // --- Z軸回転処理 ---
-    else if (u_Axis == 2) {
-        // front面（その場で回転）
-        if(u >= face_width && u < 2.0 * face_width) {
-            vec2 local = vec2((u - face_width) / face_width, v);
-            vec2 rel = local - vec2(0.5, 0.5);
-            float angle = u_Angle;
-            float cosA = cos(angle);
-            float sinA = sin(angle);
-            vec2 rot = vec2(
-                rel.x * cosA - rel.y * sinA,
-                rel.x * sinA + rel.y * cosA
-            );
-            local = rot + vec2(0.5, 0.5);
-            uv = vec2(local.x * face_width, local.y) + vec2(face_width, 0.0);
-        }
-        // back面（その場で回転）
-        else if(u >= 3.0 * face_width && u < 4.0 * face_width) {
-            vec2 local = vec2((u - 3.0 * face_width) / face_width, v);
-            vec2 rel = local - vec2(0.5, 0.5);
-            float angle = -u_Angle;
-            float cosA = cos(angle);
-            float sinA = sin(angle);
-            vec2 rot = vec2(
-                rel.x * cosA - rel.y * sinA,
-                rel.x * sinA + rel.y * cosA
-            );
-            local = rot + vec2(0.5, 0.5);
-            uv = vec2(local.x * face_width, local.y) + vec2(3.0 * face_width, 0.0);
-        }
-        // top, right, bottom, left の循環スクロール
-        else {
-            float fw = face_width;
-            float local_u, local_v;
-            int face = -1;
-            if(u < fw) { face = 0; local_u = u / fw; local_v = v; }           // top
-            else if(u >= 2.0*fw && u < 3.0*fw) { face = 2; local_u = (u-2.0*fw)/fw; local_v = v; } // right
-            else if(u >= 4.0*fw && u < 5.0*fw) { face = 4; local_u = (u-4.0*fw)/fw; local_v = v; } // left
-            else if(u >= 5.0*fw) { face = 5; local_u = (u-5.0*fw)/fw; local_v = v; }               // bottom
+    // リング上の何面先に移るかと、移動先の面内の位置
+    float rel = dot(coef, vec4(local, 1.0, scroll));
+    float seg = floor(rel);
+    int n = int(mod(param.z + param.y * seg, 4.0));
+    int t = (face * 4 + n) * 3;
+    vec4 p = vec4(local, rel - seg, 1.0);
+    vec2 dst = vec2(dot(FACE_TRANSITIONS(t), p), dot(FACE_TRANSITIONS(t + 1), p));
+    return vec2((FACE_TRANSITIONS(t + 2).x + dst.x) / 6.0, dst.y);
+}
+"""
 
-            // top, right, bottom, left のみ循環
-            int trbl_face = -1;
-            float trbl_u = local_u, trbl_v = local_v;
-            if(face == 0) trbl_face = 0; // top
-            else if(face == 2) trbl_face = 1; // right
-            else if(face == 5) trbl_face = 2; // bottom
-            else if(face == 4) trbl_face = 3; // left
+PANORAMA_FRAGMENT_SHADER = """
+#version 330 core
+in vec2 v_TexCoord;
+out vec4 FragColor;
+uniform sampler2D u_Texture;
+uniform float u_Scroll;
+uniform float u_Angle;
+""" + CUBE_FACES_GLSL + FACE_TABLE_UNIFORMS + PANORAMA_UV_FUNCTION + TRANSITION_FUNCTION + TEXT_OVERLAY_FUNCTION + """
+void main() {
+    vec4 color = panorama_color(v_TexCoord, panorama_uv(v_TexCoord, u_Angle, u_Scroll));
+    FragColor = text_overlay(v_TexCoord, color);
+}
+"""
 
-            if(trbl_face >= 0) {
-                // 0:top, 1:right, 2:bottom, 3:left
-                float scroll = u_Scroll; // 0〜4
-                float rel;
-                int seg = 0;
-                float frac = 0.0;
-                if(trbl_face == 0) {
-                    // top: 右から左へ
-                    rel = trbl_u + scroll;
-                    seg =  - int(floor(rel));
-                    frac = rel + float(seg);
-                } else if(trbl_face == 1) {
-                    // right: 上から下へ
-                    rel = trbl_v + scroll;
-                    seg = - int(floor(rel));
-                    frac = rel + float(seg);
-                } else if(trbl_face == 2) {
-                    // bottom: 右から左へ
-                    rel = trbl_u + scroll;
-                    seg = - int(floor(rel));
-                    frac = rel + float(seg);
-                } else if(trbl_face == 3) {
-                    // left: 下から上へ
-                    rel = 1.0 - trbl_v + scroll;
-                    seg = -int(floor(rel));
-                    frac = rel + float(seg);
-                }
+# 複数キューブを縦長FBOのタイルへインスタンス描画する (multi_cube.MultiCubeRenderer)
+# a_Instance = (回転モード, 角度, スクロール, テクスチャ配列のレイヤー)。インスタンス i は下から i 番目のタイルに
+# 上下反転して描くので、読み出すとキューブ順・行0=上端に並ぶ
+MULTI_CUBE_VERTEX_SHADER = """
+#version 330 core
+layout(location = 0) in vec2 a_Position;
+layout(location = 1) in vec2 a_TexCoord;
+layout(location = 2) in vec4 a_Instance;
+uniform float u_Tiles;
+out vec2 v_TexCoord;
+flat out vec4 v_Instance;
+void main() {
+    float y = (float(gl_InstanceID) + 0.5 - a_Position.y * 0.5) / u_Tiles * 2.0 - 1.0;
+    gl_Position = vec4(a_Position.x, y, 0.0, 1.0);
+    v_TexCoord = a_TexCoord;
+    v_Instance = a_Instance;
+}
+"""
 
-                // 面インデックスを循環
-                int new_face = (trbl_face + seg) % 4;
-                if(new_face < 0) new_face += 4;
+MULTI_CUBE_FRAGMENT_SHADER = """
+#version 330 core
+in vec2 v_TexCoord;
+flat in vec4 v_Instance;
+out vec4 FragColor;
+uniform sampler2DArray u_Panoramas;
+// 3つの回転モードの表を並べたもの (モード m の表は m*12, m*72 から)
+layout(std140) uniform FaceTables {
+    vec4 u_AllFaceParams[36];
+    vec4 u_AllFaceTransitions[216];
+};
+#define FACE_PARAMS(i) u_AllFaceParams[int(v_Instance.x) * 12 + (i)]
+#define FACE_TRANSITIONS(i) u_AllFaceTransitions[int(v_Instance.x) * 72 + (i)]
+""" + PANORAMA_UV_FUNCTION + """
+void main() {
+    vec2 uv = panorama_uv(v_TexCoord, v_Instance.y, v_Instance.z);
+    FragColor = texture(u_Panoramas, vec3(uv.x, 1.0 - uv.y, v_Instance.w));
+}
+"""
 
-                float new_u = trbl_u;
-                float new_v = trbl_v;
-                float base_u = 0.0;
-                bool rotate90 = false;
-                bool inv_rotate90 = false;
-                bool flip = false;
+# パノラマを立方体マップとして任意の回転行列でサンプルする関数
+# 出力の各テクセルの方向ベクトルを u_Rotation で回し、その方向の面と面内座標を求める
+CUBEMAP_UV_FUNCTION = """
+uniform mat3 u_Rotation;
+// 面の端から半テクセル内側に寄せて、隣に並んだ別の面がにじまないようにする
+uniform vec2 u_TexelInset;
 
-                // 各面遷移ごとに90度回転やflipを考慮
-                if(trbl_face == 0) { // top
-                    if(new_face == 0) {
-                        new_u = frac;
-                        new_v = trbl_v;
-                        base_u = 0.0 * fw;
-                    }
-                    else if(new_face == 1) {
-                        new_u = 1.0 - trbl_v;
-                        new_v = frac;
-                        base_u = 2.0 * fw;
-                    }
-                    else if(new_face == 2) {
-                        new_u = 1.0 - frac;
-                        new_v = 1.0 - trbl_v;
-                        base_u = 5.0 * fw; flip = true; }
-                    else if(new_face == 3) {
-                        new_u = trbl_v;
-                        new_v = 1.0 - frac;
-                        base_u = 4.0 * fw;
-                    }
-                }
-                else if(trbl_face == 1) { // right
-                    if(new_face == 0) {
-                        new_u = 1.0 - frac;
-                        new_v = trbl_u;
-                        base_u = 0.0 * fw;
-                        flip = true;
-                    }
-                    else if(new_face == 1) {
-                        new_u = trbl_u;
-                        new_v = frac;
-                        base_u = 2.0 * fw;
-                    }
-                    else if(new_face == 2) {
-                        new_u = frac;
-                        new_v = 1.0 - trbl_u;
-                        base_u = 5.0 * fw;
-                    }
-                    else if(new_face == 3) {
-                        new_u = trbl_u;
-                        new_v = 1.0 - frac;
-                        base_u = 4.0 * fw;
-                    }
-                }
-                else if(trbl_face == 2) { // bottom
-                    if(new_face == 0) {
-                        new_u = 1.0 - frac;
-                        new_v = 1.0 - trbl_v;
-                        base_u = 0.0 * fw;
-                        flip = true;
-                    }
-                    else if(new_face == 1) {
-                        new_u = trbl_v;
-                        new_v = 1.0 - frac;
-                        base_u = 2.0 * fw;
-                        flip = true;
-                    }
-                    else if(new_face == 2) {
-                        new_u = frac;
-                        new_v = trbl_v;
-                        base_u = 5.0 * fw;
-                    }
-                    else if(new_face == 3) {
-                        new_u = 1.0 - trbl_v;
-                        new_v = frac;
-                        base_u = 4.0 * fw;
-                        flip = true;
-                    }
-                }
-                else if(trbl_face == 3) { // left
-                    if(new_face == 0) {
-                        new_u = 1.0 - frac;
-                        new_v = 1.0 - trbl_u;
-                        base_u = 0.0 * fw;
-                        flip = true;
-                    }
-                    else if(new_face == 1) {
-                        new_u = trbl_u;
-                        new_v = 1.0 - frac;
-                        base_u = 2.0 * fw;
-                        flip = true;
-                    }
-                    else if(new_face == 2) {
-                        new_u = frac;
-                        new_v = trbl_u;
-                        base_u = 5.0 * fw;
-                    }
-                    else if(new_face == 3) {
-                        new_u = 1.0 - trbl_u;
-                        new_v = frac;
-                        base_u = 4.0 * fw;
-                        flip = true;
-                        
-                    }
-                }
+vec2 cubemap_uv(vec2 uv) {
+    float f = min(floor(uv.x * 6.0), 5.0);
+    int face = int(f);
+    vec2 local = vec2(uv.x * 6.0 - f, uv.y) * 2.0 - 1.0;
+    vec3 dir = u_Rotation * (FACE_CENTERS[face] + local.x * FACE_RIGHT[face] + local.y * FACE_UP[face]);
 
-                // 90度回転
-                if(rotate90) {
-                    float tmp = new_u;
-                    new_u = new_v;
-                    new_v = tmp;
-                }
-                if(inv_rotate90) {
-                    float tmp = new_u;
-                    new_u = 1.0 - new_v;
-                    new_v = 1.0 - tmp;
-                }
-                // 上下反転
-                if(flip) {
-                    new_u = 1.0 - new_u;
-                    new_v = 1.0 - new_v;
-                }
-                uv = vec2(new_u * fw, new_v) + vec2(base_u, 0.0);
-            }
+    // いちばん向きの近い面
+    int src = 0;
+    float best = dot(dir, FACE_CENTERS[0]);
+    for (int i = 1; i < 6; i++) {
+        float d = dot(dir, FACE_CENTERS[i]);
+        if (d > best) {
+            best = d;
+            src = i;
         }
     }
-    FragColor = texture(u_Texture, uv);
+    vec3 p = dir / best;
+    vec2 st = (vec2(dot(p, FACE_RIGHT[src]), dot(p, FACE_UP[src])) + 1.0) * 0.5;
+    st = clamp(st, u_TexelInset, 1.0 - u_TexelInset);
+    return vec2((float(src) + st.x) / 6.0, st.y);
+}
+"""
+
+CUBEMAP_FRAGMENT_SHADER = """
+#version 330 core
+in vec2 v_TexCoord;
+out vec4 FragColor;
+uniform sampler2D u_Texture;
+""" + CUBE_FACES_GLSL + CUBEMAP_UV_FUNCTION + TRANSITION_FUNCTION + TEXT_OVERLAY_FUNCTION + """
+void main() {
+    vec4 color = panorama_color(v_TexCoord, cubemap_uv(v_TexCoord));
+    FragColor = text_overlay(v_TexCoord, color);
 }
 """
 
@@ -432,6 +252,89 @@ in vec2 v_TexCoord;
 out vec4 FragColor;
 uniform sampler2D u_Texture;
 void main() {
-    FragColor = texture(u_Texture, v_TexCoord);
+    // テクスチャは行0が上端
+    FragColor = texture(u_Texture, vec2(v_TexCoord.x, 1.0 - v_TexCoord.y));
+}
+"""
+# LEDへ出す前の後処理 (post_process.PostProcess)。描画済みのフレーム u_Frame (行0=上端) を画素単位で読む
+# 1画素の電流はガンマLUT後の r+g+b に比例する (1チャンネルを255で点灯したときを1とする)
+POST_PROCESS_COMMON = """
+uniform sampler2D u_Frame;
+// 256x1 のガンマLUT (0〜1)
+uniform sampler2D u_GammaLut;
+uniform float u_Brightness;
+// 面の大きさ (幅, 高さ)
+uniform ivec2 u_FaceSize;
+
+vec3 led_levels(vec3 color) {
+    ivec3 index = ivec3(color * 255.0 + 0.5);
+    return vec3(texelFetch(u_GammaLut, ivec2(index.r, 0), 0).r,
+                texelFetch(u_GammaLut, ivec2(index.g, 0), 0).r,
+                texelFetch(u_GammaLut, ivec2(index.b, 0), 0).r) * u_Brightness;
+}
+"""
+
+# 電流の縮約の1段目: (6P, P) のテクスチャの各画素に、面を P x P に分けたブロックの電流を書く
+# ブロックの大きさが不揃いでもミップマップの最上段 (6x1) が面の平均になるように、
+# ブロックの合計を面の画素数で割って P*P 倍しておく
+LUMINANCE_FRAGMENT_SHADER = """
+#version 330 core
+out vec4 FragColor;
+uniform int u_Blocks;
+""" + POST_PROCESS_COMMON + """
+void main() {
+    ivec2 cell = ivec2(gl_FragCoord.xy);
+    int face = cell.x / u_Blocks;
+    int bx = cell.x - face * u_Blocks;
+    int x0 = face * u_FaceSize.x + bx * u_FaceSize.x / u_Blocks;
+    int x1 = face * u_FaceSize.x + (bx + 1) * u_FaceSize.x / u_Blocks;
+    int y0 = cell.y * u_FaceSize.y / u_Blocks;
+    int y1 = (cell.y + 1) * u_FaceSize.y / u_Blocks;
+    float total = 0.0;
+    for (int y = y0; y < y1; y++) {
+        for (int x = x0; x < x1; x++) {
+            vec3 level = led_levels(texelFetch(u_Frame, ivec2(x, y), 0).rgb);
+            total += level.r + level.g + level.b;
+        }
+    }
+    FragColor = vec4(total * float(u_Blocks * u_Blocks) / float(u_FaceSize.x * u_FaceSize.y));
 }
-"""
\ No newline at end of file
+"""
+
+# 後処理の本体: ガンマLUTと明るさをかけ、電流の上限を超える面を減光する
+# 面ごとの平均は縮約テクスチャ u_Luminance のミップマップ u_LuminanceLevel (6x1) から読むので、読み出しを待たない
+POST_PROCESS_FRAGMENT_SHADER = """
+#version 330 core
+out vec4 FragColor;
+uniform sampler2D u_Luminance;
+uniform int u_LuminanceLevel;
+uniform float u_MaPerChannel;
+// 上限 (mA)。0以下なら制限しない
+uniform float u_MaxCurrent;
+uniform float u_FaceCurrent;
+""" + POST_PROCESS_COMMON + """
+float face_current(int face) {
+    float mean = texelFetch(u_Luminance, ivec2(face, 0), u_LuminanceLevel).r;
+    return mean * float(u_FaceSize.x * u_FaceSize.y) * u_MaPerChannel;
+}
+
+float face_scale(int face, float current) {
+    return u_FaceCurrent > 0.0 && current > u_FaceCurrent ? u_FaceCurrent / current : 1.0;
+}
+
+void main() {
+    ivec2 p = ivec2(gl_FragCoord.xy);
+    int face = min(p.x / u_FaceSize.x, 5);
+    float total = 0.0;
+    for (int i = 0; i < 6; i++) {
+        float current = face_current(i);
+        total += current * face_scale(i, current);
+    }
+    float scale = face_scale(face, face_current(face));
+    if (u_MaxCurrent > 0.0 && total > u_MaxCurrent) {
+        scale *= u_MaxCurrent / total;
+    }
+    vec4 color = texelFetch(u_Frame, p, 0);
+    FragColor = vec4(led_levels(color.rgb) * scale, color.a);
+}
+"""
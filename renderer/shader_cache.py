@@ -0,0 +1,113 @@
+import ctypes
+import hashlib
+import os
+import struct
+import tempfile
+
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.GL.shaders import compileShader
+
+# キャッシュファイルの先頭: binaryFormat (uint32, little endian)
+_HEADER = struct.Struct("<I")
+
+
+def compile_program(vertex_source, fragment_source, cache_dir=None):
+    """シェーダをコンパイル・リンクしてプログラムを返す
+
+    cache_dir を指定すると glGetProgramBinary で取り出したバイナリを保存し、
+    次回以降は glProgramBinary で読み込んでコンパイルを省く。
+    キーはシェーダソースとGLのベンダ/レンダラ/バージョンのハッシュ。
+    ドライバがバイナリを受け付けなければ通常のコンパイルに戻る。
+    """
+    if cache_dir is None or not glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS):
+        return _link_program(vertex_source, fragment_source)
+
+    path = os.path.join(cache_dir, program_cache_key(vertex_source, fragment_source) + ".bin")
+    program = _load_program_binary(path)
+    if program is not None:
+        return program
+
+    program = _link_program(vertex_source, fragment_source, retrievable=True)
+    _save_program_binary(path, program)
+    return program
+
+
+def program_cache_key(vertex_source, fragment_source):
+    h = hashlib.sha256()
+    for part in (vertex_source.encode(), fragment_source.encode(),
+                 glGetString(GL_VENDOR), glGetString(GL_RENDERER), glGetString(GL_VERSION)):
+        h.update(part or b"")
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _link_program(vertex_source, fragment_source, retrievable=False):
+    vs = compileShader(vertex_source, GL_VERTEX_SHADER)
+    fs = compileShader(fragment_source, GL_FRAGMENT_SHADER)
+    program = glCreateProgram()
+    if retrievable:
+        # リンク前に指定しないとバイナリを取り出せないドライバがある
+        glProgramParameteri(program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+    glAttachShader(program, vs)
+    glAttachShader(program, fs)
+    glLinkProgram(program)
+    glDeleteShader(vs)
+    glDeleteShader(fs)
+    if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+        log = glGetProgramInfoLog(program)
+        glDeleteProgram(program)
+        raise RuntimeError(f"shader link failed: {log}")
+    return program
+
+
+def _load_program_binary(path):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if len(data) <= _HEADER.size:
+        return None
+    (binary_format,) = _HEADER.unpack_from(data)
+    binary = np.frombuffer(data, dtype=np.uint8, offset=_HEADER.size)
+
+    program = glCreateProgram()
+    try:
+        glProgramBinary(program, binary_format, binary, binary.size)
+    except GLError:
+        # ドライバが対応していない binaryFormat
+        glDeleteProgram(program)
+        return None
+    # ドライバ更新などで使えないバイナリはリンク失敗として返る
+    if glGetProgramiv(program, GL_LINK_STATUS) != GL_TRUE:
+        glDeleteProgram(program)
+        return None
+    return program
+
+
+def _save_program_binary(path, program):
+    size = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+    if not size:
+        return
+    binary = np.empty(size, dtype=np.uint8)
+    length = GLsizei()
+    binary_format = GLenum()
+    glGetProgramBinary(program, size, ctypes.byref(length), ctypes.byref(binary_format), binary)
+
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # 同時に起動したプロセスが書きかけのファイルを読まないように rename で置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(binary_format.value))
+                f.write(binary[:length.value].tobytes())
+            os.replace(tmp_path, path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        # キャッシュに書けなくても描画は続ける
+        pass
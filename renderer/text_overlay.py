@@ -0,0 +1,186 @@
+import math
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from .scroll_shader import MAX_TEXTS
+
+# 曲名などの文字列を出力の面に重ねて表示する (流れる文字 = マーキー)
+# 文字は一度だけ GlyphAtlas にラスタライズし、文字列ごとに「表示する列 → アトラスの列」の表を作る。
+# シェーダはその表とスクロール量 (uniform) でアトラスを引くので、文字を流すときはスクロール量を変えるだけでよい。
+
+
+class GlyphAtlas:
+    """文字のビットマップ (8bit のアルファ) を1枚の画像に詰めたもの
+
+    各文字は高さ line_height (ascent + descent) のセルに、ベースラインを揃えて描く。
+    セルは棚詰めで並べ、足りなくなったら画像の高さを倍にする。
+    """
+
+    def __init__(self, font=None, font_size=12, size=256):
+        if font is None:
+            self.font = ImageFont.load_default(font_size)
+        elif isinstance(font, (ImageFont.ImageFont, ImageFont.FreeTypeFont)):
+            self.font = font
+        else:
+            self.font = ImageFont.truetype(font, font_size)
+        ascent, descent = self.font.getmetrics()
+        self.line_height = ascent + descent
+        self.pixels = np.zeros((max(size, self.line_height), size), dtype=np.uint8)
+        # 文字 → (アトラスの x, y, 幅)
+        self.glyphs = {}
+        self._x = 0
+        self._y = 0
+        # 文字を追加するたびに増やす (GLテクスチャの再アップロード判定用)
+        self.version = 0
+
+    def glyph(self, char):
+        cell = self.glyphs.get(char)
+        if cell is not None:
+            return cell
+        width = max(1, int(math.ceil(self.font.getlength(char))))
+        size = self.pixels.shape[1]
+        if width > size:
+            raise ValueError(f"glyph {char!r} is wider than the atlas ({width} > {size})")
+        if self._x + width > size:
+            self._x = 0
+            self._y += self.line_height
+        if self._y + self.line_height > self.pixels.shape[0]:
+            self.pixels = np.concatenate([self.pixels, np.zeros_like(self.pixels)])
+        image = Image.new("L", (width, self.line_height))
+        ImageDraw.Draw(image).text((0, 0), char, font=self.font, fill=255)
+        self.pixels[self._y:self._y + self.line_height, self._x:self._x + width] = np.asarray(image)
+        cell = self.glyphs[char] = (self._x, self._y, width)
+        self._x += width
+        self.version += 1
+        return cell
+
+    def layout(self, text):
+        """text を1行に並べたときの列ごとの (アトラスの x, セルの y) を (N, 2) の float32 で返す"""
+        columns = []
+        for char in text:
+            x, y, width = self.glyph(char)
+            columns.extend((x + i, y) for i in range(width))
+        return np.array(columns, dtype=np.float32).reshape(-1, 2)
+
+
+class TextOverlay:
+    """出力の面に重ねる文字列 (最大 MAX_TEXTS 個) の状態
+
+    ScrollRenderer.set_text() などから使う。文字列は面 face の (left, top) から幅 width の範囲に表示し、
+    収まらなければ gap の空白を挟んで循環するマーキーになる (scroll で流す)。
+    位置と大きさは出力の面内のピクセル (top は上端から)。
+    """
+
+    def __init__(self, face_size, height, font=None, font_size=12):
+        self.face_size = face_size
+        self.height = height
+        self.atlas = GlyphAtlas(font, font_size)
+        self.slots = [None] * MAX_TEXTS
+        # 文字列・位置が変わるたびに増やす (列の表の再アップロード判定用)
+        self.layout_version = 0
+
+    def set_font(self, font=None, font_size=12):
+        """フォントを変えて表示中の文字列を並べ直す"""
+        self.atlas = GlyphAtlas(font, font_size)
+        for slot, text in enumerate(self.slots):
+            if text is not None:
+                self.set_text(slot, text["text"], text["face"], text["left"], text["top"], text["max_width"],
+                              text["color"], text["scale"], text["gap"])
+                self.slots[slot]["scroll"] = text["scroll"]
+
+    def set_text(self, slot, text, face, left=0, top=0, width=None, color=(255, 255, 255, 255), scale=1,
+                 gap=None):
+        if not 0 <= slot < MAX_TEXTS:
+            raise ValueError(f"slot must be 0-{MAX_TEXTS - 1}, got {slot}")
+        if not 0 <= face < 6:
+            raise ValueError(f"face must be 0-5, got {face}")
+        if scale <= 0:
+            raise ValueError(f"scale must be positive, got {scale}")
+        left, top = int(left), int(top)
+        max_width = self.face_size - left if width is None else int(width)
+        max_width = min(max_width, self.face_size - left)
+        columns = self.atlas.layout(text)
+        marquee = len(columns) * scale > max_width
+        if marquee:
+            # 末尾と先頭の間の空白 (既定は2文字分くらい)
+            gap = self.atlas.line_height if gap is None else int(gap)
+            columns = np.concatenate([columns, np.full((gap, 2), -1, dtype=np.float32)])
+            visible = max_width
+        else:
+            visible = int(math.ceil(len(columns) * scale))
+        self.slots[slot] = {
+            "text": text, "face": face, "left": left, "top": top, "max_width": width, "width": visible,
+            "color": tuple(color), "scale": float(scale), "gap": gap, "marquee": marquee,
+            "columns": columns, "scroll": 0.0,
+        }
+        self.layout_version += 1
+
+    def set_scroll(self, slot, offset):
+        """マーキーの表示開始位置 (文字列の先頭からの列数)。値が変わったら True"""
+        text = self.slots[slot]
+        if text is None or not text["marquee"]:
+            return False
+        offset = float(offset) % len(text["columns"])
+        if offset == text["scroll"]:
+            return False
+        text["scroll"] = offset
+        return True
+
+    def clear(self, slot=None):
+        if slot is None:
+            self.slots = [None] * MAX_TEXTS
+        else:
+            self.slots[slot] = None
+        self.layout_version += 1
+
+    def active(self):
+        return [text for text in self.slots if text is not None and len(text["columns"])]
+
+    def columns_array(self):
+        """表示中の文字列の列の表を (個数, 最大の列数, 2) にまとめる (空きは -1)"""
+        active = self.active()
+        count = max((len(text["columns"]) for text in active), default=1)
+        table = np.full((max(len(active), 1), count, 2), -1, dtype=np.float32)
+        for i, text in enumerate(active):
+            table[i, :len(text["columns"])] = text["columns"]
+        return table
+
+    def uniforms(self):
+        """シェーダの u_TextRect, u_TextLayout, u_TextColor と同じ並びの (MAX_TEXTS, 4) 配列"""
+        rect = np.zeros((MAX_TEXTS, 4), dtype=np.float32)
+        layout = np.zeros((MAX_TEXTS, 4), dtype=np.float32)
+        color = np.zeros((MAX_TEXTS, 4), dtype=np.float32)
+        for i, text in enumerate(self.active()):
+            rect[i] = (text["face"], text["left"], text["top"], text["width"])
+            layout[i] = (text["scroll"], len(text["columns"]), self.atlas.line_height, text["scale"])
+            color[i] = np.array(text["color"], dtype=np.float32) / 255.0
+        return rect, layout, color
+
+    def composite(self, frame):
+        """GLSLの text_overlay() と同じ合成を (H, W*6, 4) の uint8 フレームに行う (CPUバックエンド用)"""
+        atlas = self.atlas.pixels
+        line_height = self.atlas.line_height
+        for text in self.active():
+            scale = text["scale"]
+            rows = min(int(math.ceil(line_height * scale)), self.height - text["top"])
+            cols = text["width"]
+            if rows <= 0 or cols <= 0:
+                continue
+            ty = np.floor((np.arange(rows) + 0.5) / scale).astype(np.intp)
+            rows = int(np.searchsorted(ty, line_height))
+            ty = ty[:rows]
+            px = (np.arange(cols) + 0.5) / scale
+            column = np.mod(np.floor(px + text["scroll"]), len(text["columns"])).astype(np.intp)
+            cells = text["columns"][column].astype(np.intp)
+            visible = cells[:, 0] >= 0
+            alpha = np.zeros((rows, cols), dtype=np.float32)
+            alpha[:, visible] = atlas[cells[visible, 1][None, :] + ty[:, None], cells[visible, 0][None, :]]
+            color = np.array(text["color"], dtype=np.float32) / 255.0
+            alpha *= color[3] / 255.0
+            x = text["face"] * self.face_size + text["left"]
+            region = frame[text["top"]:text["top"] + rows, x:x + cols, :3]
+            base = region.astype(np.float32) / 255.0
+            blended = base + (color[:3] - base) * alpha[..., None]
+            region[:] = np.rint(blended * 255.0).astype(np.uint8)
+        return frame
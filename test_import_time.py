@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# 描画しないモジュール (エンコーダ・キャッシュの読み出しなど) の読み込みが重くなっていないかを調べる
+# 計測は別プロセスで行い、numpy を読み込んだ後の増分だけを予算と比べる
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# 読み込み時間の予算 (秒)。いまは数十ミリ秒なので、GL などを読み込むようになれば超える
+IMPORT_BUDGET_SECONDS = 0.1
+HEAVY_MODULES = ("OpenGL", "pyglet", "glm", "PIL")
+LIGHT_MODULES = [
+    "renderer",
+    "renderer.common",
+    "renderer.scroll_cpu",
+    "renderer.remap_cache",
+    "renderer.frame_delta",
+    "renderer.led_encoder",
+    "renderer.post_process",
+    "renderer.loop_cache",
+    "renderer.multi_cube",
+    "renderer.pipeline",
+    "renderer.profiler",
+    "renderer.audio",
+    "renderer.scroll_renderer",
+]
+
+
+def _run(code):
+    result = subprocess.run([sys.executable, "-c", f"import sys; sys.path.insert(0, {ROOT!r})\n" + code],
+                            capture_output=True, text=True, check=True, cwd=ROOT)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _measure_import(module):
+    return _run(f"""
+import json, time
+import numpy
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+""")
+
+
+@pytest.mark.parametrize("module", LIGHT_MODULES)
+def test_import_does_not_load_heavy_dependencies(module):
+    assert _measure_import(module)["heavy"] == []
+
+
+@pytest.mark.parametrize("module", LIGHT_MODULES)
+def test_import_time_budget(module):
+    # 1回目はディスクキャッシュの影響を受けるので最小値で比べる
+    seconds = min(_measure_import(module)["seconds"] for _ in range(3))
+    assert seconds < IMPORT_BUDGET_SECONDS, f"import {module} took {seconds * 1e3:.1f} ms"
+
+
+def test_cpu_backend_renders_without_gl():
+    result = _run(f"""
+import json
+import numpy as np
+from renderer import create_renderer, RotationAxis
+renderer = create_renderer("cpu", 8, 8)
+renderer.set_panorama_texture(np.full((8, 48, 4), 200, dtype=np.uint8))
+renderer.rotate(RotationAxis.Y, 45)
+renderer.on_draw()
+frame = renderer.get_current_panorama_array()
+print(json.dumps({{"shape": list(frame.shape), "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+""")
+    assert result == {"shape": [8, 48, 4], "heavy": []}
+
+
+def test_cpu_multi_cube_and_profiling_without_gl():
+    result = _run(f"""
+import json
+import numpy as np
+from renderer import create_renderer, MultiCubeRenderer
+cubes = MultiCubeRenderer(2, 8, 8, backend="cpu")
+cubes.set_panorama_texture(1, np.full((8, 48, 4), 200, dtype=np.uint8))
+frames = cubes.render()
+renderer = create_renderer("cpu", 8, 8)
+renderer.enable_profiling()
+renderer.on_draw()
+renderer.disable_profiling()
+print(json.dumps({{"shape": list(frames.shape), "heavy": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+""")
+    assert result == {"shape": [2, 8, 48, 4], "heavy": []}
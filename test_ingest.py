@@ -0,0 +1,76 @@
+import gc
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from renderer.ingest import PanoramaIngest
+
+# prefetch() と get() の対応付けと、get() されずに残った prefetch() の後始末を調べる
+
+F = 4
+
+
+def _image(color):
+    return Image.new("RGB", (8, 8), color)
+
+
+def test_get_uses_prefetched_future():
+    with PanoramaIngest(F) as ingest:
+        image = _image((255, 0, 0))
+        future = ingest.prefetch(image)
+        assert ingest.prefetch(image) is future
+        assert ingest.get(image) is future.result()
+        assert ingest.stats()["pending"] == 0
+
+
+def test_reused_id_does_not_return_another_images_panorama():
+    with PanoramaIngest(F) as ingest:
+        # 待っている間は元画像を持っているので、別の画像と id() が重ならない
+        ingest.prefetch(_image((255, 0, 0)))
+        gc.collect()
+        blue = ingest.get(_image((0, 0, 255)))
+        assert blue[0, 0, :3].tolist() == [0, 0, 255]
+
+
+def test_pending_is_bounded():
+    with PanoramaIngest(F, max_pending=2) as ingest:
+        images = [_image((i, 0, 0)) for i in range(5)]
+        for image in images:
+            ingest.prefetch(image)
+        assert ingest.stats()["pending"] == 2
+        # 捨てられた prefetch() でも get() はこのスレッドで作り直して返す
+        assert ingest.get(images[0])[0, 0, 0] == 0
+
+
+def test_stale_pending_expires():
+    with PanoramaIngest(F, pending_ttl=0.05) as ingest:
+        ingest.prefetch(_image((255, 0, 0))).result()
+        time.sleep(0.1)
+        ingest.prefetch(_image((0, 255, 0)))
+        assert ingest.stats()["pending"] == 1
+
+
+def test_get_falls_back_when_prefetch_was_cancelled():
+    started = threading.Event()
+    release = threading.Event()
+    with PanoramaIngest(F, max_pending=1) as ingest:
+        build = ingest._build
+
+        def slow_build(sources):
+            started.set()
+            release.wait(3.0)
+            return build(sources)
+
+        ingest._build = slow_build
+        ingest.prefetch(_image((1, 0, 0)))
+        started.wait(3.0)
+        # ワーカーが塞がっている間に積まれた prefetch() は追い出されると取り消される
+        queued = _image((2, 0, 0))
+        future = ingest.prefetch(queued)
+        ingest.prefetch(_image((3, 0, 0)))
+        assert future.cancelled()
+        release.set()
+        ingest._build = build
+        assert np.array_equal(ingest.get(queued)[0, 0, :3], [2, 0, 0])
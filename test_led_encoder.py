@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from renderer.led_encoder import LedEncoder, PanelLayout
+
+# パネルの向き・サーペンタイン配線・rgb565 のバイト順を小さな固定値で調べる
+# pixel_order() の値は (H, W*6) のパノラマを平坦化した画素番号 (y * W*6 + x)
+
+
+def _order(panels, face_size=2, height=2, serpentine=False):
+    return PanelLayout(panels, serpentine=serpentine).pixel_order(face_size, height).tolist()
+
+
+def test_default_layout_is_face_by_face_row_major():
+    # 面0は [[0, 1], [12, 13]]、面1は [[2, 3], [14, 15]]
+    assert PanelLayout.default().pixel_order(2, 2)[:8].tolist() == [0, 1, 12, 13, 2, 3, 14, 15]
+
+
+def test_chain_order_follows_panel_list():
+    assert _order([{"face": 2}, {"face": 0}]) == [4, 5, 16, 17, 0, 1, 12, 13]
+
+
+@pytest.mark.parametrize("rotate, expected", [
+    (0, [0, 1, 12, 13]),
+    # 時計回り: 左上には元の左下が来る
+    (90, [12, 0, 13, 1]),
+    (180, [13, 12, 1, 0]),
+    (270, [1, 13, 0, 12]),
+])
+def test_rotation(rotate, expected):
+    assert _order([{"face": 0, "rotate": rotate}]) == expected
+
+
+def test_flips():
+    assert _order([{"face": 0, "flip_x": True}]) == [1, 0, 13, 12]
+    assert _order([{"face": 0, "flip_y": True}]) == [12, 13, 0, 1]
+
+
+def test_serpentine_reverses_odd_rows():
+    # 面0 (3x3) は [[0, 1, 2], [18, 19, 20], [36, 37, 38]]
+    assert _order([{"face": 0}], face_size=3, height=3, serpentine=True) == [0, 1, 2, 20, 19, 18, 36, 37, 38]
+
+
+def test_serpentine_applies_after_rotation():
+    assert _order([{"face": 0, "rotate": 90}], serpentine=True) == [12, 0, 1, 13]
+
+
+def test_invalid_layouts():
+    with pytest.raises(ValueError):
+        PanelLayout([{"face": 6}])
+    with pytest.raises(ValueError):
+        PanelLayout([{"face": 0, "rotate": 45}])
+    with pytest.raises(ValueError):
+        PanelLayout([{"face": 0, "rotate": 90}]).pixel_order(2, 3)
+
+
+def _frame(colors):
+    """面0の左上から順に colors を置いた 1x1 面のフレーム"""
+    frame = np.zeros((1, 6, 4), dtype=np.uint8)
+    frame[0, :len(colors), :3] = colors
+    return frame
+
+
+def test_rgb888_applies_lut_in_chain_order():
+    layout = PanelLayout([{"face": 1}, {"face": 0}])
+    encoder = LedEncoder(1, 1, layout, gamma=1.0, brightness=0.5)
+    encoded = encoder.encode(_frame([(255, 100, 0), (10, 20, 30)]))
+    assert encoded.tolist() == [5, 10, 15, 128, 50, 0]
+    assert encoder.frame_bytes == 6
+
+
+@pytest.mark.parametrize("byteorder, expected", [
+    ("little", [0x00, 0xF8, 0xE0, 0x07, 0x1F, 0x00, 0xFF, 0xFF]),
+    ("big", [0xF8, 0x00, 0x07, 0xE0, 0x00, 0x1F, 0xFF, 0xFF]),
+])
+def test_rgb565_byte_order(byteorder, expected):
+    layout = PanelLayout([{"face": face} for face in range(4)])
+    encoder = LedEncoder(1, 1, layout, color_format="rgb565", gamma=1.0, byteorder=byteorder)
+    frame = _frame([(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255)])
+    assert encoder.encode(frame).tolist() == expected
+    assert encoder.frame_bytes == 8
+
+
+def test_encode_into_out():
+    encoder = LedEncoder(1, 1, gamma=1.0)
+    out = np.empty(encoder.frame_bytes, dtype=np.uint8)
+    assert encoder.encode(_frame([(1, 2, 3)]), out=out) is out
+    assert out[:3].tolist() == [1, 2, 3]
@@ -0,0 +1,39 @@
+import numpy as np
+
+from renderer import create_renderer, LoopCache, RotationAxis
+
+# レンダラなしの LoopCache.open() と、load() が表示中のパノラマを変えないことを調べる
+
+F = 8
+
+
+def _panorama(seed):
+    return np.random.default_rng(seed).integers(0, 256, (F, F * 6, 4), dtype=np.uint8)
+
+
+def test_open_without_renderer(tmp_path):
+    cache = LoopCache(str(tmp_path))
+    art = _panorama(0)
+    assert cache.open(art, RotationAxis.Y, 90, F, F, backend="cpu") is None
+
+    renderer = create_renderer("cpu", F, F)
+    loaded = cache.load(renderer, art, RotationAxis.Y, 90)
+    playback = cache.open(art, RotationAxis.Y, 90, F, F, backend="cpu")
+    assert playback is not None and playback.path == loaded.path
+    np.testing.assert_array_equal(playback.frame(180), loaded.frame(180))
+    # キーには描画したバックエンドが入る
+    assert cache.open(art, RotationAxis.Y, 90, F, F, backend="gl") is None
+    assert cache.open(art, RotationAxis.X, 90, F, F, backend="cpu") is None
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_load_keeps_the_live_panorama(tmp_path):
+    renderer = create_renderer("cpu", F, F)
+    renderer.set_panorama_texture(_panorama(1))
+    renderer.on_draw()
+    before = renderer.get_current_panorama_array().copy()
+    version = renderer.content_version
+    LoopCache(str(tmp_path)).load(renderer, _panorama(2), RotationAxis.Z, 45)
+    renderer.on_draw()
+    np.testing.assert_array_equal(renderer.get_current_panorama_array(), before)
+    assert renderer.content_version == version
@@ -0,0 +1,70 @@
+import threading
+
+import numpy as np
+import pytest
+
+from renderer.pipeline import FrameQueue, PipelineRunner
+
+# 描画・出力スレッドの止め方 (例外・stop()) でデッドロックしないかを調べる
+# 止まらなかったときにテスト全体が固まらないよう、run() は別スレッドで動かして join にタイムアウトを付ける
+
+SHAPE = (2, 12, 4)
+
+
+def _render(dt):
+    _render.count += 1
+    return _render.count, np.zeros(SHAPE, dtype=np.uint8)
+
+
+def _run_in_thread(runner, fps, duration):
+    result = {}
+
+    def target():
+        try:
+            runner.run(fps, duration=duration)
+        except Exception as error:
+            result["error"] = error
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread, result
+
+
+def test_output_error_stops_run():
+    _render.count = 0
+
+    def output(frame_index, frame):
+        if frame_index == 2:
+            raise OSError("sink closed")
+
+    runner = PipelineRunner(_render, output, SHAPE, capacity=2, policy="block")
+    runner.start()
+    thread, result = _run_in_thread(runner, 100, 1.0)
+    thread.join(3.0)
+    assert not thread.is_alive()
+    assert isinstance(result["error"], RuntimeError)
+    assert isinstance(result["error"].__cause__, OSError)
+    runner.stop()
+    with pytest.raises(RuntimeError):
+        runner.tick()
+
+
+def test_stop_ends_unbounded_run():
+    _render.count = 0
+    runner = PipelineRunner(_render, lambda frame_index, frame: None, SHAPE)
+    runner.start()
+    thread, result = _run_in_thread(runner, 100, None)
+    thread.join(0.2)
+    assert thread.is_alive()
+    runner.stop()
+    thread.join(3.0)
+    assert not thread.is_alive()
+    assert result == {}
+
+
+def test_block_policy_put_returns_after_close():
+    queue = FrameQueue(1, SHAPE, policy="block")
+    frame = np.zeros(SHAPE, dtype=np.uint8)
+    assert queue.put(0, frame)
+    threading.Timer(0.1, queue.close).start()
+    assert queue.put(1, frame) is False
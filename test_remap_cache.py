@@ -0,0 +1,66 @@
+import pytest
+
+from renderer.remap_cache import RemapTableCache
+
+# remapテーブルのキャッシュの量子化・LRUの順序・削除数を調べる
+
+
+def _table_bytes(face_size=4, height=4):
+    index, weight = RemapTableCache().get(1, 0, face_size, height)
+    return index.nbytes + weight.nbytes
+
+
+def test_quantize_wraps_and_snaps():
+    cache = RemapTableCache()
+    assert cache.quantize(360) == 0
+    assert cache.quantize(-90) == 270
+    # 丸め誤差で 360 - ε が別のキーにならない
+    assert cache.quantize(359.9999999) == 0
+    stepped = RemapTableCache(angle_step=5)
+    assert stepped.quantize(12.4) == 10
+    assert stepped.quantize(12.6) == 15
+    assert stepped.quantize(358) == 0
+
+
+def test_invalid_angle_step():
+    with pytest.raises(ValueError):
+        RemapTableCache(angle_step=0)
+
+
+def test_hits_share_the_quantized_table():
+    cache = RemapTableCache(angle_step=5)
+    first = cache.get(1, 10, 4, 4)
+    assert cache.get(1, 11, 4, 4) is first
+    assert cache.get(1, 370, 4, 4) is first
+    assert cache.get(0, 10, 4, 4) is not first
+    assert cache.get(1, 10, 8, 4) is not first
+    assert cache.stats() == {"entries": 3, "bytes": cache.nbytes, "hits": 2, "misses": 3, "evictions": 0}
+
+
+def test_lru_evicts_least_recently_used():
+    size = _table_bytes()
+    cache = RemapTableCache(max_bytes=size * 2)
+    a = cache.get(1, 0, 4, 4)
+    cache.get(1, 90, 4, 4)
+    # 0度を使い直したので、次に追い出されるのは90度
+    assert cache.get(1, 0, 4, 4) is a
+    cache.get(1, 180, 4, 4)
+    assert len(cache) == 2 and cache.evictions == 1 and cache.nbytes == size * 2
+    assert cache.get(1, 0, 4, 4) is a
+    misses = cache.misses
+    cache.get(1, 90, 4, 4)
+    assert cache.misses == misses + 1
+    assert cache.evictions == 2
+
+
+def test_table_larger_than_budget_is_not_kept():
+    cache = RemapTableCache(max_bytes=_table_bytes() - 1)
+    cache.get(1, 0, 4, 4)
+    assert len(cache) == 0 and cache.nbytes == 0 and cache.evictions == 0
+
+
+def test_clear_resets_bytes():
+    cache = RemapTableCache()
+    cache.get(1, 0, 4, 4)
+    cache.clear()
+    assert len(cache) == 0 and cache.nbytes == 0
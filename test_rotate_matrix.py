@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from renderer import create_renderer
+from renderer.face_table import axis_rotation, match_axis_rotation, SCROLL_MISMATCH
+
+# rotate_matrix() がスクロール描画に寄せる回転と、連続した回転での見た目の連続性を調べる
+
+F = 16
+
+
+@pytest.fixture
+def renderer():
+    # 隣の角度との差が小さくなるように、なめらかなグラデーションのパノラマを使う
+    y, x = np.mgrid[0:F, 0:F * 6].astype(np.float64)
+    panorama = np.stack([128 + 100 * np.sin(x / 7.0), 128 + 100 * np.sin(y / 4.0 + x / 11.0),
+                         128 + 100 * np.cos(x / 5.0 - y / 3.0), np.full_like(x, 255)], axis=-1).astype(np.uint8)
+    renderer = create_renderer("cpu", F, F)
+    renderer.set_panorama_texture(panorama)
+    yield renderer
+    renderer.cleanup()
+
+
+def _frame(renderer, matrix):
+    renderer.rotate_matrix(matrix)
+    renderer.on_draw()
+    return renderer.get_current_panorama_array().astype(np.int32)
+
+
+@pytest.mark.parametrize("axis", range(3))
+@pytest.mark.parametrize("degree", (0, 90, 180, 270))
+def test_snapped_rotations_match_the_resample(renderer, axis, degree):
+    matrix = axis_rotation(axis, degree)
+    if (axis, degree) in SCROLL_MISMATCH:
+        assert match_axis_rotation(matrix) is None
+        return
+    # 0度 (単位行列) はどの軸でも同じなので最初の軸に寄る
+    assert match_axis_rotation(matrix) == ((0, 0) if degree == 0 else (axis, degree))
+    scroll = _frame(renderer, matrix)
+    assert renderer.rotation is None
+    resampled = renderer.cpu_renderer.render_rotation(matrix)
+    np.testing.assert_array_equal(scroll, resampled)
+
+
+@pytest.mark.parametrize("axis", range(3))
+def test_tumble_is_continuous_across_half_turn(renderer, axis):
+    frames = [_frame(renderer, axis_rotation(axis, degree)) for degree in range(170, 192, 2)]
+    # 180度の前後だけ大きく変わる (1フレーム飛ぶ) 面がない。飛ぶのは1面だけなので面ごとに比べる
+    for face in range(6):
+        columns = slice(face * F, (face + 1) * F)
+        steps = [np.abs(b[:, columns] - a[:, columns]).mean() for a, b in zip(frames, frames[1:])]
+        assert max(steps) < 4 * np.median(steps), f"face {face}: {np.round(steps, 1)}"
+
+
+def test_composed_quarter_turns_equal_half_turn(renderer):
+    half = _frame(renderer, axis_rotation(2, 90) @ axis_rotation(2, 90))
+    np.testing.assert_array_equal(half, _frame(renderer, axis_rotation(2, 180)))
+    np.testing.assert_array_equal(half, renderer.cpu_renderer.render_rotation(axis_rotation(2, 180)))
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from renderer import create_renderer
+from renderer.scroll_cpu import CpuPanoramaRenderer
+from renderer.face_table import MODES
+
+# CPUバックエンドの描画を face_table の隣接表から決まる結果と比べる
+# 90度単位ではテクセルの中心をちょうどサンプルするので、面の入れ替わりは画素単位で一致する
+
+F = 8
+
+
+def _faces(frame):
+    return [frame[:, i * F:(i + 1) * F] for i in range(6)]
+
+
+@pytest.fixture
+def panorama():
+    pixels = np.random.default_rng(0).integers(0, 256, (F, F * 6, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    return pixels
+
+
+@pytest.fixture
+def solid():
+    """面ごとに単色のパノラマ (面の境目でにじむと別の色が混ざる)"""
+    colors = np.array([(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255), (255, 0, 255)])
+    pixels = np.full((F, F * 6, 4), 255, dtype=np.uint8)
+    for face, color in enumerate(colors):
+        pixels[:, face * F:(face + 1) * F, :3] = color
+    return pixels
+
+
+def _render(pixels, axis, degree):
+    renderer = CpuPanoramaRenderer(F, F)
+    renderer.set_panorama(pixels)
+    return renderer.render(axis, degree)
+
+
+@pytest.mark.parametrize("axis", sorted(MODES))
+def test_zero_and_full_turn_are_identity(panorama, axis):
+    np.testing.assert_array_equal(_render(panorama, axis, 0), panorama)
+    # スクロール量が4で一周して0に戻る点
+    np.testing.assert_array_equal(_render(panorama, axis, 360), panorama)
+
+
+@pytest.mark.parametrize("axis", sorted(MODES))
+def test_scroll_wraps_modulo_a_turn(panorama, axis):
+    np.testing.assert_array_equal(_render(panorama, axis, 450), _render(panorama, axis, 90))
+    np.testing.assert_array_equal(_render(panorama, axis, -90), _render(panorama, axis, 270))
+
+
+def test_y_ring_shifts_by_one_face_per_quarter_turn(panorama):
+    # Y: ring (1, 2, 3, 4) は rel = lu + scroll で、移動先の面内座標は (f, lv) のまま
+    ring = MODES[1]["ring"]
+    for quarter in range(4):
+        out = _faces(_render(panorama, 1, quarter * 90))
+        src = _faces(panorama)
+        for position, face in enumerate(ring):
+            np.testing.assert_array_equal(out[face], src[ring[(position + quarter) % 4]])
+
+
+def test_x_ring_quarter_turn_follows_transitions(panorama):
+    # X: top は k=+1, seg=+1 で front へ移り、(0, 1) は180度回転。front/bottom は k=-1, seg=-1 でも
+    # 位置は +1 進み (front→bottom, bottom→back)、back は +1 で top へ移る (どちらも180度回転)
+    out = _faces(_render(panorama, 0, 90))
+    src = _faces(panorama)
+    np.testing.assert_array_equal(out[0], src[1][::-1, ::-1])
+    np.testing.assert_array_equal(out[1], src[5])
+    np.testing.assert_array_equal(out[5], src[3][::-1, ::-1])
+    np.testing.assert_array_equal(out[3], src[0])
+
+
+@pytest.mark.parametrize("axis", sorted(MODES))
+def test_rotating_faces_turn_in_place(panorama, axis):
+    out = _faces(_render(panorama, axis, 90))
+    half = _faces(_render(panorama, axis, 180))
+    src = _faces(panorama)
+    for face, sign in MODES[axis]["rotate"].items():
+        # 符号が正の面は出力が時計回りに回る (画像の行0が上)
+        np.testing.assert_array_equal(out[face], np.rot90(src[face], -int(sign)))
+        np.testing.assert_array_equal(half[face], np.rot90(src[face], 2))
+
+
+@pytest.mark.parametrize("axis", sorted(MODES))
+def test_face_seams_do_not_bleed(solid, axis):
+    # 45度では出力の面の中央で隣の面に切り替わる。境目の両側のテクセルは隣の面の色を混ぜない
+    out = _render(solid, axis, 45)
+    colors = {tuple(solid[0, face * F, :3]) for face in range(6)}
+    ring = MODES[axis]["ring"]
+    for face in ring:
+        pixels = {tuple(p) for p in out[:, face * F:(face + 1) * F, :3].reshape(-1, 3)}
+        assert len(pixels) == 2 and pixels <= colors
+
+
+def test_cpu_backend_accepts_headless():
+    # バックエンドに関係なく headless=True を渡す呼び出し側でも cleanup() できる
+    renderer = create_renderer("cpu", F, F, headless=True)
+    renderer.on_draw()
+    renderer.cleanup()
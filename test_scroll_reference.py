@@ -0,0 +1,144 @@
+import math
+
+import numpy as np
+import pytest
+
+from renderer.face_table import MODES
+from renderer.scroll_cpu import CpuPanoramaRenderer, apply_remap_table, panorama_uv, remap_table_from_uv
+
+# 隣接表 (face_table) による描画を、表にする前の PANORAMA_FRAGMENT_SHADER の分岐をそのまま移した
+# 参照実装と比べる。90度単位だけでなく、面の途中で切り替わる 45度・135度なども調べる
+
+F = 8
+FW = 1.0 / 6.0
+
+
+def _rotate(local_u, local_v, angle, base):
+    rel_u, rel_v = local_u - 0.5, local_v - 0.5
+    cos_a, sin_a = math.cos(angle), math.sin(angle)
+    return ((rel_u * cos_a - rel_v * sin_a + 0.5) * FW + base,
+            rel_u * sin_a + rel_v * cos_a + 0.5)
+
+
+def _reference_y(u, v, angle, scroll):
+    if u < FW:
+        return _rotate(u / FW, v, angle, 0.0)
+    if u >= 5 * FW:
+        return _rotate((u - 5 * FW) / FW, v, -angle, 5 * FW)
+    rel = ((u - FW) / (4 * FW) + scroll / 4) % 1.0
+    return FW + rel * 4 * FW, v
+
+
+# X軸: 0:top 1:front 2:bottom 3:back の間を移ったときに180度回すかどうか
+_X_FLIP = [
+    (False, True, True, False),
+    (True, False, False, True),
+    (True, False, False, True),
+    (False, True, True, False),
+]
+_X_BASE = (0.0, FW, 5 * FW, 3 * FW)
+
+
+def _reference_x(u, v, angle, scroll):
+    if 2 * FW <= u < 3 * FW:
+        return _rotate((u - 2 * FW) / FW, v, angle, 2 * FW)
+    if 4 * FW <= u < 5 * FW:
+        return _rotate((u - 4 * FW) / FW, v, -angle, 4 * FW)
+    if u < FW:
+        face, local_u = 0, u / FW
+    elif u < 2 * FW:
+        face, local_u = 1, (u - FW) / FW
+    elif u < 4 * FW:
+        face, local_u = 3, (u - 3 * FW) / FW
+    else:
+        face, local_u = 2, (u - 5 * FW) / FW
+    if face in (0, 3):
+        rel = v + scroll
+        seg = math.floor(rel)
+        frac = rel - seg
+    else:
+        rel = v - scroll
+        seg = -math.floor(rel)
+        frac = rel + seg
+    new_face = (face + seg) % 4
+    if _X_FLIP[face][new_face]:
+        local_u, frac = 1 - local_u, 1 - frac
+    return local_u * FW + _X_BASE[new_face], frac
+
+
+def _reference_z(u, v, angle, scroll):
+    if FW <= u < 2 * FW:
+        return _rotate((u - FW) / FW, v, angle, FW)
+    if 3 * FW <= u < 4 * FW:
+        return _rotate((u - 3 * FW) / FW, v, -angle, 3 * FW)
+    # 0:top 1:right 2:bottom 3:left
+    if u < FW:
+        face, lu = 0, u / FW
+    elif u < 3 * FW:
+        face, lu = 1, (u - 2 * FW) / FW
+    elif u < 5 * FW:
+        face, lu = 3, (u - 4 * FW) / FW
+    else:
+        face, lu = 2, (u - 5 * FW) / FW
+    lv = v
+    rel = (lu, lv, lu, 1 - lv)[face] + scroll
+    seg = -math.floor(rel)
+    frac = rel + seg
+    new_face = (face + seg) % 4
+    # (new_u, new_v, 移動先の面の左端, 180度回すか)
+    new_u, new_v, base, flip = {
+        (0, 0): (frac, lv, 0, False), (0, 1): (1 - lv, frac, 2, False),
+        (0, 2): (1 - frac, 1 - lv, 5, True), (0, 3): (lv, 1 - frac, 4, False),
+        (1, 0): (1 - frac, lu, 0, True), (1, 1): (lu, frac, 2, False),
+        (1, 2): (frac, 1 - lu, 5, False), (1, 3): (lu, 1 - frac, 4, False),
+        (2, 0): (1 - frac, 1 - lv, 0, True), (2, 1): (lv, 1 - frac, 2, True),
+        (2, 2): (frac, lv, 5, False), (2, 3): (1 - lv, frac, 4, True),
+        (3, 0): (1 - frac, 1 - lu, 0, True), (3, 1): (lu, 1 - frac, 2, True),
+        (3, 2): (frac, lu, 5, False), (3, 3): (1 - lu, frac, 4, True),
+    }[face, new_face]
+    if flip:
+        new_u, new_v = 1 - new_u, 1 - new_v
+    return new_u * FW + base * FW, new_v
+
+
+_REFERENCE = {0: _reference_x, 1: _reference_y, 2: _reference_z}
+
+
+def _reference_uv(axis, degree):
+    """シェーダと同じく出力のピクセル中心 (vは下→上) ごとにuvを求める。配列は行0が上"""
+    angle = math.radians(degree)
+    scroll = (degree / 90.0) % 4.0
+    out_u = np.empty((F, F * 6), dtype=np.float32)
+    out_v = np.empty((F, F * 6), dtype=np.float32)
+    for row in range(F):
+        v = 1.0 - (row + 0.5) / F
+        for column in range(F * 6):
+            out_u[row, column], out_v[row, column] = _REFERENCE[axis]((column + 0.5) / (F * 6), v, angle, scroll)
+    return out_u, out_v
+
+
+@pytest.fixture(scope="module")
+def panorama():
+    pixels = np.random.default_rng(1).integers(0, 256, (F, F * 6, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    return pixels
+
+
+@pytest.mark.parametrize("degree", [45, 90, 135, 270, 330])
+@pytest.mark.parametrize("axis", sorted(MODES))
+def test_uv_matches_reference(axis, degree):
+    u, v = panorama_uv(axis, math.radians(degree), (degree / 90.0) % 4.0, F, F)
+    ref_u, ref_v = _reference_uv(axis, degree)
+    np.testing.assert_allclose(u, ref_u, atol=1e-6)
+    np.testing.assert_allclose(v, ref_v, atol=1e-6)
+
+
+@pytest.mark.parametrize("degree", [45, 90, 135, 270, 330])
+@pytest.mark.parametrize("axis", sorted(MODES))
+def test_frame_matches_reference(panorama, axis, degree):
+    renderer = CpuPanoramaRenderer(F, F)
+    renderer.set_panorama(panorama)
+    expected = apply_remap_table(panorama, *remap_table_from_uv(*_reference_uv(axis, degree), F, F))
+    diff = np.abs(renderer.render(axis, degree).astype(np.int16) - expected)
+    # 回転する面は float32 と float64 の cos/sin の差で重みの丸めが変わることがある
+    assert diff.max() <= 1